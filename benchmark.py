@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmarks for compiler.py
+
+Usage: python benchmark.py [benchmark] [options]
+
+Benchmarks:
+    lexer           throughput of the lexer engines, in MB/s
+    tokens          memory of a Token list against the compact token store
+    tree            time to build wide Sentence blocks and long ConstantList initializers
+    arena           time and memory of the linked and the arena syntax tree backends
+    expression      time and allocations of the expression parser against the reverse polish one
+    walk            time to display and assemble a large syntax tree and a deeply nested expression
+    incremental     time to re-lex and re-parse after a one-character edit against a full rebuild
+    codegen         time and instruction count of the syntax tree and the three-address code backends
+    cfg             time to build the control flow graph and dominator tree as the function grows
+    dataflow        time to solve liveness, reaching definitions and available expressions as the function grows
+    dce             instructions and data definitions left with and without dead code elimination, and its time
+
+Options:
+    -h, --help      show help
+    -n repeat       how many times the statements of source.c are repeated, default 2000
+
+Examples:
+    python benchmark.py lexer -n 5000
+'''
+
+import gc
+import os
+import sys
+import time
+import getopt
+
+import compiler
+
+# source.c的路径
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'source.c')
+
+
+# 将source.c中main函数的语句重复repeat次，生成一个很大的c文件
+def generate_source(repeat):
+    source = open(SOURCE_PATH, 'r').read()
+    start = source.index('printf(')
+    end = source.index('return 0;')
+    return source[:start] + source[start:end] * repeat + source[end:]
+
+
+# 多次运行func，返回最快的一次所用的时间
+def best_time(func, times=3):
+    best = None
+    for i in range(times):
+        start = time.time()
+        func()
+        cost = time.time() - start
+        if best is None or cost < best:
+            best = cost
+    return best
+
+
+# 词法分析引擎的吞吐量
+def bench_lexer(repeat):
+    source = generate_source(repeat)
+    size = len(source) / 1024.0 / 1024.0
+    print 'source size: %.2f MB' % size
+    results = {}
+    for engine in ['char', 'regex']:
+        lexers = []
+
+        def run():
+            lexers.append(compiler.Lexer(source, engine))
+            lexers[-1].main()
+        cost = best_time(run)
+        results[engine] = [(token.type, token.value) for token in lexers[-1].tokens]
+        print '%-6s %8.3f s %8.2f MB/s' % (engine, cost, size / cost)
+    if results['char'] != results['regex']:
+        print 'error: token streams of the two engines differ!'
+        exit()
+
+
+# Token列表和紧凑token序列所占的内存
+def bench_tokens(repeat):
+    lexer = compiler.Lexer(generate_source(repeat))
+    lexer.main()
+    # 列表本身、Token对象、对象的__dict__和token的值
+    size = sys.getsizeof(lexer.tokens)
+    for token in lexer.tokens:
+        size += sys.getsizeof(token) + sys.getsizeof(token.__dict__) + sys.getsizeof(token.value)
+    compact = lexer.compact_tokens()
+    compact_size = sum(sys.getsizeof(item) for item in [compact.types, compact.starts, compact.ends, compact.partners])
+    print 'tokens:  %d' % len(lexer.tokens)
+    print 'Token:   %8.2f MB' % (size / 1024.0 / 1024.0)
+    print 'compact: %8.2f MB' % (compact_size / 1024.0 / 1024.0)
+    print 'ratio:   %8.1f' % (float(size) / compact_size)
+    for i, token in enumerate(lexer.tokens):
+        if token.type != compact[i].type or token.value != compact[i].value:
+            print 'error: compact token %d differs!' % i
+            exit()
+
+
+# 有width条语句的main函数
+def wide_block_source(width):
+    return 'int main() {\n    int x;\n' + '    x = 1;\n' * width + '}\n'
+
+
+# 数组初始化列表中有width个常数的main函数
+def long_list_source(width):
+    return 'int main() {\n    int a[%d] = {%s};\n}\n' % (width, ', '.join(['1'] * width))
+
+
+# 构建语法树所用的时间随规模的变化，线性时每个节点所用的时间应该基本不变
+def bench_tree(repeat):
+    for name, generate in [('Sentence', wide_block_source), ('ConstantList', long_list_source)]:
+        for width in [repeat, repeat * 2, repeat * 4, repeat * 8]:
+            tokens = compiler.Lexer(generate(width)).compact_tokens()
+
+            def run():
+                compiler.Parser(tokens=tokens).main()
+            cost = best_time(run)
+            print '%-12s width %7d %8.3f s %8.2f us/item' % (name, width, cost, cost / width * 1e6)
+
+
+# 链接的语法树中所有节点所占的内存，不包括extra_info
+def node_tree_size(root):
+    size = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        size += sys.getsizeof(node)
+        child = node.first_son
+        while child:
+            stack.append(child)
+            child = child.right
+    return size
+
+
+# 两种语法树存储方式的构建时间和内存
+def bench_arena(repeat):
+    tokens = compiler.Lexer(generate_source(repeat)).compact_tokens()
+    for backend in ['node', 'arena']:
+        parsers = []
+
+        def run():
+            parsers.append(compiler.Parser(tokens=tokens, backend=backend))
+            parsers[-1].main()
+        cost = best_time(run)
+        parser = parsers[-1]
+        if parser.arena is None:
+            size = node_tree_size(parser.tree.root)
+        else:
+            arena = parser.arena
+            size = sum(sys.getsizeof(item) for item in [
+                arena.values, arena.types, arena.fathers, arena.lefts, arena.rights,
+                arena.first_sons, arena.last_sons, arena.strings, arena.string_ids])
+        # 树还存在时一次完整垃圾回收所用的时间
+        gc_cost = best_time(gc.collect)
+        print '%-6s build %8.3f s %8.2f MB  gc %8.3f s' % (backend, cost, size / 1024.0 / 1024.0, gc_cost)
+        del parsers[:]
+
+
+class RPNParser(compiler.Parser):
+    '''用原来的逆波兰表达式实现分析表达式的语法分析器'''
+
+    # 原来先转为逆波兰表达式再建树的实现
+    def _expression(self, father=None, index=None):
+        if not father:
+            father = self.tree.root
+        # 运算符优先级
+        operator_priority = {'>': 0, '<': 0, '>=': 0, '<=': 0,
+                             '+': 1, '-': 1, '*': 2, '/': 2, '++': 3, '--': 3, '!': 3}
+        # 运算符栈
+        operator_stack = []
+        # 转换成的逆波兰表达式结果
+        reverse_polish_expression = []
+        # 中缀表达式转为后缀表达式，即逆波兰表达式
+        while self.tokens[self.index].type != 'SEMICOLON':
+            if index and self.index >= index:
+                break
+            # 如果是常量
+            if self.tokens[self.index].type == 'DIGIT_CONSTANT':
+                tree = compiler.SyntaxTree()
+                tree.current = tree.root = self.new_node(
+                    'Expression', 'Constant')
+                tree.add_child_node(
+                    self.new_node(self.tokens[self.index].value, '_Constant'))
+                reverse_polish_expression.append(tree)
+            # 如果是变量或者数组的某元素
+            elif self.tokens[self.index].type == 'IDENTIFIER':
+                # 变量
+                if self.tokens[self.index + 1].value in compiler.operators or self.tokens[self.index + 1].type == 'SEMICOLON':
+                    tree = compiler.SyntaxTree()
+                    tree.current = tree.root = self.new_node(
+                        'Expression', 'Variable')
+                    tree.add_child_node(
+                        self.new_node(self.tokens[self.index].value, '_Variable'))
+                    reverse_polish_expression.append(tree)
+                # 数组的某一个元素ID[i]
+                elif self.tokens[self.index + 1].type == 'LM_BRACKET':
+                    tree = compiler.SyntaxTree()
+                    tree.current = tree.root = self.new_node(
+                        'Expression', 'ArrayItem')
+                    # 数组的名字
+                    tree.add_child_node(
+                        self.new_node(self.tokens[self.index].value, '_ArrayName'))
+                    self.index += 2
+                    if self.tokens[self.index].type != 'DIGIT_CONSTANT' and self.tokens[self.index].type != 'IDENTIFIER':
+                        print 'error: 数组下表必须为常量或标识符'
+                        print self.tokens[self.index].type
+                        exit()
+                    else:
+                        # 数组下标
+                        tree.add_child_node(
+                            self.new_node(self.tokens[self.index].value, '_ArrayIndex'), tree.root)
+                        reverse_polish_expression.append(tree)
+            # 如果是运算符
+            elif self.tokens[self.index].value in compiler.operators or self.tokens[self.index].type == 'LL_BRACKET' or self.tokens[self.index].type == 'RL_BRACKET':
+                tree = compiler.SyntaxTree()
+                tree.current = tree.root = self.new_node(
+                    'Operator', 'Operator')
+                tree.add_child_node(
+                    self.new_node(self.tokens[self.index].value, '_Operator'))
+                # 如果是左括号，直接压栈
+                if self.tokens[self.index].type == 'LL_BRACKET':
+                    operator_stack.append(tree.root)
+                # 如果是右括号，弹栈直到遇到左括号为止
+                elif self.tokens[self.index].type == 'RL_BRACKET':
+                    while operator_stack and operator_stack[-1].current.type != 'LL_BRACKET':
+                        reverse_polish_expression.append(operator_stack.pop())
+                    # 将左括号弹出来
+                    if operator_stack:
+                        operator_stack.pop()
+                # 其他只能是运算符
+                else:
+                    while operator_stack and operator_priority[tree.current.value] < operator_priority[operator_stack[-1].current.value]:
+                        reverse_polish_expression.append(operator_stack.pop())
+                    operator_stack.append(tree)
+            self.index += 1
+        # 最后将符号栈清空，最终得到逆波兰表达式reverse_polish_expression
+        while operator_stack:
+            reverse_polish_expression.append(operator_stack.pop())
+        # 打印
+        # for item in reverse_polish_expression:
+        #   print item.current.value,
+        # print
+
+        # 操作数栈
+        operand_stack = []
+        child_operators = [['!', '++', '--'], [
+            '+', '-', '*', '/', '>', '<', '>=', '<=']]
+        for item in reverse_polish_expression:
+            if item.root.type != 'Operator':
+                operand_stack.append(item)
+            else:
+                # 处理单目运算符
+                if item.current.value in child_operators[0]:
+                    a = operand_stack.pop()
+                    new_tree = compiler.SyntaxTree()
+                    new_tree.current = new_tree.root = self.new_node(
+                        'Expression', 'SingleOperand')
+                    # 添加操作符
+                    new_tree.add_child_node(item.root)
+                    # 添加操作数
+                    new_tree.add_child_node(a.root, new_tree.root)
+                    operand_stack.append(new_tree)
+                # 双目运算符
+                elif item.current.value in child_operators[1]:
+                    b = operand_stack.pop()
+                    a = operand_stack.pop()
+                    new_tree = compiler.SyntaxTree()
+                    new_tree.current = new_tree.root = self.new_node(
+                        'Expression', 'DoubleOperand')
+                    # 第一个操作数
+                    new_tree.add_child_node(a.root)
+                    # 操作符
+                    new_tree.add_child_node(item.root, new_tree.root)
+                    # 第二个操作数
+                    new_tree.add_child_node(b.root, new_tree.root)
+                    operand_stack.append(new_tree)
+                else:
+                    print 'operator %s not supported!' % item.current.value
+                    exit()
+        self.tree.add_child_node(operand_stack[0].root, father)
+
+
+# 每条赋值语句的表达式中有width个操作数的main函数
+def long_expression_source(count, width):
+    operands = ['x', '2', 'a[i]', 'i']
+    operators = ['+', '*', '-', '/']
+    expression = operands[0]
+    for i in range(1, width):
+        expression += ' %s %s' % (operators[i % len(operators)], operands[i % len(operands)])
+    return 'int main() {\n    int x;\n' + ('    x = %s;\n' % expression) * count + '}\n'
+
+
+# 两种表达式分析方法所用的时间、建立的节点数和SyntaxTree对象数
+def bench_expression(repeat):
+    tokens = compiler.Lexer(long_expression_source(repeat / 10 or 1, 100)).compact_tokens()
+    tree_class = compiler.SyntaxTree
+    for name, parser_class in [('rpn', RPNParser), ('pratt', compiler.Parser)]:
+        counts = {'node': 0, 'tree': 0}
+
+        class CountingTree(tree_class):
+            def __init__(self):
+                counts['tree'] += 1
+                tree_class.__init__(self)
+
+        def new_node(*args):
+            counts['node'] += 1
+            return compiler.SyntaxTreeNode(*args)
+
+        def run():
+            parser_class(tokens=tokens).main()
+        cost = best_time(run)
+        # 统计一次分析中的分配
+        compiler.SyntaxTree = CountingTree
+        try:
+            parser = parser_class(tokens=tokens)
+            parser.new_node = new_node
+            parser.main()
+        finally:
+            compiler.SyntaxTree = tree_class
+        print '%-6s %8.3f s  nodes %8d  SyntaxTree %8d' % (name, cost, counts['node'], counts['tree'])
+
+
+# 有depth个加数的表达式，语法树的深度和depth成正比
+def deep_expression_source(depth):
+    return 'int main() {\n    int x;\n    x = %s;\n}\n' % ' + '.join(['1'] * depth)
+
+
+# 遍历语法树打印和生成汇编所用的时间，深度超过递归限制的语法树也可以遍历
+def bench_walk(repeat):
+    for name, source in [('large', generate_source(repeat)), ('deep', deep_expression_source(repeat))]:
+        session = compiler.CompilationSession(source)
+        tree = session.tree
+        nodes = sum(1 for node in compiler.SyntaxTree.preorder(tree.root))
+
+        def display():
+            for line in compiler.Parser.display_lines(tree.root):
+                pass
+
+        def assemble():
+            compiler.Assembler(tree).traverse(tree.root)
+        display_cost = best_time(display)
+        assemble_cost = best_time(assemble)
+        print '%-6s nodes %8d  display %8.3f s  assemble %8.3f s  recursion limit %d' % (
+            name, nodes, display_cost, assemble_cost, sys.getrecursionlimit())
+
+
+# 修改一个字符之后增量分析和完整分析所用的时间
+def bench_incremental(repeat):
+    source = generate_source(repeat)
+    # 把main函数中间某个if语句块里的一个常数改掉
+    offset = source.index('mean - 60', len(source) / 2) + 8
+    for engine in ['char', 'regex']:
+
+        def full():
+            session = compiler.CompilationSession(source[:offset] + '1' + source[offset + 1:], engine=engine)
+            session.tree
+
+        sessions = [compiler.CompilationSession(source, engine=engine)]
+        sessions[-1].tree
+
+        def incremental():
+            sessions.append(sessions[-1].edit(offset, 1, '1'))
+            sessions[-1].tree
+        full_cost = best_time(full)
+        incremental_cost = best_time(incremental)
+        print '%-6s full %8.3f s  incremental %8.4f s  speedup %8.1f' % (
+            engine, full_cost, incremental_cost, full_cost / incremental_cost)
+
+
+# 两种生成汇编方式所用的时间和生成的指令条数
+def bench_codegen(repeat):
+    source = generate_source(repeat)
+    for codegen in ['ast', 'ir']:
+        sessions = []
+
+        def run():
+            sessions.append(compiler.CompilationSession(source, codegen=codegen))
+            sessions[-1].tree
+            sessions[-1].assembler
+        cost = best_time(run)
+        session = sessions[-1]
+        text = session.assembler.ass_file_handler.sections['TEXT']
+        ir = '%8d' % len(session.ir) if codegen == 'ir' else '%8s' % '-'
+        print '%-4s %8.3f s  ir %s  instructions %8d' % (
+            codegen, cost, ir, sum(1 for line in text if not line.endswith(':')))
+
+
+# 建立控制流图和支配树所用的时间随函数规模的变化，线性时每条指令所用的时间应该基本不变
+def bench_cfg(repeat):
+    for size in [repeat, repeat * 2, repeat * 4, repeat * 8]:
+        program = compiler.CompilationSession(generate_source(size)).ir
+        graphs = []
+
+        def run():
+            graphs.append(compiler.ControlFlowGraph(program))
+        cost = best_time(run)
+        print 'instructions %8d  blocks %7d %8.3f s %8.2f us/instruction' % (
+            len(program), len(graphs[-1]), cost, cost / len(program) * 1e6)
+
+
+# 三种数据流分析所用的时间随函数规模的变化
+def bench_dataflow(repeat):
+    for size in [repeat, repeat * 2, repeat * 4, repeat * 8]:
+        program = compiler.CompilationSession(generate_source(size)).ir
+        graph = compiler.ControlFlowGraph(program)
+        for analysis in [compiler.Liveness, compiler.ReachingDefinitions, compiler.AvailableExpressions]:
+            cost = best_time(lambda: analysis(graph))
+            print '%-20s instructions %8d  blocks %7d %8.3f s %8.2f us/instruction' % (
+                analysis.__name__, len(program), len(graph), cost, cost / len(program) * 1e6)
+
+
+# 在重复的语句中加入结果不再被读的赋值，并声明一个没有用到的数组
+def dead_code_source(repeat):
+    source = generate_source(repeat).replace('    int i;\n', '    int i;\n    int spare;\n    int unused[6];\n', 1)
+    return source.replace('    mean = sum / temp ;\n', '    spare = temp * 2;\n    mean = sum / temp ;\n')
+
+
+# 删除死代码前后两种生成汇编方式的指令条数和数据段、bss段的定义个数，以及在三地址码上删除死代码所用的时间
+def bench_dce(repeat):
+    source = dead_code_source(repeat)
+    for codegen in ['ast', 'ir']:
+        for dce in [False, True]:
+            handler = compiler.CompilationSession(source, codegen=codegen, dce=dce).assembler.ass_file_handler
+            lines = list(handler.lines())
+            data = sum(1 for line in lines if handler.DEFINITION_PATTERN.match(line))
+            text = handler.sections['TEXT']
+            print '%-4s dce %-5s  instructions %8d  definitions %6d' % (
+                codegen, dce, sum(1 for line in text if not line.endswith(':')), data)
+    session = compiler.CompilationSession(source, dce=False)
+    programs = []
+
+    def run():
+        session._ir = None
+        programs.append(compiler.DeadCodeEliminator(session.ir).main())
+    cost = best_time(run)
+    eliminator = programs[-1]
+    print 'eliminate %8.3f s  unreachable %d  dead %d  declarations %d  strings %d' % (
+        cost, eliminator.unreachable, eliminator.dead, eliminator.declarations, eliminator.strings)
+
+
+BENCHMARKS = {
+    'lexer': bench_lexer,
+    'tokens': bench_tokens,
+    'tree': bench_tree,
+    'arena': bench_arena,
+    'incremental': bench_incremental,
+    'walk': bench_walk,
+    'expression': bench_expression,
+    'codegen': bench_codegen,
+    'cfg': bench_cfg,
+    'dataflow': bench_dataflow,
+    'dce': bench_dce,
+}
+
+if __name__ == '__main__':
+    try:
+        opts, argvs = getopt.gnu_getopt(sys.argv[1:], 'n:h', ['help'])
+    except:
+        print __doc__
+        exit()
+
+    repeat = 2000
+    for opt, argv in opts:
+        if opt in ['-h', '--help']:
+            print __doc__
+            exit()
+        elif opt == '-n':
+            repeat = int(argv)
+
+    for name in argvs or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            print 'benchmark %s not found!' % name
+            exit()
+        print '== %s ==' % name
+        BENCHMARKS[name](repeat)
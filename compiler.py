@@ -12,21 +12,64 @@ Usage: python compiler.py -s [file] [options]
 
 Options:
     -h, --h         show help
-    -s file         import the source file, required!
+    -s file         import the source file, required! repeat it to compile several files with -a
+    -m manifest     compile every file listed in manifest, one path per line
+    -j jobs         number of processes when compiling several files, default the number of cpus
+    -e engine       lexer engine, regex(default) or char
     -l              lexer
     -p              parser
+    -i              intermediate representation, three-address code lowered from the syntax tree
+    -g              control flow graph and dominator tree of the three-address code, in DOT
+    -d              dataflow of each basic block: live variables, reaching definitions and available expressions
     -a              assembler, the assembler file is in the same path with compiler.py
+    --stream        write the text section straight into the assembler file while generating it
+    --cache=dir     reuse the results of unchanged sources, cached in dir
+    --serve=socket  run as a compile server listening on the unix socket, see compiler_client.py
+    --grammar       regenerate the parse table from grammar.txt and report its conflicts
+    --peephole=rules    peephole rules applied to the text section, comma separated, all(default) or none
+    --peephole-report   print how many instructions each peephole rule removed
+    --no-fold       do not fold constant expressions or propagate constants before generating the assembly
+    --no-dce        keep unreachable code, dead assignments and unreferenced variables, arrays and strings
+    --codegen=name  generate the assembly from the syntax tree, ast(default), or from the three-address code, ir
 
 Examples:
     python compiler.py -h
     python compiler.py -s source.c -a
+    python compiler.py -s a.c -s b.c -j 4 -a
+    python compiler.py --serve=/tmp/compiler.sock
+    python compiler.py --grammar
+    python compiler.py -s source.c -a --peephole=move,jump-next --peephole-report
+    python compiler.py -s source.c -i -a --codegen=ir
+    python compiler.py -s source.c -g | dot -Tpng -o cfg.png
+    python compiler.py -s source.c -d
 
 Enjoy ^_^.
 '''
 
+import os
 import re
 import sys
+import json
+import bisect
+import mmap
+import time
 import getopt
+import operator
+import shutil
+import struct
+import SocketServer
+import hashlib
+import heapq
+import marshal
+import tempfile
+import multiprocessing
+import cPickle as pickle
+from cStringIO import StringIO
+from array import array
+from itertools import imap, repeat
+
+# 编译器版本，改变编译结果的修改都要修改版本号，以免用到旧的缓存
+VERSION = '2.6'
 
 # token比较大的分类
 TOKEN_STYLE = [
@@ -85,11 +128,65 @@ operators = [
 # 分隔符
 delimiters = ['(', ')', '{', '}', '[', ']', ',', '\"', ';']
 
-# c文件名字
-file_name = None
+# 所有token的具体类型，token类型在这里的下标即为其编号
+TOKEN_TYPES = TOKEN_STYLE + sorted(set(DETAIL_TOKEN_STYLE.values()))
+
+# token类型到编号的映射
+TOKEN_TYPE_ID = dict((_type, i) for i, _type in enumerate(TOKEN_TYPES))
+
+# TOKEN_STYLE中每个大类的编号
+STYLE_TYPE_ID = [TOKEN_TYPE_ID[style] for style in TOKEN_STYLE]
+
+# 支持的预处理指令，语法分析只处理include
+DIRECTIVES = set(['include'])
+
+# 匹配#之后的预处理指令名
+DIRECTIVE_PATTERN = re.compile(r'[ \t\n\r]*([A-Za-z_][A-Za-z0-9_]*)[ \t\n\r]*')
+
+# 匹配include的头文件，<stdio.h>或者"stdio.h"
+HEADER_PATTERNS = {
+    '<': re.compile(r'(<)[ \t\n\r]*([^>]*)(>)'),
+    '"': re.compile(r'(")[ \t\n\r]*([^"]*)(")'),
+}
+
+# 所有关键字的集合
+KEYWORD_SET = set(word for item in keywords for word in item)
+
+# 语句的边界，这些token之后的词法分析状态总是初始状态
+BOUNDARY_TYPE_IDS = frozenset(TOKEN_TYPE_ID[name] for name in ['SEMICOLON', 'LB_BRACKET', 'RB_BRACKET'])
+
+# 左括号的类型对应的右括号的类型
+BRACKET_PAIRS = {'LL_BRACKET': 'RL_BRACKET', 'LM_BRACKET': 'RM_BRACKET', 'LB_BRACKET': 'RB_BRACKET'}
+
+# 左括号的类型编号，右括号的类型编号对应的左括号的类型编号
+OPEN_BRACKET_IDS = frozenset(TOKEN_TYPE_ID[name] for name in BRACKET_PAIRS)
+CLOSE_BRACKET_IDS = dict((TOKEN_TYPE_ID[close], TOKEN_TYPE_ID[name]) for name, close in BRACKET_PAIRS.items())
+
+# 文法文件的路径，预测分析表缓存在同一目录下的grammar.txt.table中
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grammar.txt')
+
+# 文法中表示一类token的终结符
+GRAMMAR_TERMINALS = {'ID': 'IDENTIFIER', 'Num': 'DIGIT_CONSTANT', 'String': 'STRING_CONSTANT'}
+
+# 文法中的空串
+EPSILON = '∑'
+
+# 文法产生式右部的符号
+GRAMMAR_SYMBOL_PATTERN = re.compile(EPSILON + r'|[A-Za-z_][A-Za-z0-9_]*|>=|<=|\+\+|--|\S')
+
+# 输入结束时的token类型编号
+END_TYPE_ID = -1
 
-# 文件内容
-content = None
+# 一次匹配一个token的正则表达式，分组的名字即token的大类
+TOKEN_PATTERN = re.compile(r'''
+    (?P<BLANK>[ \t\n\r]+)
+  | (?P<SHARP>\#)
+  | (?P<WORD>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<NUMBER>[0-9]+(?:\.[0-9]+)*)
+  | (?P<STRING>"[^"]*)
+  | (?P<OPERATOR>\+\+|--|>=|<=|[=&<>+\-*/])
+  | (?P<DELIMITER>[(){}\[\],;])
+''', re.VERBOSE)
 
 
 class Token(object):
@@ -105,12 +202,17 @@ class Token(object):
 class Lexer(object):
     '''词法分析器'''
 
-    def __init__(self):
+    def __init__(self, source, engine='regex'):
+        # 要分析的源文件，可以是字符串、mmap等支持切片的对象
+        self.content = source
         # 用来保存词法分析出来的结果
         self.tokens = []
+        # 词法分析引擎，regex为单个正则表达式，char为逐字符扫描
+        self.engine = engine
 
     # 判断是否是空白字符
     def is_blank(self, index):
+        content = self.content
         return (
             content[index] == ' ' or
             content[index] == '\t' or
@@ -120,6 +222,7 @@ class Lexer(object):
 
     # 跳过空白字符
     def skip_blank(self, index):
+        content = self.content
         while index < len(content) and self.is_blank(index):
             index += 1
         return index
@@ -135,44 +238,128 @@ class Lexer(object):
                 return True
         return False
 
+    # 分析以#开头的预处理指令，返回指令之后的位置和分析出的token的范围
+    def _directive(self, i):
+        content = self.content
+        # self.print_log( '分隔符', content[ i ] )
+        spans = [(4, i, i + 1)]
+        # 从#之后的位置直接匹配指令名，不复制源文件
+        m = DIRECTIVE_PATTERN.match(content, i + 1)
+        # 不支持的指令和原来一样报错
+        if not m or m.group(1) not in DIRECTIVES:
+            print 'include error!'
+            exit()
+        # self.print_log( '关键字', m.group(1) )
+        spans.append((0, m.start(1), m.end(1)))
+        i = m.end()
+        # 头文件
+        pattern = HEADER_PATTERNS.get(content[i:i + 1])
+        m = pattern.match(content, i) if pattern else None
+        if not m:
+            print 'include error!'
+            exit()
+        # 分隔符、头文件名、分隔符
+        spans.append((4, m.start(1), m.end(1)))
+        spans.append((1, m.start(2), m.end(2)))
+        spans.append((4, m.start(3), m.end(3)))
+        i = self.skip_blank(m.end())
+        return i, spans
+
     # 词法分析主程序
     def main(self):
-        i = 0
+        self.tokens.extend(self.iter_tokens())
+
+    # 逐个产生token的生成器，边分析边产生，不保存分析结果
+    def iter_tokens(self):
+        for style, start, end in self.iter_spans():
+            yield Token(style, self.content[start:end])
+
+    # 分析出紧凑存储的token序列
+    def compact_tokens(self):
+        tokens = CompactTokens(self.content)
+        append = tokens.append
+        for style, start, end in self.iter_spans():
+            append(style, start, end)
+        tokens.match_brackets()
+        return tokens
+
+    # 源文件的offset处删除了deleted个字符、插入了inserted之后，只重新分析受影响的token
+    # old为修改前的CompactTokens，self.content为修改后的源文件
+    # 返回新的CompactTokens，以及被替换的token在旧序列中的范围[first, old_end)和在新序列中的范围[first, new_end)
+    def relex(self, old, offset, deleted, inserted):
+        delta = len(inserted) - deleted
+        edit_end = offset + len(inserted)
+        # 从修改处之前最近的语句边界之后开始重新分析
+        first = bisect.bisect_right(old.ends, offset)
+        while first > 0 and old.types[first - 1] not in BOUNDARY_TYPE_IDS:
+            first -= 1
+        middle = CompactTokens(self.content)
+        old_end = len(old)
+        j = first
+        for style, start, end in self.iter_spans(old.ends[first - 1] if first else 0):
+            middle.append(style, start, end)
+            if start < edit_end:
+                continue
+            # 越过修改处之后，和平移后的旧token在某个语句边界上重合即可停止
+            while j < old_end and old.starts[j] + delta < start:
+                j += 1
+            if j == old_end:
+                continue
+            if old.starts[j] + delta == start and old.ends[j] + delta == end and (
+                    old.types[j] == middle.types[-1] and old.types[j] in BOUNDARY_TYPE_IDS):
+                for item in [middle.types, middle.starts, middle.ends]:
+                    item.pop()
+                old_end = j
+                break
+        # 拼接，重合之后的token只需要平移位置
+        tokens = CompactTokens(self.content)
+        tokens.types = old.types[:first] + middle.types + old.types[old_end:]
+        tokens.starts = old.starts[:first] + middle.starts + array(
+            'I', imap(operator.add, old.starts[old_end:], repeat(delta)))
+        tokens.ends = old.ends[:first] + middle.ends + array(
+            'I', imap(operator.add, old.ends[old_end:], repeat(delta)))
+        # 括号的配对保存的是相对距离，被替换的部分前后的括号各自配对时不需要修改
+        partners, unmatched = middle.match(0, len(middle))
+        if partners is not None and all(
+                first <= i + old.partners[i] < old_end for i in xrange(first, old_end)):
+            partners = tokens.partners = old.partners[:first] + partners + old.partners[old_end:]
+            # 跨过被替换部分的括号对的距离要加上token个数的变化，从修改处向前跳过已经配对的括号找到它们
+            shift = len(middle) - (old_end - first)
+            i = first - 1
+            while shift and i >= 0:
+                distance = partners[i]
+                if distance < 0:
+                    i += distance - 1
+                    continue
+                if distance > 0:
+                    partners[i] += shift
+                    partners[i + distance + shift] -= shift
+                i -= 1
+        else:
+            tokens.match_brackets()
+        return tokens, first, old_end, first + len(middle)
+
+    # 逐个产生(token大类, 起始位置, 结束位置)的生成器，从源文件的start处开始分析
+    def iter_spans(self, start=0):
+        if self.engine == 'regex':
+            return self._iter_regex(start)
+        elif self.engine == 'char':
+            return self._iter_char(start)
+        else:
+            print 'lexer engine %s not supported!' % self.engine
+            exit()
+
+    # 逐字符扫描的词法分析
+    def _iter_char(self, start=0):
+        content = self.content
+        i = start
         while i < len(content):
             i = self.skip_blank(i)
             # 如果是引入头文件，还有一种可能是16进制数，这里先不判断
             if content[i] == '#':
-                #self.print_log( '分隔符', content[ i ] )
-                self.tokens.append(Token(4, content[i]))
-                i = self.skip_blank(i + 1)
-                # 分析这一引入头文件
-                while i < len(content):
-                    # 匹配"include"
-                    if re.match('include', content[i:]):
-                        # self.print_log( '关键字', 'include' )
-                        self.tokens.append(Token(0, 'include'))
-                        i = self.skip_blank(i + 7)
-                    # 匹配"或者<
-                    elif content[i] == '\"' or content[i] == '<':
-                        # self.print_log( '分隔符', content[ i ] )
-                        self.tokens.append(Token(4, content[i]))
-                        i = self.skip_blank(i + 1)
-                        close_flag = '\"' if content[i] == '\"' else '>'
-                        # 找到include的头文件
-                        lib = ''
-                        while content[i] != close_flag:
-                            lib += content[i]
-                            i += 1
-                        # self.print_log( '标识符', lib )
-                        self.tokens.append(Token(1, lib))
-                        # 跳出循环后，很显然找到close_flog
-                        # self.print_log( '分隔符', close_flag )
-                        self.tokens.append(Token(4, close_flag))
-                        i = self.skip_blank(i + 1)
-                        break
-                    else:
-                        print 'include error!'
-                        exit()
+                i, spans = self._directive(i)
+                for span in spans:
+                    yield span
             # 如果是字母或者是以下划线开头
             elif content[i].isalpha() or content[i] == '_':
                 # 找到该字符串
@@ -186,10 +373,10 @@ class Lexer(object):
                 # 判断该字符串
                 if self.is_keyword(temp):
                     # self.print_log( '关键字', temp )
-                    self.tokens.append(Token(0, temp))
+                    yield 0, i - len(temp), i
                 else:
                     # self.print_log( '标识符', temp )
-                    self.tokens.append(Token(1, temp))
+                    yield 1, i - len(temp), i
                 i = self.skip_blank(i)
             # 如果是数字开头
             elif content[i].isdigit():
@@ -206,12 +393,12 @@ class Lexer(object):
                         else:
                             break
                 # self.print_log( '常量' , temp )
-                self.tokens.append(Token(2, temp))
+                yield 2, i - len(temp), i
                 i = self.skip_blank(i)
             # 如果是分隔符
             elif content[i] in delimiters:
                 # self.print_log( '分隔符', content[ i ] )
-                self.tokens.append(Token(4, content[i]))
+                yield 4, i, i + 1
                 # 如果是字符串常量
                 if content[i] == '\"':
                     i += 1
@@ -226,9 +413,9 @@ class Lexer(object):
                         print 'error:lack of \"'
                         exit()
                     # self.print_log( '常量' , temp )
-                    self.tokens.append(Token(5, temp))
+                    yield 5, i - len(temp), i
                     # self.print_log( '分隔符' , '\"' )
-                    self.tokens.append(Token(4, '\"'))
+                    yield 4, i, i + 1
                 i = self.skip_blank(i + 1)
             # 如果是运算符
             elif content[i] in operators:
@@ -236,23 +423,244 @@ class Lexer(object):
                 if (content[i] == '+' or content[i] == '-') and (
                         content[i + 1] == content[i]):
                     # self.print_log( '运算符', content[ i ] * 2 )
-                    self.tokens.append(Token(3, content[i] * 2))
+                    yield 3, i, i + 2
                     i = self.skip_blank(i + 2)
                 # 如果是>=或者<=
                 elif (content[i] == '>' or content[i] == '<') and content[i + 1] == '=':
                     # self.print_log( '运算符', content[ i ] + '=' )
-                    self.tokens.append(Token(3, content[i] + '='))
+                    yield 3, i, i + 2
                     i = self.skip_blank(i + 2)
                 # 其他
                 else:
                     # self.print_log( '运算符', content[ i ] )
-                    self.tokens.append(Token(3, content[i]))
+                    yield 3, i, i + 1
                     i = self.skip_blank(i + 1)
 
+    # 用一个正则表达式一次性匹配的词法分析
+    def _iter_regex(self, start=0):
+        content = self.content
+        i = start
+        length = len(content)
+        match = TOKEN_PATTERN.match
+        while i < length:
+            m = match(content, i)
+            if not m:
+                print 'unknown character %s!' % content[i]
+                exit()
+            kind = m.lastgroup
+            start = i
+            i = m.end()
+            if kind == 'BLANK':
+                continue
+            elif kind == 'SHARP':
+                i, spans = self._directive(start)
+                for span in spans:
+                    yield span
+            elif kind == 'WORD':
+                yield (0 if m.group() in KEYWORD_SET else 1), start, i
+            elif kind == 'NUMBER':
+                if i < length and content[i] == '.':
+                    print 'float number error!'
+                    exit()
+                yield 2, start, i
+            elif kind == 'STRING':
+                if i >= length:
+                    print 'error:lack of \"'
+                    exit()
+                yield 4, start, start + 1
+                yield 5, start + 1, i
+                yield 4, i, i + 1
+                i += 1
+            else:
+                yield (3 if kind == 'OPERATOR' else 4), start, i
+
+
+class CompactTokens(object):
+    '''紧凑存储的token序列，只保存类型编号和在源文件中的起止位置，值在使用时才取出'''
+
+    def __init__(self, source):
+        try:
+            self.view = memoryview(source)
+        except TypeError:
+            # mmap等只支持旧式buffer接口的对象
+            self.view = buffer(source)
+        # token类型在TOKEN_TYPES中的编号
+        self.types = array('H')
+        # token在源文件中的起始位置和结束位置
+        self.starts = array('I')
+        self.ends = array('I')
+        # 括号到与之配对的括号的距离，不是括号的token为0
+        self.partners = array('i')
+
+    # 添加一个token，style为其在TOKEN_STYLE中的下标
+    def append(self, style, start, end):
+        if style in (0, 3, 4):
+            value = self.view[start:end]
+            type_id = TOKEN_TYPE_ID[DETAIL_TOKEN_STYLE[
+                value.tobytes() if isinstance(value, memoryview) else value]]
+        else:
+            type_id = STYLE_TYPE_ID[style]
+        self.types.append(type_id)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self.types):
+            raise IndexError(index)
+        return TokenView(self, index)
+
+    # 第index个token的值
+    def value(self, index):
+        value = self.view[self.starts[index]:self.ends[index]]
+        return value.tobytes() if isinstance(value, memoryview) else value
+
+    # 是否存在下标为index的token
+    def has(self, index):
+        return 0 <= index < len(self.types)
+
+    # 所有token都在内存中，不需要释放
+    def release(self, index):
+        pass
+
+    # 下标为index的括号配对的括号的下标
+    def partner(self, index):
+        return index + self.partners[index]
+
+    # 第index个token的类型编号，超出范围时为输入结束
+    def type_id(self, index):
+        return self.types[index] if 0 <= index < len(self.types) else END_TYPE_ID
+
+    # 用一个栈找出下标在[start, end)中的每个括号配对的括号，返回(相对距离的数组, -1)
+    # 括号不配对时返回(None, 第一个不配对的括号的下标)
+    def match(self, start, end):
+        types = self.types
+        partners = array('i', [0]) * (end - start)
+        stack = []
+        for i in xrange(start, end):
+            type_id = types[i]
+            if type_id in OPEN_BRACKET_IDS:
+                stack.append(i)
+            elif type_id in CLOSE_BRACKET_IDS:
+                if not stack or types[stack[-1]] != CLOSE_BRACKET_IDS[type_id]:
+                    return None, i
+                j = stack.pop()
+                partners[j - start] = i - j
+                partners[i - start] = j - i
+        if stack:
+            return None, stack[-1]
+        return partners, -1
+
+    # 计算所有括号的配对，括号不配对时报错
+    def match_brackets(self):
+        partners, unmatched = self.match(0, len(self.types))
+        if partners is None:
+            print 'error: unmatched bracket %s at offset %d!' % (self.value(unmatched), self.starts[unmatched])
+            exit()
+        self.partners = partners
+
+    # 序列化为字符串，不包括源文件
+    def dump(self):
+        return marshal.dumps((self.types.tostring(), self.starts.tostring(), self.ends.tostring()))
+
+    # 从dump的结果和源文件恢复
+    @classmethod
+    def load(cls, source, data):
+        tokens = cls(source)
+        types, starts, ends = marshal.loads(data)
+        tokens.types.fromstring(types)
+        tokens.starts.fromstring(starts)
+        tokens.ends.fromstring(ends)
+        tokens.match_brackets()
+        return tokens
+
+
+class TokenView(object):
+    '''CompactTokens中某一个token的视图，和Token有相同的type和value属性'''
+
+    __slots__ = ('tokens', 'index')
+
+    def __init__(self, tokens, index):
+        self.tokens = tokens
+        self.index = index
+
+    @property
+    def type(self):
+        return TOKEN_TYPES[self.tokens.types[self.index]]
+
+    @property
+    def value(self):
+        return self.tokens.value(self.index)
+
+
+class TokenBuffer(object):
+    '''按需从词法分析器中取token的缓冲区，只保存还没有分析完的token'''
+
+    def __init__(self, tokens):
+        # token的来源，可以是生成器
+        self.iterator = iter(tokens)
+        # 缓冲的token
+        self.buffer = []
+        # buffer中第一个token的下标
+        self.offset = 0
+
+    # 从来源中取token，直到缓冲区中有下标为index的token
+    def _fill(self, index):
+        while index - self.offset >= len(self.buffer):
+            try:
+                self.buffer.append(next(self.iterator))
+            except StopIteration:
+                return False
+        return True
+
+    def __getitem__(self, index):
+        if index < self.offset:
+            print 'error: token %d has been released!' % index
+            exit()
+        if not self._fill(index):
+            raise IndexError(index)
+        return self.buffer[index - self.offset]
+
+    # 是否存在下标为index的token
+    def has(self, index):
+        return self._fill(index)
+
+    # 释放下标index之前的token
+    def release(self, index):
+        if index > self.offset:
+            del self.buffer[:index - self.offset]
+            self.offset = index
+
+    # 第index个token的类型编号，超出范围时为输入结束
+    def type_id(self, index):
+        return TOKEN_TYPE_ID[self[index].type] if self.has(index) else END_TYPE_ID
+
+    # 下标为index的左括号配对的右括号的下标，边分析边取token时没有预先算好的配对，只能向后扫描
+    def partner(self, index):
+        open_type = self[index].type
+        close_type = BRACKET_PAIRS[open_type]
+        depth = 0
+        while self.has(index):
+            token_type = self[index].type
+            if token_type == open_type:
+                depth += 1
+            elif token_type == close_type:
+                depth -= 1
+                if not depth:
+                    return index
+            index += 1
+        print 'error: unmatched bracket %s!' % self[index - 1].value
+        exit()
+
 
 class SyntaxTreeNode(object):
     '''语法树节点'''
 
+    __slots__ = ('value', 'type', 'extra_info', 'father',
+                 'left', 'right', 'first_son', 'last_son')
+
     def __init__(self, value=None, _type=None, extra_info=None):
         # 节点的值，为文法中的终结符或者非终结符
         self.value = value
@@ -264,6 +672,8 @@ class SyntaxTreeNode(object):
         self.left = None
         self.right = None
         self.first_son = None
+        # 最后一个儿子，添加儿子时不需要遍历兄弟节点
+        self.last_son = None
     # 设置value
 
     def set_value(self, value):
@@ -278,6 +688,115 @@ class SyntaxTreeNode(object):
         self.extra_info = extra_info
 
 
+class ArenaTree(object):
+    '''用平行数组保存的整棵语法树，节点用数组下标表示，整棵树一起创建一起释放'''
+
+    def __init__(self):
+        # 节点的value和type都保存为字符串表中的下标，0表示None
+        self.strings = [None]
+        self.string_ids = {None: 0}
+        self.values = array('I')
+        self.types = array('I')
+        # 父节点、左右兄弟、第一个和最后一个儿子的下标，-1表示没有
+        self.fathers = array('i')
+        self.lefts = array('i')
+        self.rights = array('i')
+        self.first_sons = array('i')
+        self.last_sons = array('i')
+        # 大部分节点没有extra_info，单独保存
+        self.extra_infos = {}
+
+    # 字符串在字符串表中的下标
+    def intern(self, string):
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    # 新建一个节点，和SyntaxTreeNode的参数相同
+    def new_node(self, value=None, _type=None, extra_info=None):
+        index = len(self.values)
+        self.values.append(self.intern(value))
+        self.types.append(self.intern(_type))
+        for links in (self.fathers, self.lefts, self.rights, self.first_sons, self.last_sons):
+            links.append(-1)
+        if extra_info is not None:
+            self.extra_infos[index] = extra_info
+        return ArenaNode(self, index)
+
+    # 下标为index的节点
+    def node(self, index):
+        return ArenaNode(self, index) if index >= 0 else None
+
+    # 节点的个数
+    def __len__(self):
+        return len(self.values)
+
+    # 一次释放整棵树
+    def clear(self):
+        self.__init__()
+
+
+# 生成ArenaNode中父节点、兄弟、儿子的属性
+def _arena_link(name):
+    def getter(self):
+        return self.arena.node(getattr(self.arena, name)[self.index])
+
+    def setter(self, node):
+        getattr(self.arena, name)[self.index] = node.index if node else -1
+    return property(getter, setter)
+
+
+class ArenaNode(object):
+    '''ArenaTree中某个节点的句柄，和SyntaxTreeNode有相同的属性和方法'''
+
+    __slots__ = ('arena', 'index')
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaNode) and self.arena is other.arena and self.index == other.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.arena), self.index))
+
+    @property
+    def value(self):
+        return self.arena.strings[self.arena.values[self.index]]
+
+    @property
+    def type(self):
+        return self.arena.strings[self.arena.types[self.index]]
+
+    @property
+    def extra_info(self):
+        return self.arena.extra_infos.get(self.index)
+
+    father = _arena_link('fathers')
+    left = _arena_link('lefts')
+    right = _arena_link('rights')
+    first_son = _arena_link('first_sons')
+    last_son = _arena_link('last_sons')
+
+    # 设置value
+    def set_value(self, value):
+        self.arena.values[self.index] = self.arena.intern(value)
+
+    # 设置type
+    def set_type(self, _type):
+        self.arena.types[self.index] = self.arena.intern(_type)
+
+    # 设置extra_info
+    def set_extra_info(self, extra_info):
+        self.arena.extra_infos[self.index] = extra_info
+
+
 class SyntaxTree(object):
     '''语法树'''
 
@@ -297,13 +816,75 @@ class SyntaxTree(object):
         if not father.first_son:
             father.first_son = new_node
         else:
-            current_node = father.first_son
-            while current_node.right:
-                current_node = current_node.right
-            current_node.right = new_node
-            new_node.left = current_node
+            father.last_son.right = new_node
+            new_node.left = father.last_son
+        father.last_son = new_node
         self.current = new_node
 
+    # 以node为根的子树的先序遍历，用显式的栈代替递归，树的深度不受递归深度的限制
+    @staticmethod
+    def preorder(node):
+        stack = [node] if node else []
+        push = stack.append
+        pop = stack.pop
+        while stack:
+            node = pop()
+            yield node
+            # 儿子倒序入栈，最左边的儿子先出栈
+            child = node.last_son
+            while child:
+                push(child)
+                child = child.left
+
+    # 以node为根的子树的后序遍历
+    @staticmethod
+    def postorder(node):
+        # 节点和它下一个要访问的儿子
+        stack = [[node, node.first_son]] if node else []
+        while stack:
+            top = stack[-1]
+            child = top[1]
+            if child:
+                top[1] = child.right
+                stack.append([child, child.first_son])
+            else:
+                stack.pop()
+                yield top[0]
+
+    # 先序遍历得到的(value, type, extra_info, 儿子个数)列表，用于序列化
+    def dump(self):
+        nodes = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            children = []
+            child = node.first_son
+            while child:
+                children.append(child)
+                child = child.right
+            nodes.append((node.value, node.type, node.extra_info, len(children)))
+            stack.extend(reversed(children))
+        return nodes
+
+    # 从dump的结果恢复语法树，new_node为新建节点的方法
+    @classmethod
+    def load(cls, nodes, new_node=SyntaxTreeNode):
+        tree = cls()
+        # 还没有添加完儿子的节点和剩余的儿子个数
+        stack = []
+        for value, _type, extra_info, count in nodes:
+            node = new_node(value, _type, extra_info)
+            if stack:
+                tree.add_child_node(node, stack[-1][0])
+                stack[-1][1] -= 1
+            else:
+                tree.root = tree.current = node
+            if count:
+                stack.append([node, count])
+            while stack and not stack[-1][1]:
+                stack.pop()
+        return tree
+
     # 交换相邻的两棵兄弟子树
     def switch(self, left, right):
         left_left = left.left
@@ -316,28 +897,312 @@ class SyntaxTree(object):
             left_left.right = right
         if right_right:
             right_right.left = left
+        # 交换的是第一个或者最后一个儿子
+        father = left.father
+        if father:
+            if father.first_son == left:
+                father.first_son = right
+            if father.last_son == right:
+                father.last_son = left
+
+    # 用new_node所在的子树替换old_node所在的子树
+    def replace(self, old_node, new_node):
+        new_node.father = old_node.father
+        new_node.left = old_node.left
+        new_node.right = old_node.right
+        if old_node.left:
+            old_node.left.right = new_node
+        if old_node.right:
+            old_node.right.left = new_node
+        father = old_node.father
+        if father:
+            if father.first_son == old_node:
+                father.first_son = new_node
+            if father.last_son == old_node:
+                father.last_son = new_node
+        if self.root == old_node:
+            self.root = new_node
+
+
+class Grammar(object):
+    '''从grammar.txt读入的文法，计算FIRST、FOLLOW集合并生成预测分析表'''
+
+    def __init__(self, text, lookahead=3):
+        # 产生式列表，每一项为(左部, 右部的符号元组)，右部为空元组时表示空串
+        self.productions = []
+        # 非终结符，按在文法中第一次出现的顺序，第一个为开始符号
+        self.nonterminals = []
+        # 冲突时最多向后看几个token
+        self.lookahead = lookahead
+        # 需要向后看多个token才能确定产生式的地方，(非终结符, 向前看的token类型, 产生式下标列表)
+        self.deep_cells = []
+        # 向后看lookahead个token也不能确定产生式的冲突
+        self.conflicts = []
+        self._read(text)
+        self.first = self._compute_first()
+        self.follow = self._compute_follow()
+        # (非终结符, token类型编号)到产生式下标的映射，冲突时为按之后的token类型编号查找的子表
+        self.table = self._compute_table()
+
+    # 是否是非终结符
+    def is_nonterminal(self, symbol):
+        return symbol[0].isupper() and symbol not in GRAMMAR_TERMINALS
+
+    # 终结符对应的token类型编号
+    def terminal_id(self, symbol):
+        _type = GRAMMAR_TERMINALS.get(symbol) or DETAIL_TOKEN_STYLE.get(symbol)
+        if _type is None:
+            print 'grammar error: unknown terminal %s!' % symbol
+            exit()
+        return TOKEN_TYPE_ID[_type]
+
+    # 读入产生式，词法分析器识别的Num和String不作为非终结符
+    def _read(self, text):
+        for line in text.splitlines():
+            line = line.split('//')[0]
+            if '-->' not in line:
+                continue
+            left, right = [item.strip() for item in line.split('-->', 1)]
+            if left in GRAMMAR_TERMINALS:
+                continue
+            if left not in self.nonterminals:
+                self.nonterminals.append(left)
+            for alternative in right.split('|'):
+                symbols = tuple(GRAMMAR_SYMBOL_PATTERN.findall(alternative))
+                if symbols == (EPSILON,):
+                    symbols = ()
+                if (left, symbols) not in self.productions:
+                    self.productions.append((left, symbols))
+        for left, symbols in self.productions:
+            for symbol in symbols:
+                if self.is_nonterminal(symbol) and symbol not in self.nonterminals:
+                    print 'grammar error: nonterminal %s is not defined!' % symbol
+                    exit()
+
+    # 两个串集合的连接，结果只保留前lookahead个符号
+    def _concat(self, heads, tails):
+        k = self.lookahead
+        result = set()
+        for head in heads:
+            if len(head) >= k:
+                result.add(head)
+            else:
+                for tail in tails:
+                    result.add((head + tail)[:k])
+        return result
+
+    # 符号串的FIRST集合，集合中是长度不超过lookahead的token类型编号元组
+    def _first_of(self, symbols, first):
+        result = set([()])
+        for symbol in symbols:
+            if self.is_nonterminal(symbol):
+                result = self._concat(result, first[symbol])
+            else:
+                result = self._concat(result, set([(self.terminal_id(symbol),)]))
+            if not result or min(len(item) for item in result) >= self.lookahead:
+                break
+        return result
+
+    # 所有非终结符的FIRST集合，迭代到不再变化为止
+    def _compute_first(self):
+        first = dict((name, set()) for name in self.nonterminals)
+        changed = True
+        while changed:
+            changed = False
+            for left, symbols in self.productions:
+                strings = self._first_of(symbols, first)
+                if not strings <= first[left]:
+                    first[left] |= strings
+                    changed = True
+        return first
+
+    # 所有非终结符的FOLLOW集合，开始符号之后是输入结束
+    def _compute_follow(self):
+        follow = dict((name, set()) for name in self.nonterminals)
+        follow[self.nonterminals[0]].add((END_TYPE_ID,))
+        changed = True
+        while changed:
+            changed = False
+            for left, symbols in self.productions:
+                for i, symbol in enumerate(symbols):
+                    if not self.is_nonterminal(symbol):
+                        continue
+                    strings = self._concat(self._first_of(symbols[i + 1:], self.first), follow[left])
+                    if not strings <= follow[symbol]:
+                        follow[symbol] |= strings
+                        changed = True
+        return follow
+
+    # 预测分析表，先只看下一个token，冲突时再看之后的token
+    def _compute_table(self):
+        table = {}
+        for name in self.nonterminals:
+            candidates = []
+            for index, (left, symbols) in enumerate(self.productions):
+                if left == name:
+                    candidates.append((index, self._concat(self._first_of(symbols, self.first), self.follow[left])))
+            for type_id, cell in self._predict(name, candidates, 0, ()).iteritems():
+                table[(name, type_id)] = cell
+        return table
+
+    # candidates为(产生式下标, 向前看的串集合)，按第depth个token类型分组
+    def _predict(self, name, candidates, depth, prefix):
+        groups = {}
+        for index, strings in candidates:
+            for string in strings:
+                type_id = string[depth] if depth < len(string) else END_TYPE_ID
+                groups.setdefault(type_id, {}).setdefault(index, set()).add(string)
+        cells = {}
+        for type_id in sorted(groups):
+            alternatives = groups[type_id]
+            indexes = sorted(alternatives)
+            if len(indexes) == 1:
+                cells[type_id] = indexes[0]
+            elif depth + 1 < self.lookahead and type_id != END_TYPE_ID:
+                self.deep_cells.append((name, prefix + (type_id,), indexes))
+                cells[type_id] = self._predict(name, sorted(alternatives.items()), depth + 1, prefix + (type_id,))
+            else:
+                # 无法确定时取文法中靠前的产生式
+                self.conflicts.append((name, prefix + (type_id,), indexes))
+                cells[type_id] = indexes[0]
+        return cells
+
+    # 产生式的文本
+    def production_text(self, index):
+        left, symbols = self.productions[index]
+        return '%s --> %s' % (left, ' '.join(symbols) or EPSILON)
+
+    # 向前看的token类型的文本
+    @staticmethod
+    def lookahead_text(type_ids):
+        return ' '.join('$' if type_id == END_TYPE_ID else TOKEN_TYPES[type_id] for type_id in type_ids)
+
+    # 冲突报告的每一行
+    def report_lines(self):
+        for title, cells in [('needs more lookahead', self.deep_cells), ('conflict', self.conflicts)]:
+            for name, type_ids, indexes in cells:
+                yield '%s: %s on %s' % (title, name, self.lookahead_text(type_ids))
+                for index in indexes:
+                    yield '    ' + self.production_text(index)
+
+
+class PredictTable(object):
+    '''预测分析表，由Grammar生成，按grammar.txt的内容缓存在磁盘上'''
+
+    # 进程中已经读入的预测分析表
+    _instance = None
+
+    def __init__(self, productions, table):
+        self.productions = productions
+        self.table = table
+
+    # 在tokens的index处预测nonterminal的产生式，返回(左部, 右部)，没有可用的产生式时返回None
+    def predict(self, nonterminal, tokens, index):
+        cell = self.table.get((nonterminal, tokens.type_id(index)))
+        while isinstance(cell, dict):
+            index += 1
+            cell = cell.get(tokens.type_id(index))
+        return None if cell is None else self.productions[cell]
+
+    # 文法和token类型决定了预测分析表的内容
+    @staticmethod
+    def key(text):
+        return hashlib.sha1('\0'.join([VERSION, repr(TOKEN_TYPES), text])).hexdigest()
+
+    # 根据文法生成预测分析表并写入缓存，report为True时打印冲突
+    @classmethod
+    def generate(cls, path=GRAMMAR_PATH, report=False):
+        text = open(path, 'rb').read()
+        grammar = Grammar(text)
+        try:
+            fd, tmp_path = tempfile.mkstemp('.tmp', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as tmp_file:
+                marshal.dump((cls.key(text), grammar.productions, grammar.table), tmp_file)
+            os.rename(tmp_path, path + '.table')
+        except (IOError, OSError):
+            pass
+        if report:
+            print 'productions: %d, nonterminals: %d, cells: %d' % (
+                len(grammar.productions), len(grammar.nonterminals), len(grammar.table))
+            for line in grammar.report_lines():
+                print line
+        elif grammar.conflicts:
+            # 编译时不能写到标准输出，以免混入词法分析和语法分析的结果
+            for line in grammar.report_lines():
+                sys.stderr.write(line + '\n')
+        return cls(grammar.productions, grammar.table)
+
+    # 读入缓存的预测分析表，文法改变或者没有缓存时重新生成
+    @classmethod
+    def load(cls, path=GRAMMAR_PATH):
+        if cls._instance is None:
+            try:
+                with open(path + '.table', 'rb') as table_file:
+                    key, productions, table = marshal.load(table_file)
+                if key != cls.key(open(path, 'rb').read()):
+                    raise ValueError(key)
+                cls._instance = cls(productions, table)
+            except (IOError, OSError, ValueError, EOFError, TypeError):
+                cls._instance = cls.generate(path)
+        return cls._instance
 
 
 class Parser(object):
     '''语法分析器'''
 
-    def __init__(self):
-        lexer = Lexer()
-        lexer.main()
-        # 要分析的tokens
-        self.tokens = lexer.tokens
+    # 运算符优先级
+    OPERATOR_PRIORITY = {'>': 0, '<': 0, '>=': 0, '<=': 0,
+                         '+': 1, '-': 1, '*': 2, '/': 2, '++': 3, '--': 3, '!': 3}
+    # 单目运算符
+    UNARY_OPERATORS = frozenset(['!', '++', '--'])
+    # 双目运算符
+    BINARY_OPERATORS = frozenset(['+', '-', '*', '/', '>', '<', '>=', '<='])
+    # 文法中Sentence的产生式的第一个非终结符对应的句型
+    SENTENCE_PATTERNS = {
+        'Include': 'INCLUDE',
+        'Statement': 'STATEMENT',
+        'FunctionStatement': 'FUNCTION_STATEMENT',
+        'Assignment': 'ASSIGNMENT',
+        'FunctionCall': 'FUNCTION_CALL',
+        'Control': 'CONTROL',
+        'Return': 'RETURN',
+    }
+
+    def __init__(self, source=None, engine='regex', tokens=None, backend='node', arena=None):
+        # 要分析的tokens，没有给出时边词法分析边语法分析
+        if tokens is None:
+            tokens = TokenBuffer(Lexer(source, engine).iter_tokens())
+        self.tokens = tokens
+        # 语法树的存储方式，node为链接的SyntaxTreeNode，arena为平行数组
+        if backend == 'node':
+            self.arena = None
+            self.new_node = SyntaxTreeNode
+        elif backend == 'arena':
+            # 增量分析时新节点要和原来的语法树在同一个arena中
+            self.arena = arena or ArenaTree()
+            self.new_node = self.arena.new_node
+        else:
+            print 'syntax tree backend %s not supported!' % backend
+            exit()
         # tokens下标
         self.index = 0
         # 最终生成的语法树
         self.tree = SyntaxTree()
+        # 每个大括号语句块的Sentence节点对应的左右大括号的下标
+        self.blocks = {}
+        # 由grammar.txt生成的预测分析表
+        self.predict_table = PredictTable.load()
 
     # 处理大括号里的部分
     def _block(self, father_tree):
+        left = self.index
         self.index += 1
         sentence_tree = SyntaxTree()
-        sentence_tree.current = sentence_tree.root = SyntaxTreeNode('Sentence')
+        sentence_tree.current = sentence_tree.root = self.new_node('Sentence')
         father_tree.add_child_node(sentence_tree.root, father_tree.root)
         while True:
+            # 之前的句子已经分析完了
+            self.tokens.release(self.index)
             # 句型
             sentence_pattern = self._judge_sentence_pattern()
             # 声明语句
@@ -361,25 +1226,26 @@ class Parser(object):
             else:
                 print 'block error!'
                 exit()
+        self.blocks[sentence_tree.root] = (left, self.index - 1)
 
     # include句型
     def _include(self, father=None):
         if not father:
             father = self.tree.root
         include_tree = SyntaxTree()
-        include_tree.current = include_tree.root = SyntaxTreeNode('Include')
+        include_tree.current = include_tree.root = self.new_node('Include')
         self.tree.add_child_node(include_tree.root, father)
         # include语句中双引号的个数
         cnt = 0
         # include语句是否结束
         flag = True
         while flag:
-            if self.tokens[self.index] == '\"':
+            if self.tokens[self.index].value == '\"':
                 cnt += 1
-            if self.index >= len(self.tokens) or cnt >= 2 or self.tokens[self.index].value == '>':
+            if not self.tokens.has(self.index) or cnt >= 2 or self.tokens[self.index].value == '>':
                 flag = False
             include_tree.add_child_node(
-                SyntaxTreeNode(self.tokens[self.index].value), include_tree.root)
+                self.new_node(self.tokens[self.index].value), include_tree.root)
             self.index += 1
 
     # 函数声明
@@ -387,44 +1253,44 @@ class Parser(object):
         if not father:
             father = self.tree.root
         func_statement_tree = SyntaxTree()
-        func_statement_tree.current = func_statement_tree.root = SyntaxTreeNode(
+        func_statement_tree.current = func_statement_tree.root = self.new_node(
             'FunctionStatement')
         self.tree.add_child_node(func_statement_tree.root, father)
         # 函数声明语句什么时候结束
         flag = True
-        while flag and self.index < len(self.tokens):
+        while flag and self.tokens.has(self.index):
             # 如果是函数返回类型
             if self.tokens[self.index].value in keywords[0]:
-                return_type = SyntaxTreeNode('Type')
+                return_type = self.new_node('Type')
                 func_statement_tree.add_child_node(return_type)
                 func_statement_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}))
+                    self.new_node(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}))
                 self.index += 1
             # 如果是函数名
             elif self.tokens[self.index].type == 'IDENTIFIER':
-                func_name = SyntaxTreeNode('FunctionName')
+                func_name = self.new_node('FunctionName')
                 func_statement_tree.add_child_node(
                     func_name, func_statement_tree.root)
                 # extra_info
                 func_statement_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'IDENTIFIER', {'type': 'FUNCTION_NAME'}))
+                    self.new_node(self.tokens[self.index].value, 'IDENTIFIER', {'type': 'FUNCTION_NAME'}))
                 self.index += 1
             # 如果是参数序列
             elif self.tokens[self.index].type == 'LL_BRACKET':
-                params_list = SyntaxTreeNode('StateParameterList')
+                params_list = self.new_node('StateParameterList')
                 func_statement_tree.add_child_node(
                     params_list, func_statement_tree.root)
                 self.index += 1
                 while self.tokens[self.index].type != 'RL_BRACKET':
                     if self.tokens[self.index].value in keywords[0]:
-                        param = SyntaxTreeNode('Parameter')
+                        param = self.new_node('Parameter')
                         func_statement_tree.add_child_node(param, params_list)
                         # extra_info
                         func_statement_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}), param)
+                            self.new_node(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}), param)
                         if self.tokens[self.index + 1].type == 'IDENTIFIER':
                             # extra_info
-                            func_statement_tree.add_child_node(SyntaxTreeNode(self.tokens[self.index + 1].value, 'IDENTIFIER', {
+                            func_statement_tree.add_child_node(self.new_node(self.tokens[self.index + 1].value, 'IDENTIFIER', {
                                                                'type': 'VARIABLE', 'variable_type': self.tokens[self.index].value}), param)
                         else:
                             print '函数定义参数错误！'
@@ -441,7 +1307,7 @@ class Parser(object):
         if not father:
             father = self.tree.root
         statement_tree = SyntaxTree()
-        statement_tree.current = statement_tree.root = SyntaxTreeNode(
+        statement_tree.current = statement_tree.root = self.new_node(
             'Statement')
         self.tree.add_child_node(statement_tree.root, father)
         # 暂时用来保存当前声明语句的类型，以便于识别多个变量的声明
@@ -450,49 +1316,49 @@ class Parser(object):
             # 变量类型
             if self.tokens[self.index].value in keywords[0]:
                 tmp_variable_type = self.tokens[self.index].value
-                variable_type = SyntaxTreeNode('Type')
+                variable_type = self.new_node('Type')
                 statement_tree.add_child_node(variable_type)
                 # extra_info
                 statement_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}))
+                    self.new_node(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}))
             # 变量名
             elif self.tokens[self.index].type == 'IDENTIFIER':
                 # extra_info
-                statement_tree.add_child_node(SyntaxTreeNode(self.tokens[self.index].value, 'IDENTIFIER', {
+                statement_tree.add_child_node(self.new_node(self.tokens[self.index].value, 'IDENTIFIER', {
                                               'type': 'VARIABLE', 'variable_type': tmp_variable_type}), statement_tree.root)
             # 数组大小
             elif self.tokens[self.index].type == 'DIGIT_CONSTANT':
                 statement_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'DIGIT_CONSTANT'), statement_tree.root)
+                    self.new_node(self.tokens[self.index].value, 'DIGIT_CONSTANT'), statement_tree.root)
                 statement_tree.current.left.set_extra_info(
                     {'type': 'LIST', 'list_type': tmp_variable_type})
             # 数组元素
             elif self.tokens[self.index].type == 'LB_BRACKET':
                 self.index += 1
-                constant_list = SyntaxTreeNode('ConstantList')
+                constant_list = self.new_node('ConstantList')
                 statement_tree.add_child_node(
                     constant_list, statement_tree.root)
                 while self.tokens[self.index].type != 'RB_BRACKET':
                     if self.tokens[self.index].type == 'DIGIT_CONSTANT':
                         statement_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, 'DIGIT_CONSTANT'), constant_list)
+                            self.new_node(self.tokens[self.index].value, 'DIGIT_CONSTANT'), constant_list)
                     self.index += 1
             # 多个变量声明
             elif self.tokens[self.index].type == 'COMMA':
                 while self.tokens[self.index].type != 'SEMICOLON':
                     if self.tokens[self.index].type == 'IDENTIFIER':
                         tree = SyntaxTree()
-                        tree.current = tree.root = SyntaxTreeNode('Statement')
+                        tree.current = tree.root = self.new_node('Statement')
                         self.tree.add_child_node(tree.root, father)
                         # 类型
-                        variable_type = SyntaxTreeNode('Type')
+                        variable_type = self.new_node('Type')
                         tree.add_child_node(variable_type)
                         # extra_info
                         # 类型
                         tree.add_child_node(
-                            SyntaxTreeNode(tmp_variable_type, 'FIELD_TYPE', {'type': tmp_variable_type}))
+                            self.new_node(tmp_variable_type, 'FIELD_TYPE', {'type': tmp_variable_type}))
                         # 变量名
-                        tree.add_child_node(SyntaxTreeNode(self.tokens[self.index].value, 'IDENTIFIER', {
+                        tree.add_child_node(self.new_node(self.tokens[self.index].value, 'IDENTIFIER', {
                                             'type': 'VARIABLE', 'variable_type': tmp_variable_type}), tree.root)
                     self.index += 1
                 break
@@ -504,13 +1370,13 @@ class Parser(object):
         if not father:
             father = self.tree.root
         assign_tree = SyntaxTree()
-        assign_tree.current = assign_tree.root = SyntaxTreeNode('Assignment')
+        assign_tree.current = assign_tree.root = self.new_node('Assignment')
         self.tree.add_child_node(assign_tree.root, father)
         while self.tokens[self.index].type != 'SEMICOLON':
             # 被赋值的变量
             if self.tokens[self.index].type == 'IDENTIFIER':
                 assign_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'IDENTIFIER'))
+                    self.new_node(self.tokens[self.index].value, 'IDENTIFIER'))
                 self.index += 1
             elif self.tokens[self.index].type == 'ASSIGN':
                 self.index += 1
@@ -520,16 +1386,18 @@ class Parser(object):
     # while语句，没处理do-while的情况，只处理了while
     def _while(self, father=None):
         while_tree = SyntaxTree()
-        while_tree.current = while_tree.root = SyntaxTreeNode(
+        while_tree.current = while_tree.root = self.new_node(
             'Control', 'WhileControl')
         self.tree.add_child_node(while_tree.root, father)
 
         self.index += 1
         if self.tokens[self.index].type == 'LL_BRACKET':
-            tmp_index = self.index
-            while self.tokens[tmp_index].type != 'RL_BRACKET':
-                tmp_index += 1
+            # 右小括号位置
+            tmp_index = self.tokens.partner(self.index)
+            self.index += 1
             self._expression(while_tree.root, tmp_index)
+            # 跳过右小括号
+            self.index = tmp_index + 1
 
             if self.tokens[self.index].type == 'LB_BRACKET':
                 self._block(while_tree)
@@ -537,7 +1405,7 @@ class Parser(object):
     # for语句
     def _for(self, father=None):
         for_tree = SyntaxTree()
-        for_tree.current = for_tree.root = SyntaxTreeNode(
+        for_tree.current = for_tree.root = self.new_node(
             'Control', 'ForControl')
         self.tree.add_child_node(for_tree.root, father)
         # 标记for语句是否结束
@@ -548,11 +1416,9 @@ class Parser(object):
                 self.index += 1
             # 左小括号
             elif token_type == 'LL_BRACKET':
-                self.index += 1
                 # 首先找到右小括号的位置
-                tmp_index = self.index
-                while self.tokens[tmp_index].type != 'RL_BRACKET':
-                    tmp_index += 1
+                tmp_index = self.tokens.partner(self.index)
+                self.index += 1
                 # for语句中的第一个分号前的部分
                 self._assignment(for_tree.root)
                 # 两个分号中间的部分
@@ -573,12 +1439,12 @@ class Parser(object):
     # if语句
     def _if_else(self, father=None):
         if_else_tree = SyntaxTree()
-        if_else_tree.current = if_else_tree.root = SyntaxTreeNode(
+        if_else_tree.current = if_else_tree.root = self.new_node(
             'Control', 'IfElseControl')
         self.tree.add_child_node(if_else_tree.root, father)
 
         if_tree = SyntaxTree()
-        if_tree.current = if_tree.root = SyntaxTreeNode('IfControl')
+        if_tree.current = if_tree.root = self.new_node('IfControl')
         if_else_tree.add_child_node(if_tree.root)
 
         # if标志
@@ -586,11 +1452,9 @@ class Parser(object):
             self.index += 1
             # 左小括号
             if self.tokens[self.index].type == 'LL_BRACKET':
-                self.index += 1
                 # 右小括号位置
-                tmp_index = self.index
-                while self.tokens[tmp_index].type != 'RL_BRACKET':
-                    tmp_index += 1
+                tmp_index = self.tokens.partner(self.index)
+                self.index += 1
                 self._expression(if_tree.root, tmp_index)
                 self.index += 1
             else:
@@ -605,7 +1469,7 @@ class Parser(object):
         if self.tokens[self.index].type == 'ELSE':
             self.index += 1
             else_tree = SyntaxTree()
-            else_tree.current = else_tree.root = SyntaxTreeNode('ElseControl')
+            else_tree.current = else_tree.root = self.new_node('ElseControl')
             if_else_tree.add_child_node(else_tree.root, if_else_tree.root)
             # 左大括号
             if self.tokens[self.index].type == 'LB_BRACKET':
@@ -623,132 +1487,123 @@ class Parser(object):
             print 'error: control style not supported!'
             exit()
 
-    # 表达式-->TODO
+    # 表达式，用运算符优先级分析一遍直接建出语法树，index为表达式之后的token下标
+    # 同一优先级的运算符是右结合的，和原来的逆波兰表达式实现一致
     def _expression(self, father=None, index=None):
         if not father:
             father = self.tree.root
-        # 运算符优先级
-        operator_priority = {'>': 0, '<': 0, '>=': 0, '<=': 0,
-                             '+': 1, '-': 1, '*': 2, '/': 2, '++': 3, '--': 3, '!': 3}
-        # 运算符栈
+        # 操作数栈，保存已经建好的子树的根节点
+        operand_stack = []
+        # 运算符栈，保存(优先级, 运算符节点)，左括号为None
         operator_stack = []
-        # 转换成的逆波兰表达式结果
-        reverse_polish_expression = []
-        # 中缀表达式转为后缀表达式，即逆波兰表达式
+        # 下一个token应该是操作数还是运算符
+        expect_operand = True
         while self.tokens[self.index].type != 'SEMICOLON':
             if index and self.index >= index:
                 break
-            # 如果是常量
-            if self.tokens[self.index].type == 'DIGIT_CONSTANT':
-                tree = SyntaxTree()
-                tree.current = tree.root = SyntaxTreeNode(
-                    'Expression', 'Constant')
-                tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, '_Constant'))
-                reverse_polish_expression.append(tree)
-            # 如果是变量或者数组的某元素
-            elif self.tokens[self.index].type == 'IDENTIFIER':
-                # 变量
-                if self.tokens[self.index + 1].value in operators or self.tokens[self.index + 1].type == 'SEMICOLON':
-                    tree = SyntaxTree()
-                    tree.current = tree.root = SyntaxTreeNode(
-                        'Expression', 'Variable')
-                    tree.add_child_node(
-                        SyntaxTreeNode(self.tokens[self.index].value, '_Variable'))
-                    reverse_polish_expression.append(tree)
+            token = self.tokens[self.index]
+            token_type = token.type
+            if expect_operand:
+                # 常量
+                if token_type == 'DIGIT_CONSTANT':
+                    node = self.new_node('Expression', 'Constant')
+                    self.tree.add_child_node(self.new_node(token.value, '_Constant'), node)
+                    operand_stack.append(node)
+                    expect_operand = False
                 # 数组的某一个元素ID[i]
-                elif self.tokens[self.index + 1].type == 'LM_BRACKET':
-                    tree = SyntaxTree()
-                    tree.current = tree.root = SyntaxTreeNode(
-                        'Expression', 'ArrayItem')
-                    # 数组的名字
-                    tree.add_child_node(
-                        SyntaxTreeNode(self.tokens[self.index].value, '_ArrayName'))
+                elif token_type == 'IDENTIFIER' and self.tokens[self.index + 1].type == 'LM_BRACKET':
+                    node = self.new_node('Expression', 'ArrayItem')
+                    self.tree.add_child_node(self.new_node(token.value, '_ArrayName'), node)
                     self.index += 2
                     if self.tokens[self.index].type != 'DIGIT_CONSTANT' and self.tokens[self.index].type != 'IDENTIFIER':
                         print 'error: 数组下表必须为常量或标识符'
                         print self.tokens[self.index].type
                         exit()
-                    else:
-                        # 数组下标
-                        tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, '_ArrayIndex'), tree.root)
-                        reverse_polish_expression.append(tree)
-            # 如果是运算符
-            elif self.tokens[self.index].value in operators or self.tokens[self.index].type == 'LL_BRACKET' or self.tokens[self.index].type == 'RL_BRACKET':
-                tree = SyntaxTree()
-                tree.current = tree.root = SyntaxTreeNode(
-                    'Operator', 'Operator')
-                tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, '_Operator'))
-                # 如果是左括号，直接压栈
-                if self.tokens[self.index].type == 'LL_BRACKET':
-                    operator_stack.append(tree.root)
-                # 如果是右括号，弹栈直到遇到左括号为止
-                elif self.tokens[self.index].type == 'RL_BRACKET':
-                    while operator_stack and operator_stack[-1].current.type != 'LL_BRACKET':
-                        reverse_polish_expression.append(operator_stack.pop())
-                    # 将左括号弹出来
-                    if operator_stack:
-                        operator_stack.pop()
-                # 其他只能是运算符
+                    # 数组下标
+                    self.tree.add_child_node(
+                        self.new_node(self.tokens[self.index].value, '_ArrayIndex'), node)
+                    # 跳过右中括号
+                    self.index += 1
+                    operand_stack.append(node)
+                    expect_operand = False
+                # 变量
+                elif token_type == 'IDENTIFIER':
+                    node = self.new_node('Expression', 'Variable')
+                    self.tree.add_child_node(self.new_node(token.value, '_Variable'), node)
+                    operand_stack.append(node)
+                    expect_operand = False
+                # 左括号
+                elif token_type == 'LL_BRACKET':
+                    operator_stack.append(None)
+                # 前置的单目运算符
+                elif token.value in self.UNARY_OPERATORS:
+                    operator_stack.append((self.OPERATOR_PRIORITY[token.value], self._operator_node(token.value)))
                 else:
-                    while operator_stack and operator_priority[tree.current.value] < operator_priority[operator_stack[-1].current.value]:
-                        reverse_polish_expression.append(operator_stack.pop())
-                    operator_stack.append(tree)
-            self.index += 1
-        # 最后将符号栈清空，最终得到逆波兰表达式reverse_polish_expression
-        while operator_stack:
-            reverse_polish_expression.append(operator_stack.pop())
-        # 打印
-        # for item in reverse_polish_expression:
-        #   print item.current.value,
-        # print
-
-        # 操作数栈
-        operand_stack = []
-        child_operators = [['!', '++', '--'], [
-            '+', '-', '*', '/', '>', '<', '>=', '<=']]
-        for item in reverse_polish_expression:
-            if item.root.type != 'Operator':
-                operand_stack.append(item)
+                    print 'expression error: unexpected %s!' % token.value
+                    exit()
             else:
-                # 处理单目运算符
-                if item.current.value in child_operators[0]:
-                    a = operand_stack.pop()
-                    new_tree = SyntaxTree()
-                    new_tree.current = new_tree.root = SyntaxTreeNode(
-                        'Expression', 'SingleOperand')
-                    # 添加操作符
-                    new_tree.add_child_node(item.root)
-                    # 添加操作数
-                    new_tree.add_child_node(a.root, new_tree.root)
-                    operand_stack.append(new_tree)
-                # 双目运算符
-                elif item.current.value in child_operators[1]:
-                    b = operand_stack.pop()
-                    a = operand_stack.pop()
-                    new_tree = SyntaxTree()
-                    new_tree.current = new_tree.root = SyntaxTreeNode(
-                        'Expression', 'DoubleOperand')
-                    # 第一个操作数
-                    new_tree.add_child_node(a.root)
-                    # 操作符
-                    new_tree.add_child_node(item.root, new_tree.root)
-                    # 第二个操作数
-                    new_tree.add_child_node(b.root, new_tree.root)
-                    operand_stack.append(new_tree)
+                # 右括号，归约到对应的左括号为止
+                if token_type == 'RL_BRACKET' and None in operator_stack:
+                    while operator_stack[-1] is not None:
+                        self._reduce(operand_stack, operator_stack)
+                    operator_stack.pop()
+                # 后置的单目运算符，优先级最高，直接作用于前一个操作数
+                elif token.value in self.UNARY_OPERATORS:
+                    node = self.new_node('Expression', 'SingleOperand')
+                    self.tree.add_child_node(self._operator_node(token.value), node)
+                    self.tree.add_child_node(operand_stack.pop(), node)
+                    operand_stack.append(node)
+                # 双目运算符，优先级更高的运算符先归约
+                elif token.value in self.BINARY_OPERATORS:
+                    priority = self.OPERATOR_PRIORITY[token.value]
+                    while operator_stack and operator_stack[-1] is not None and priority < operator_stack[-1][0]:
+                        self._reduce(operand_stack, operator_stack)
+                    operator_stack.append((priority, self._operator_node(token.value)))
+                    expect_operand = True
                 else:
-                    print 'operator %s not supported!' % item.current.value
+                    print 'expression error: unexpected %s!' % token.value
                     exit()
-        self.tree.add_child_node(operand_stack[0].root, father)
+            self.index += 1
+        if expect_operand:
+            print 'expression error: lack of operand!'
+            exit()
+        # 没有配对的左括号直接丢弃
+        while operator_stack:
+            if operator_stack[-1] is None:
+                operator_stack.pop()
+            else:
+                self._reduce(operand_stack, operator_stack)
+        self.tree.add_child_node(operand_stack[0], father)
+
+    # 运算符节点
+    def _operator_node(self, value):
+        node = self.new_node('Operator', 'Operator')
+        self.tree.add_child_node(self.new_node(value, '_Operator'), node)
+        return node
+
+    # 弹出一个运算符和它的操作数，合并成一个操作数
+    def _reduce(self, operand_stack, operator_stack):
+        operator = operator_stack.pop()[1]
+        # 前置的单目运算符
+        if operator.first_son.value in self.UNARY_OPERATORS:
+            node = self.new_node('Expression', 'SingleOperand')
+            self.tree.add_child_node(operator, node)
+            self.tree.add_child_node(operand_stack.pop(), node)
+        # 双目运算符
+        else:
+            b = operand_stack.pop()
+            node = self.new_node('Expression', 'DoubleOperand')
+            self.tree.add_child_node(operand_stack.pop(), node)
+            self.tree.add_child_node(operator, node)
+            self.tree.add_child_node(b, node)
+        operand_stack.append(node)
 
     # 函数调用
     def _function_call(self, father=None):
         if not father:
             father = self.tree.root
         func_call_tree = SyntaxTree()
-        func_call_tree.current = func_call_tree.root = SyntaxTreeNode(
+        func_call_tree.current = func_call_tree.root = self.new_node(
             'FunctionCall')
         self.tree.add_child_node(func_call_tree.root, father)
 
@@ -756,24 +1611,24 @@ class Parser(object):
             # 函数名
             if self.tokens[self.index].type == 'IDENTIFIER':
                 func_call_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'FUNCTION_NAME'))
+                    self.new_node(self.tokens[self.index].value, 'FUNCTION_NAME'))
             # 左小括号
             elif self.tokens[self.index].type == 'LL_BRACKET':
                 self.index += 1
-                params_list = SyntaxTreeNode('CallParameterList')
+                params_list = self.new_node('CallParameterList')
                 func_call_tree.add_child_node(params_list, func_call_tree.root)
                 while self.tokens[self.index].type != 'RL_BRACKET':
                     if self.tokens[self.index].type == 'IDENTIFIER' or self.tokens[self.index].type == 'DIGIT_CONSTANT' or self.tokens[self.index].type == 'STRING_CONSTANT':
                         func_call_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, self.tokens[self.index].type), params_list)
+                            self.new_node(self.tokens[self.index].value, self.tokens[self.index].type), params_list)
                     elif self.tokens[self.index].type == 'DOUBLE_QUOTE':
                         self.index += 1
                         func_call_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, self.tokens[self.index].type), params_list)
+                            self.new_node(self.tokens[self.index].value, self.tokens[self.index].type), params_list)
                         self.index += 1
                     elif self.tokens[self.index].type == 'ADDRESS':
                         func_call_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, 'ADDRESS'), params_list)
+                            self.new_node(self.tokens[self.index].value, 'ADDRESS'), params_list)
                     self.index += 1
             else:
                 print 'function call error!'
@@ -786,61 +1641,38 @@ class Parser(object):
         if not father:
             father = self.tree.root
         return_tree = SyntaxTree()
-        return_tree.current = return_tree.root = SyntaxTreeNode('Return')
+        return_tree.current = return_tree.root = self.new_node('Return')
         self.tree.add_child_node(return_tree.root, father)
         while self.tokens[self.index].type != 'SEMICOLON':
             # 被赋值的变量
             if self.tokens[self.index].type == 'RETURN':
                 return_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value))
+                    self.new_node(self.tokens[self.index].value))
                 self.index += 1
             else:
                 self._expression(return_tree.root)
         self.index += 1
 
-    # 根据一个句型的句首判断句型
+    # 根据一个句型的句首判断句型，在预测分析表中查Sentence的产生式
     def _judge_sentence_pattern(self):
-        token_value = self.tokens[self.index].value
-        token_type = self.tokens[self.index].type
-        # include句型
-        if token_type == 'SHARP' and self.tokens[self.index + 1].type == 'INCLUDE':
-            return 'INCLUDE'
-        # 控制句型
-        elif token_value in keywords[1]:
-            return 'CONTROL'
-        # 有可能是声明语句或者函数声明语句
-        elif token_value in keywords[0] and self.tokens[self.index + 1].type == 'IDENTIFIER':
-            index_2_token_type = self.tokens[self.index + 2].type
-            if index_2_token_type == 'LL_BRACKET':
-                return 'FUNCTION_STATEMENT'
-            elif index_2_token_type == 'SEMICOLON' or index_2_token_type == 'LM_BRACKET' or index_2_token_type == 'COMMA':
-                return 'STATEMENT'
-            else:
-                return 'ERROR'
-        # 可能为函数调用或者赋值语句
-        elif token_type == 'IDENTIFIER':
-            index_1_token_type = self.tokens[self.index + 1].type
-            if index_1_token_type == 'LL_BRACKET':
-                return 'FUNCTION_CALL'
-            elif index_1_token_type == 'ASSIGN':
-                return 'ASSIGNMENT'
-            else:
-                return 'ERROR'
-        # return语句
-        elif token_type == 'RETURN':
-            return 'RETURN'
-        # 右大括号，表明函数的结束
-        elif token_type == 'RB_BRACKET':
-            self.index += 1
-            return 'RB_BRACKET'
-        else:
+        production = self.predict_table.predict('Sentence', self.tokens, self.index)
+        if production is None:
+            return 'ERROR'
+        symbols = production[1]
+        # 空串，右大括号表明语句块的结束
+        if not symbols:
+            if self.tokens.type_id(self.index) == TOKEN_TYPE_ID['RB_BRACKET']:
+                self.index += 1
+                return 'RB_BRACKET'
             return 'ERROR'
+        return self.SENTENCE_PATTERNS[symbols[0]]
 
     # 主程序
     def main(self):
         # 根节点
-        self.tree.current = self.tree.root = SyntaxTreeNode('Sentence')
-        while self.index < len(self.tokens):
+        self.tree.current = self.tree.root = self.new_node('Sentence')
+        while self.tokens.has(self.index):
+            self.tokens.release(self.index)
             # 句型
             sentence_pattern = self._judge_sentence_pattern()
             # 如果是include句型
@@ -862,125 +1694,1886 @@ class Parser(object):
 
     # DFS遍历语法树
     def display(self, node):
-        if not node:
-            return
-        print '( self: %s %s, father: %s, left: %s, right: %s )' % (node.value, node.type, node.father.value if node.father else None, node.left.value if node.left else None, node.right.value if node.right else None)
-        child = node.first_son
-        while child:
-            self.display(child)
-            child = child.right
+        for line in self.display_lines(node):
+            print line
 
+    # DFS遍历语法树，产生display要打印的每一行
+    @staticmethod
+    def display_lines(node):
+        for node in SyntaxTree.preorder(node):
+            yield '( self: %s %s, father: %s, left: %s, right: %s )' % (node.value, node.type, node.father.value if node.father else None, node.left.value if node.left else None, node.right.value if node.right else None)
 
-class AssemblerFileHandler(object):
-    '''维护生成的汇编文件'''
 
-    def __init__(self):
-        self.result = ['.data', '.bss', '.lcomm bss_tmp, 4', '.text']
-        self.data_pointer = 1
-        self.bss_pointer = 3
-        self.text_pointer = 4
+class ConstantFolder(object):
+    '''常量折叠和常量传播，在生成汇编之前直接改写语法树中的表达式，生成完之后可以撤销改写'''
 
-    def insert(self, value, _type):
-        # 插入到data域
-        if _type == 'DATA':
-            self.result.insert(self.data_pointer, value)
-            self.data_pointer += 1
-            self.bss_pointer += 1
-            self.text_pointer += 1
-        # 插入到bss域
-        elif _type == 'BSS':
-            self.result.insert(self.bss_pointer, value)
-            self.bss_pointer += 1
-            self.text_pointer += 1
-        # 插入到代码段
-        elif _type == 'TEXT':
-            self.result.insert(self.text_pointer, value)
-            self.text_pointer += 1
+    # 句型到处理方法的映射，含有语句块的句型的处理方法是生成器，产生(语句块的第一个节点, 已知的常量)
+    NODE_HANDLERS = {
+        'Sentence': '_sentence',
+        'FunctionStatement': '_function_statement',
+        'Statement': '_statement',
+        'FunctionCall': '_function_call',
+        'Assignment': '_assignment',
+        'Control': '_control',
+        'Expression': '_expression_sentence',
+        'Return': '_return',
+    }
+    # 控制语句的type到处理方法的映射
+    CONTROL_HANDLERS = {
+        'IfElseControl': '_control_if',
+        'ForControl': '_control_for',
+        'WhileControl': '_control_while',
+    }
+    # 可以折叠的运算符，比较运算符生成的是跳转，不折叠
+    FOLD_OPERATORS = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.div}
+    # 整数常量
+    INT_PATTERN = re.compile(r'-?[0-9]+$')
+
+    def __init__(self, tree):
+        self.tree = tree
+        # 变量名到数据类型的映射
+        self.field_types = {}
+        # 对语法树的修改，(节点, 属性, 原来的值)，用于撤销
+        self.changes = []
+        # 折叠的运算和传播的变量的个数
+        self.folded = 0
+        self.propagated = 0
+
+    # 修改节点的属性并记录下来
+    def _set(self, node, name, value):
+        self.changes.append((node, name, getattr(node, name)))
+        if name == 'value':
+            node.set_value(value)
+        elif name == 'type':
+            node.set_type(value)
         else:
-            print 'error!'
-            exit()
+            setattr(node, name, value)
 
-    # 将结果保存到文件中
-    def generate_ass_file(self):
-        self.file = open(file_name + '.S', 'w+')
-        self.file.write('\n'.join(self.result) + '\n')
-        self.file.close()
+    # 撤销所有修改，恢复分析出来的语法树
+    def undo(self):
+        while self.changes:
+            node, name, value = self.changes.pop()
+            if name == 'value':
+                node.set_value(value)
+            elif name == 'type':
+                node.set_type(value)
+            else:
+                setattr(node, name, value)
 
+    # 32位有符号整数的溢出
+    def _wrap(self, value):
+        return (value + 0x80000000) % 0x100000000 - 0x80000000
 
-class Assembler(object):
-    '''编译成汇编语言'''
+    # 表达式为整数常量时返回它的值
+    def _int_value(self, node):
+        if node.type == 'Constant' and self.INT_PATTERN.match(node.first_son.value):
+            return int(node.first_son.value)
+        return None
 
-    def __init__(self):
-        self.parser = Parser()
-        self.parser.main()
-        # 生成的语法树
-        self.tree = self.parser.tree
-        # 要生成的汇编文件管理器
-        self.ass_file_handler = AssemblerFileHandler()
-        # 符号表
-        self.symbol_table = {}
-        # 语法类型
-        self.sentence_type = ['Sentence', 'Include', 'FunctionStatement',
-                              'Statement', 'FunctionCall', 'Assignment', 'Control', 'Expression', 'Return']
-        # 表达式中的符号栈
-        self.operator_stack = []
-        # 表达式中的操作符栈
-        self.operand_stack = []
-        # 已经声明了多少个label
-        self.label_cnt = 0
-        # ifelse中的标签
-        self.labels_ifelse = {}
+    # 子树中被赋值、自增自减、取地址或者重新声明的变量
+    def _assigned(self, node):
+        names = set()
+        for current_node in SyntaxTree.preorder(node):
+            if current_node.value == 'Assignment':
+                names.add(current_node.first_son.value)
+            elif current_node.type == 'IDENTIFIER' and current_node.father and \
+                    current_node.father.value == 'Statement':
+                names.add(current_node.value)
+            elif current_node.type == 'ADDRESS' and current_node.right:
+                names.add(current_node.right.value)
+            elif current_node.type == 'SingleOperand':
+                operand = current_node.last_son
+                if operand.type == 'Variable':
+                    names.add(operand.first_son.value)
+        return names
 
-    # include句型
-    def _include(self, node=None):
-        pass
+    # 改写表达式，已知值的整型变量换成常量，两边都是整数常量的运算换成结果
+    def _expression(self, node, known):
+        for current_node in SyntaxTree.postorder(node):
+            if current_node.value != 'Expression':
+                continue
+            if current_node.type == 'Variable':
+                name = current_node.first_son.value
+                # 自增自减的操作数必须是变量
+                father = current_node.father
+                if name in known and not (father and father.type == 'SingleOperand'):
+                    self._set(current_node, 'type', 'Constant')
+                    self._set(current_node.first_son, 'type', '_Constant')
+                    self._set(current_node.first_son, 'value', str(known[name]))
+                    self.propagated += 1
+            elif current_node.type == 'DoubleOperand':
+                left = current_node.first_son
+                right = current_node.last_son
+                operator_value = left.right.first_son.value
+                value_a = self._int_value(left)
+                value_b = self._int_value(right)
+                if operator_value not in self.FOLD_OPERATORS or value_a is None or value_b is None:
+                    continue
+                if operator_value == '/':
+                    if value_b == 0:
+                        continue
+                    # 和C一样向0取整
+                    value = abs(value_a) // abs(value_b)
+                    if (value_a < 0) != (value_b < 0):
+                        value = -value
+                else:
+                    value = self.FOLD_OPERATORS[operator_value](value_a, value_b)
+                # 左边常量的叶子节点改成结果，作为这个表达式唯一的儿子
+                leaf = left.first_son
+                self._set(leaf, 'value', str(self._wrap(value)))
+                self._set(leaf, 'father', current_node)
+                self._set(current_node, 'first_son', leaf)
+                self._set(current_node, 'last_son', leaf)
+                self._set(current_node, 'type', 'Constant')
+                self.folded += 1
 
-    # 函数定义句型
-    def _function_statement(self, node=None):
-        # 第一个儿子
+    # 依次处理node及其之后的兄弟节点，产生其中各语句块的第一个节点和块中已知的常量
+    def _sentences(self, node, known):
+        while node:
+            method = self.NODE_HANDLERS.get(node.value)
+            blocks = getattr(self, method)(node, known) if method else None
+            if blocks is not None:
+                for block in blocks:
+                    yield block
+            node = node.right
+
+    # 遍历语法树，语句块的嵌套用显式的栈代替递归
+    def main(self):
+        stack = [self._sentences(self.tree.root, {})]
+        while stack:
+            try:
+                first, known = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+            else:
+                stack.append(self._sentences(first, known))
+        return self
+
+    # 语句块
+    def _sentence(self, node, known):
+        yield node.first_son, known
+
+    # 函数定义，函数体中用一份新的已知常量
+    def _function_statement(self, node, known):
         current_node = node.first_son
         while current_node:
-            if current_node.value == 'FunctionName':
-                if current_node.first_son.value != 'main':
-                    print 'other function statement except for main is not supported!'
-                    exit()
-                else:
-                    self.ass_file_handler.insert('.globl main', 'TEXT')
-                    self.ass_file_handler.insert('main:', 'TEXT')
-                    self.ass_file_handler.insert('finit', 'TEXT')
-            elif current_node.value == 'Sentence':
-                self.traverse(current_node.first_son)
+            if current_node.value == 'Sentence':
+                yield current_node.first_son, dict(known)
             current_node = current_node.right
 
-    # 简单的sizeof
-    def _sizeof(self, _type):
-        size = -1
-        if _type == 'int' or _type == 'float' or _type == 'long':
-            size = 4
-        elif _type == 'char':
-            size = 1
-        elif _type == 'double':
-            size = 8
-        return str(size)
-
-    # 声明语句
-    def _statement(self, node=None):
-        # 对应的汇编代码中的声明语句
-        line = None
-        # 1:初始化的，0:没有初始化
-        flag = 0
-        # 变量数据类型
-        variable_field_type = None
-        # 变量类型，是数组还是单个变量
-        variable_type = None
-        # 变量名
-        variable_name = None
+    # 声明语句，记录变量的数据类型
+    def _statement(self, node, known):
+        field_type = None
         current_node = node.first_son
         while current_node:
-            # 类型
             if current_node.value == 'Type':
-                variable_field_type = current_node.first_son.value
-            # 变量名
+                field_type = current_node.first_son.value
+            elif current_node.type == 'IDENTIFIER':
+                self.field_types[current_node.value] = field_type
+                known.pop(current_node.value, None)
+            current_node = current_node.right
+
+    # 函数调用，取了地址的变量可能被修改，参数不改写
+    def _function_call(self, node, known):
+        for name in self._assigned(node):
+            known.pop(name, None)
+
+    # 赋值语句，整型变量被赋值为整数常量时记下它的值
+    def _assignment(self, node, known):
+        name = node.first_son.value
+        expression = node.first_son.right
+        self._expression(expression, known)
+        for assigned in self._assigned(expression):
+            known.pop(assigned, None)
+        value = self._int_value(expression)
+        if value is not None and self.field_types.get(name) == 'int':
+            known[name] = value
+        else:
+            known.pop(name, None)
+
+    # 表达式语句
+    def _expression_sentence(self, node, known):
+        self._expression(node, known)
+        for name in self._assigned(node):
+            known.pop(name, None)
+
+    # return语句
+    def _return(self, node, known):
+        self._expression(node.last_son, known)
+
+    # 控制语句，语句中修改的变量在整个语句中都不是已知的常量，按type分派
+    def _control(self, node, known):
+        method = self.CONTROL_HANDLERS.get(node.type)
+        if method:
+            return getattr(self, method)(node, known)
+
+    # for语句，第一部分只执行一次，循环中修改的变量在条件和循环体中都不是常量
+    def _control_for(self, node, known):
+        current_node = node.first_son
+        if current_node and current_node.value == 'Assignment':
+            self._assignment(current_node, known)
+            current_node = current_node.right
+        for name in self._assigned(node):
+            known.pop(name, None)
+        # 循环体中得到的常量不带到循环之后
+        block = dict(known)
+        while current_node:
+            if current_node.value == 'Expression':
+                self._expression(current_node, block)
+            elif current_node.value == 'Sentence':
+                yield current_node.first_son, block
+            current_node = current_node.right
+
+    # if else语句，每个分支从条件之后已知的常量开始
+    def _control_if(self, node, known):
+        for name in self._assigned(node):
+            known.pop(name, None)
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'IfControl':
+                self._expression(current_node.first_son, known)
+                yield current_node.first_son.right.first_son, dict(known)
+            elif current_node.value == 'ElseControl':
+                yield current_node.first_son, dict(known)
+            current_node = current_node.right
+
+    # while语句
+    def _control_while(self, node, known):
+        for name in self._assigned(node):
+            known.pop(name, None)
+        block = dict(known)
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'Expression':
+                self._expression(current_node, block)
+            elif current_node.value == 'Sentence':
+                yield current_node.first_son, block
+            current_node = current_node.right
+
+
+class IRProgram(object):
+    '''三地址码形式的中间表示，指令保存在平行数组中，指令的操作码和操作数都是整数下标'''
+
+    # 操作码，(名字, 打印格式)，opcodes中保存的是在这个列表中的下标，格式中d为目的操作数，a、b为源操作数
+    OPCODES = [
+        ('function', '{a}:'),
+        ('label', '{a}:'),
+        ('jump', 'goto {a}'),
+        ('mov', '{d} = {a}'),
+        ('add', '{d} = {a} + {b}'),
+        ('sub', '{d} = {a} - {b}'),
+        ('mul', '{d} = {a} * {b}'),
+        ('div', '{d} = {a} / {b}'),
+        ('itof', '{d} = (float) {a}'),
+        ('ftoi', '{d} = (int) {a}'),
+        ('load', '{d} = {a}[{b}]'),
+        ('store', '{d}[{a}] = {b}'),
+        ('jl', 'if {a} < {b} goto {d}'),
+        ('jge', 'if {a} >= {b} goto {d}'),
+        ('jg', 'if {a} > {b} goto {d}'),
+        ('jle', 'if {a} <= {b} goto {d}'),
+        ('je', 'if {a} == {b} goto {d}'),
+        ('jne', 'if {a} != {b} goto {d}'),
+        ('param', 'param {a}'),
+        ('call', 'call {a}, {b}'),
+        ('exit', 'exit {a}'),
+    ]
+    OPCODE_ID = dict((name, i) for i, (name, text) in enumerate(OPCODES))
+    # 条件跳转的操作码
+    BRANCHES = frozenset(['jl', 'jge', 'jg', 'jle', 'je', 'jne'])
+    # 写目的操作数的操作码，目的操作数为变量或者虚拟寄存器
+    DEFINITIONS = frozenset(['mov', 'add', 'sub', 'mul', 'div', 'itof', 'ftoi', 'load'])
+
+    def __init__(self):
+        # 操作数表，每个操作数为(种类, 值)，种类为VREG、CONSTANT、VARIABLE、ADDRESS、STRING、LABEL、FUNCTION
+        self.values = []
+        self.value_ids = {}
+        # 每条指令的操作码、目的操作数和两个源操作数，操作数为操作数表中的下标，-1表示没有
+        self.opcodes = array('B')
+        self.dests = array('i')
+        self.operands_a = array('i')
+        self.operands_b = array('i')
+        # 每个虚拟寄存器的数据类型
+        self.vreg_types = []
+        # 声明的变量和数组，名字到{'id', 'type', 'field_type', 'size', 'values'}，以及声明的顺序，id为在声明顺序中的下标
+        self.symbols = {}
+        self.declarations = []
+        # 字符串常量，(标号, 内容)
+        self.strings = []
+        # 已经用了多少个标号，和Assembler一样命名为label_N
+        self.label_cnt = 0
+
+    # 操作数在操作数表中的下标
+    def operand(self, kind, value):
+        key = (kind, value)
+        value_id = self.value_ids.get(key)
+        if value_id is None:
+            value_id = self.value_ids[key] = len(self.values)
+            self.values.append(key)
+        return value_id
+
+    # 操作数的种类
+    def kind(self, value_id):
+        return self.values[value_id][0]
+
+    # 新的虚拟寄存器
+    def new_vreg(self, field_type):
+        self.vreg_types.append(field_type)
+        return self.operand('VREG', len(self.vreg_types) - 1)
+
+    # 新的标号
+    def new_label(self):
+        label = 'label_' + str(self.label_cnt)
+        self.label_cnt += 1
+        return self.operand('LABEL', label)
+
+    # 新的字符串常量，返回它的标号
+    def new_string(self, text):
+        label = 'label_' + str(self.label_cnt)
+        self.label_cnt += 1
+        self.strings.append((label, text))
+        return self.operand('STRING', label)
+
+    # 声明一个变量或者数组
+    def declare(self, name, variable_type, field_type, size=None, values=None):
+        if name in self.symbols:
+            variable_id = self.symbols[name]['id']
+        else:
+            variable_id = len(self.declarations)
+            self.declarations.append(name)
+        self.symbols[name] = {'id': variable_id, 'type': variable_type, 'field_type': field_type, 'size': size,
+                              'values': values}
+
+    # 操作数的数据类型，int或者float
+    def field_type(self, value_id):
+        kind, value = self.values[value_id]
+        if kind == 'VREG':
+            return self.vreg_types[value]
+        elif kind == 'CONSTANT':
+            return 'float' if '.' in value else 'int'
+        elif kind == 'VARIABLE':
+            return self.symbols[value]['field_type']
+        return 'int'
+
+    # 添加一条指令，返回它的下标
+    def emit(self, opcode, dest=-1, operand_a=-1, operand_b=-1):
+        self.opcodes.append(self.OPCODE_ID[opcode])
+        self.dests.append(dest)
+        self.operands_a.append(operand_a)
+        self.operands_b.append(operand_b)
+        return len(self.opcodes) - 1
+
+    # 指令条数
+    def __len__(self):
+        return len(self.opcodes)
+
+    # 只保留keep中不为0的指令
+    def compact(self, keep):
+        for name in ['opcodes', 'dests', 'operands_a', 'operands_b']:
+            instructions = getattr(self, name)
+            kept = [value for value, flag in zip(instructions, keep) if flag]
+            setattr(self, name, array(instructions.typecode, kept))
+
+    # 每个函数的名字和指令范围，(名字, 第一条指令的下标, 最后一条指令之后的下标)
+    def functions(self):
+        function_id = self.OPCODE_ID['function']
+        starts = [index for index, opcode in enumerate(self.opcodes) if opcode == function_id]
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else len(self.opcodes)
+            yield self.text(self.operands_a[start]), start, end
+
+    # 操作数的写法
+    def text(self, value_id):
+        if value_id < 0:
+            return ''
+        kind, value = self.values[value_id]
+        if kind == 'VREG':
+            return 't' + str(value)
+        elif kind == 'ADDRESS':
+            return '&' + value
+        return value
+
+    # 第index条指令的写法
+    def instruction_text(self, index):
+        name, text = self.OPCODES[self.opcodes[index]]
+        return text.format(d=self.text(self.dests[index]), a=self.text(self.operands_a[index]),
+                           b=self.text(self.operands_b[index]))
+
+    # 打印中间代码的每一行，先是声明，然后是指令
+    def lines(self):
+        for name in self.declarations:
+            item = self.symbols[name]
+            if item['type'] == 'VARIABLE':
+                yield '%s %s' % (item['field_type'], name)
+            elif item['values'] is None:
+                yield '%s %s[%s]' % (item['field_type'], name, item['size'])
+            else:
+                yield '%s %s[%s] = {%s}' % (item['field_type'], name, item['size'], ', '.join(item['values']))
+        for label, text in self.strings:
+            yield '%s = "%s"' % (label, text)
+        for index in xrange(len(self.opcodes)):
+            line = self.instruction_text(index)
+            yield line if line.endswith(':') else '    ' + line
+
+
+class IRBuilder(object):
+    '''把语法树翻译成三地址码，表达式的临时结果放在虚拟寄存器中'''
+
+    # 句型到处理方法的映射，含有语句块的句型的处理方法是生成器，产生各语句块的第一个节点
+    NODE_HANDLERS = {
+        'Sentence': '_sentence',
+        'FunctionStatement': '_function_statement',
+        'Statement': '_statement',
+        'FunctionCall': '_function_call',
+        'Assignment': '_assignment',
+        'Control': '_control',
+        'Expression': '_expression_sentence',
+        'Return': '_return',
+    }
+    # 控制语句的type到处理方法的映射
+    CONTROL_HANDLERS = {
+        'IfElseControl': '_control_if',
+        'ForControl': '_control_for',
+        'WhileControl': '_control_while',
+    }
+    # 算术运算符的操作码
+    ARITHMETIC_OPCODES = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'div'}
+    # 比较运算符的条件跳转，(成立时跳转, 不成立时跳转)
+    COMPARE_JUMPS = {'<': ('jl', 'jge'), '>=': ('jge', 'jl'), '>': ('jg', 'jle'), '<=': ('jle', 'jg')}
+    # 自增自减的操作码
+    UNARY_OPCODES = {'++': 'add', '--': 'sub'}
+
+    def __init__(self, tree):
+        self.tree = tree
+        # 翻译的结果
+        self.program = IRProgram()
+
+    # 变量名对应的操作数，只支持int和float
+    def _variable(self, name):
+        item = self.program.symbols.get(name)
+        if item is None:
+            print 'variable %s is not declared!' % name
+            exit()
+        if item['type'] != 'VARIABLE':
+            print '%s is an array!' % name
+            exit()
+        if item['field_type'] not in ['int', 'float']:
+            print 'field type except int and float not supported!'
+            exit()
+        return self.program.operand('VARIABLE', name)
+
+    # 把操作数转换成field_type类型，常数直接转换，转换成float时和itof存入float变量一样舍入到单精度
+    def _convert(self, value, field_type):
+        program = self.program
+        if program.field_type(value) == field_type:
+            return value
+        if program.kind(value) == 'CONSTANT':
+            constant = program.values[value][1]
+            if field_type == 'float':
+                constant = struct.unpack('f', struct.pack('f', float(constant)))[0]
+                return program.operand('CONSTANT', repr(constant))
+            return program.operand('CONSTANT', str(int(float(constant))))
+        result = program.new_vreg(field_type)
+        program.emit('itof' if field_type == 'float' else 'ftoi', result, value)
+        return result
+
+    # 两个操作数中有float时都转换成float
+    def _unify(self, value_a, value_b):
+        program = self.program
+        if program.field_type(value_a) == 'float' or program.field_type(value_b) == 'float':
+            return self._convert(value_a, 'float'), self._convert(value_b, 'float')
+        return value_a, value_b
+
+    # 数组元素的数组名和下标
+    def _array_index(self, node):
+        program = self.program
+        name = node.first_son.value
+        if name not in program.symbols or program.symbols[name]['type'] != 'LIST':
+            print '%s is not an array!' % name
+            exit()
+        if program.symbols[name]['field_type'] not in ['int', 'float']:
+            print 'field type except int and float not supported!'
+            exit()
+        index = node.last_son.value
+        if index.isdigit():
+            index = program.operand('CONSTANT', index)
+        else:
+            index = self._convert(self._variable(index), 'int')
+        return program.operand('VARIABLE', name), index
+
+    # 自增自减，操作数必须是变量或者数组元素，表达式的值为运算之后的值
+    def _unary(self, node, value):
+        program = self.program
+        opcode = self.UNARY_OPCODES[node.first_son.first_son.value]
+        one = self._convert(program.operand('CONSTANT', '1'), program.field_type(value))
+        operand_node = node.last_son
+        if operand_node.type == 'Variable':
+            program.emit(opcode, value, value, one)
+            return value
+        elif operand_node.type == 'ArrayItem':
+            result = program.new_vreg(program.field_type(value))
+            program.emit(opcode, result, value, one)
+            array_name, index = self._array_index(operand_node)
+            program.emit('store', array_name, index, result)
+            return result
+        print 'operand of %s must be a variable!' % node.first_son.first_son.value
+        exit()
+
+    # 双目运算，比较运算的结果为0或者1
+    def _binary(self, operator_value, value_a, value_b):
+        program = self.program
+        value_a, value_b = self._unify(value_a, value_b)
+        if operator_value in self.COMPARE_JUMPS:
+            result = program.new_vreg('int')
+            label = program.new_label()
+            program.emit('mov', result, program.operand('CONSTANT', '0'))
+            program.emit(self.COMPARE_JUMPS[operator_value][1], label, value_a, value_b)
+            program.emit('mov', result, program.operand('CONSTANT', '1'))
+            program.emit('label', -1, label)
+            return result
+        elif operator_value in self.ARITHMETIC_OPCODES:
+            result = program.new_vreg(program.field_type(value_a))
+            program.emit(self.ARITHMETIC_OPCODES[operator_value], result, value_a, value_b)
+            return result
+        print 'operator not supported!'
+        exit()
+
+    # 翻译表达式，返回结果所在的操作数
+    def _expression(self, node):
+        program = self.program
+        values = []
+        for current_node in SyntaxTree.postorder(node):
+            if current_node.value != 'Expression':
+                continue
+            _type = current_node.type
+            if _type == 'Constant':
+                values.append(program.operand('CONSTANT', current_node.first_son.value))
+            elif _type == 'Variable':
+                values.append(self._variable(current_node.first_son.value))
+            elif _type == 'ArrayItem':
+                array_name, index = self._array_index(current_node)
+                result = program.new_vreg(program.field_type(array_name))
+                program.emit('load', result, array_name, index)
+                values.append(result)
+            elif _type == 'SingleOperand':
+                values.append(self._unary(current_node, values.pop()))
+            elif _type == 'DoubleOperand':
+                value_b = values.pop()
+                value_a = values.pop()
+                values.append(self._binary(current_node.first_son.right.first_son.value, value_a, value_b))
+        return values[-1]
+
+    # 条件不成立时跳转到label
+    def _condition(self, node, label):
+        program = self.program
+        if node.type == 'DoubleOperand':
+            operator_value = node.first_son.right.first_son.value
+            if operator_value in self.COMPARE_JUMPS:
+                value_a = self._expression(node.first_son)
+                value_b = self._expression(node.last_son)
+                value_a, value_b = self._unify(value_a, value_b)
+                program.emit(self.COMPARE_JUMPS[operator_value][1], label, value_a, value_b)
+                return
+        value = self._expression(node)
+        zero = self._convert(program.operand('CONSTANT', '0'), program.field_type(value))
+        program.emit('je', label, value, zero)
+
+    # 依次处理node及其之后的兄弟节点，产生其中各语句块要遍历的第一个节点
+    def _sentences(self, node=None):
+        while node:
+            method = self.NODE_HANDLERS.get(node.value)
+            blocks = getattr(self, method)(node) if method else None
+            if blocks is not None:
+                for first in blocks:
+                    yield first
+            node = node.right
+
+    # 遍历语法树翻译成三地址码，语句块的嵌套用显式的栈代替递归
+    def traverse(self, node=None):
+        stack = [self._sentences(node)]
+        while stack:
+            try:
+                first = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+            else:
+                stack.append(self._sentences(first))
+        return self.program
+
+    # 语句块
+    def _sentence(self, node=None):
+        yield node.first_son
+
+    # 函数定义，函数体最后没有return时和C一样返回0
+    def _function_statement(self, node=None):
+        program = self.program
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'FunctionName':
+                if current_node.first_son.value != 'main':
+                    print 'other function statement except for main is not supported!'
+                    exit()
+                program.emit('function', -1, program.operand('FUNCTION', 'main'))
+            elif current_node.value == 'Sentence':
+                yield current_node.first_son
+                if not current_node.last_son or current_node.last_son.value != 'Return':
+                    program.emit('exit', -1, program.operand('CONSTANT', '0'))
+            current_node = current_node.right
+
+    # 声明语句
+    def _statement(self, node=None):
+        field_type = None
+        name = None
+        variable_type = None
+        size = None
+        values = None
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'Type':
+                field_type = current_node.first_son.value
+            elif current_node.type == 'IDENTIFIER':
+                name = current_node.value
+                variable_type = current_node.extra_info['type']
+            elif current_node.type == 'DIGIT_CONSTANT':
+                size = current_node.value
+            elif current_node.value == 'ConstantList':
+                values = []
+                tmp_node = current_node.first_son
+                while tmp_node:
+                    values.append(tmp_node.value)
+                    tmp_node = tmp_node.right
+            current_node = current_node.right
+        self.program.declare(name, variable_type, field_type, size, values)
+
+    # 函数调用，参数依次用param传递
+    def _function_call(self, node=None):
+        program = self.program
+        func_name = node.first_son.value
+        parameters = []
+        current_node = node.first_son.right.first_son if node.first_son.right else None
+        while current_node:
+            if current_node.type == 'STRING_CONSTANT':
+                parameters.append(program.new_string(current_node.value))
+            elif current_node.type == 'DIGIT_CONSTANT':
+                parameters.append(program.operand('CONSTANT', current_node.value))
+            elif current_node.type == 'ADDRESS':
+                current_node = current_node.right
+                self._variable(current_node.value)
+                parameters.append(program.operand('ADDRESS', current_node.value))
+            elif current_node.type == 'IDENTIFIER':
+                parameters.append(self._variable(current_node.value))
+            else:
+                print 'parameter type is not supported yet!'
+                exit()
+            current_node = current_node.right
+        for parameter in parameters:
+            program.emit('param', -1, parameter)
+        program.emit('call', -1, program.operand('FUNCTION', func_name),
+                     program.operand('CONSTANT', str(len(parameters))))
+
+    # 赋值语句，表达式最后一条指令的结果直接写入变量
+    def _assignment(self, node=None):
+        program = self.program
+        target = self._variable(node.first_son.value)
+        value = self._convert(self._expression(node.first_son.right), program.field_type(target))
+        last = len(program) - 1
+        if program.kind(value) == 'VREG' and last >= 0 and program.dests[last] == value:
+            program.dests[last] = target
+        else:
+            program.emit('mov', target, value)
+
+    # for语句，产生循环体中要遍历的第一个节点
+    def _control_for(self, node=None):
+        program = self.program
+        begin = program.new_label()
+        end = program.new_label()
+        # 条件之后的表达式是每次循环最后执行的第三部分
+        condition = True
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'Assignment':
+                self._assignment(current_node)
+            elif current_node.value == 'Expression':
+                if condition:
+                    program.emit('label', -1, begin)
+                    self._condition(current_node, end)
+                    condition = False
+                else:
+                    self._expression(current_node)
+            elif current_node.value == 'Sentence':
+                yield current_node.first_son
+            current_node = current_node.right
+        program.emit('jump', -1, begin)
+        program.emit('label', -1, end)
+
+    # if else语句，依次产生if和else语句块中要遍历的第一个节点
+    def _control_if(self, node=None):
+        program = self.program
+        label_else = program.new_label()
+        # 没有else时不需要跳过else语句块
+        label_end = program.new_label() if node.last_son.value == 'ElseControl' else label_else
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'IfControl':
+                self._condition(current_node.first_son, label_else)
+                yield current_node.first_son.right.first_son
+                if label_end != label_else:
+                    program.emit('jump', -1, label_end)
+                program.emit('label', -1, label_else)
+            elif current_node.value == 'ElseControl':
+                yield current_node.first_son
+                program.emit('label', -1, label_end)
+            current_node = current_node.right
+
+    # while语句
+    def _control_while(self, node=None):
+        program = self.program
+        begin = program.new_label()
+        end = program.new_label()
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'Expression':
+                program.emit('label', -1, begin)
+                self._condition(current_node, end)
+            elif current_node.value == 'Sentence':
+                yield current_node.first_son
+            current_node = current_node.right
+        program.emit('jump', -1, begin)
+        program.emit('label', -1, end)
+
+    # 控制语句，按type分派
+    def _control(self, node=None):
+        method = self.CONTROL_HANDLERS.get(node.type)
+        if method is None:
+            print 'control type not supported!'
+            exit()
+        return getattr(self, method)(node)
+
+    # 表达式语句，结果不需要保存
+    def _expression_sentence(self, node=None):
+        self._expression(node)
+
+    # return语句，main函数返回时退出程序
+    def _return(self, node=None):
+        program = self.program
+        value = self._convert(self._expression(node.last_son), 'int')
+        program.emit('exit', -1, value)
+
+
+class ControlFlowGraph(object):
+    '''三地址码中一个函数的控制流图，基本块用编号表示，入口为0号基本块，支配树用Cooper-Harvey-Kennedy的迭代算法计算'''
+
+    # 之后的指令是新的基本块的开头
+    TERMINATORS = frozenset(['jump', 'exit']) | IRProgram.BRANCHES
+
+    def __init__(self, program, start=0, end=None):
+        self.program = program
+        # 函数的指令在program中的范围
+        self.start = start
+        self.end = len(program) if end is None else end
+        # 每个基本块第一条指令的下标和最后一条指令之后的下标
+        self.starts = array('i')
+        self.ends = array('i')
+        # 每条指令所在的基本块，下标相对于start
+        self.instruction_blocks = array('i')
+        # 标号所在的基本块
+        self.label_blocks = {}
+        # 每个基本块的后继和前驱
+        self.successors = []
+        self.predecessors = []
+        # 从入口可以到达的基本块的逆后序，以及每个基本块在其中的位置，不可到达的为-1
+        self.order = []
+        self.order_numbers = array('i')
+        # 直接支配者，入口的直接支配者为它自己，不可到达的为-1
+        self.idoms = array('i')
+        # 支配树中每个基本块的儿子，以及先序和后序遍历的编号，用于O(1)判断支配关系
+        self.dominator_children = []
+        self.preorder_numbers = array('i')
+        self.postorder_numbers = array('i')
+        self._split()
+        self._link()
+        self._order()
+        self._dominators()
+
+    # 基本块的个数
+    def __len__(self):
+        return len(self.starts)
+
+    # 划分基本块，函数开头、标号和跳转之后的指令开始一个新的基本块
+    def _split(self):
+        program = self.program
+        terminators = set(IRProgram.OPCODE_ID[name] for name in self.TERMINATORS)
+        label_id = IRProgram.OPCODE_ID['label']
+        block = -1
+        leader = True
+        for index in xrange(self.start, self.end):
+            opcode = program.opcodes[index]
+            if leader or opcode == label_id:
+                if block >= 0:
+                    self.ends.append(index)
+                block += 1
+                self.starts.append(index)
+                leader = False
+            if opcode == label_id:
+                self.label_blocks[program.operands_a[index]] = block
+            self.instruction_blocks.append(block)
+            leader = opcode in terminators
+        if block >= 0:
+            self.ends.append(self.end)
+
+    # 基本块之间的边，按照最后一条指令连接跳转目标和紧接着的基本块
+    def _link(self):
+        program = self.program
+        count = len(self.starts)
+        self.successors = [[] for i in xrange(count)]
+        self.predecessors = [[] for i in xrange(count)]
+        jump_id = IRProgram.OPCODE_ID['jump']
+        exit_id = IRProgram.OPCODE_ID['exit']
+        branches = set(IRProgram.OPCODE_ID[name] for name in IRProgram.BRANCHES)
+        for block in xrange(count):
+            last = self.ends[block] - 1
+            opcode = program.opcodes[last]
+            targets = []
+            if opcode == jump_id:
+                targets.append(self.label_blocks[program.operands_a[last]])
+            elif opcode in branches:
+                targets.append(self.label_blocks[program.dests[last]])
+                if block + 1 < count:
+                    targets.append(block + 1)
+            elif opcode != exit_id and block + 1 < count:
+                targets.append(block + 1)
+            for target in targets:
+                if target not in self.successors[block]:
+                    self.successors[block].append(target)
+                    self.predecessors[target].append(block)
+
+    # 从入口深度优先遍历得到逆后序，用显式的栈代替递归
+    def _order(self):
+        count = len(self.starts)
+        visited = bytearray(count)
+        postorder = []
+        stack = [(0, iter(self.successors[0]))] if count else []
+        if count:
+            visited[0] = 1
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if not visited[successor]:
+                    visited[successor] = 1
+                    stack.append((successor, iter(self.successors[successor])))
+                    break
+            else:
+                stack.pop()
+                postorder.append(block)
+        self.order = postorder[::-1]
+        self.order_numbers = array('i', [-1]) * count
+        for number, block in enumerate(self.order):
+            self.order_numbers[block] = number
+
+    # 两个基本块在支配树中的最近公共祖先
+    def _intersect(self, block_a, block_b):
+        numbers = self.order_numbers
+        idoms = self.idoms
+        while block_a != block_b:
+            while numbers[block_a] > numbers[block_b]:
+                block_a = idoms[block_a]
+            while numbers[block_b] > numbers[block_a]:
+                block_b = idoms[block_b]
+        return block_a
+
+    # 按逆后序反复计算直接支配者直到不再变化，再给支配树编号
+    def _dominators(self):
+        count = len(self.starts)
+        self.idoms = idoms = array('i', [-1]) * count
+        if not count:
+            return
+        idoms[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for block in self.order[1:]:
+                new_idom = -1
+                for predecessor in self.predecessors[block]:
+                    if idoms[predecessor] < 0:
+                        continue
+                    new_idom = predecessor if new_idom < 0 else self._intersect(predecessor, new_idom)
+                if idoms[block] != new_idom:
+                    idoms[block] = new_idom
+                    changed = True
+        self.dominator_children = [[] for i in xrange(count)]
+        for block in self.order[1:]:
+            self.dominator_children[idoms[block]].append(block)
+        self.preorder_numbers = array('i', [-1]) * count
+        self.postorder_numbers = array('i', [-1]) * count
+        number = 0
+        stack = [(0, iter(self.dominator_children[0]))]
+        self.preorder_numbers[0] = number
+        while stack:
+            block, children = stack[-1]
+            for child in children:
+                number += 1
+                self.preorder_numbers[child] = number
+                stack.append((child, iter(self.dominator_children[child])))
+                break
+            else:
+                stack.pop()
+                number += 1
+                self.postorder_numbers[block] = number
+
+    # 基本块是否可以从入口到达
+    def reachable(self, block):
+        return self.order_numbers[block] >= 0
+
+    # 第index条指令所在的基本块
+    def block_of(self, index):
+        return self.instruction_blocks[index - self.start]
+
+    # block_a是否支配block_b，不可到达的基本块不被任何基本块支配
+    def dominates(self, block_a, block_b):
+        if self.preorder_numbers[block_a] < 0 or self.preorder_numbers[block_b] < 0:
+            return False
+        return self.preorder_numbers[block_a] <= self.preorder_numbers[block_b] and \
+            self.postorder_numbers[block_b] <= self.postorder_numbers[block_a]
+
+    # 基本块中的指令下标
+    def instructions(self, block):
+        return xrange(self.starts[block], self.ends[block])
+
+    # DOT格式的控制流图，dominators为True时用虚线画出支配树
+    def dot_lines(self, name='cfg', dominators=False):
+        yield 'digraph %s {' % name
+        yield '    node [shape=box, fontname="monospace"];'
+        for block in xrange(len(self.starts)):
+            lines = ['B%d%s' % (block, '' if self.reachable(block) else ' (unreachable)')]
+            lines.extend(self.program.instruction_text(index) for index in self.instructions(block))
+            label = ''.join(line.replace('\\', '\\\\').replace('"', '\\"') + '\\l' for line in lines)
+            yield '    B%d [label="%s"];' % (block, label)
+        for block, successors in enumerate(self.successors):
+            for successor in successors:
+                yield '    B%d -> B%d;' % (block, successor)
+        if dominators:
+            for block in self.order[1:]:
+                yield '    B%d -> B%d [style=dashed, color=gray];' % (self.idoms[block], block)
+        yield '}'
+
+
+class DataflowAnalysis(object):
+    '''控制流图上的数据流分析框架，集合是用python整数表示的位向量，用工作表迭代到不动点
+    子类给出方向、汇合方式和每个基本块的gen、kill集合'''
+
+    # 分析的方向，forward或者backward
+    DIRECTION = 'forward'
+    # 汇合时取并集还是交集，union或者intersection
+    MEET = 'union'
+    # 读操作数的种类，取地址也当作读
+    USE_KINDS = frozenset(['VARIABLE', 'VREG', 'ADDRESS'])
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.program = graph.program
+        self.definition_ids = set(IRProgram.OPCODE_ID[name] for name in IRProgram.DEFINITIONS)
+        # 变量在位向量中的下标为符号表中的id，虚拟寄存器排在所有变量之后
+        self.variable_count = len(self.program.declarations)
+        # 全集，交集汇合时的初值
+        self.universe = 0
+        # 每个基本块的gen、kill集合，以及入口和出口处的集合
+        self.gens = []
+        self.kills = []
+        self.ins = []
+        self.outs = []
+        self._local()
+        self._solve()
+
+    # 操作数对应的位，变量和虚拟寄存器以外的操作数为0
+    def _bit(self, value):
+        kind, name = self.program.values[value]
+        if kind == 'VREG':
+            return 1 << (self.variable_count + name)
+        elif kind in ['VARIABLE', 'ADDRESS']:
+            return 1 << self.program.symbols[name]['id']
+        return 0
+
+    # 第index条指令读的变量和虚拟寄存器
+    def _uses(self, index):
+        program = self.program
+        bits = 0
+        for value in (program.operands_a[index], program.operands_b[index]):
+            if value >= 0 and program.values[value][0] in self.USE_KINDS:
+                bits |= self._bit(value)
+        return bits
+
+    # 第index条指令写的变量或者虚拟寄存器，没有时为-1
+    def _definition(self, index):
+        program = self.program
+        if program.opcodes[index] in self.definition_ids:
+            return program.dests[index]
+        return -1
+
+    # 计算每个基本块的gen、kill集合，子类覆盖，默认都为空集，集合原样经过每个基本块
+    def _local(self):
+        self.gens = [0] * len(self.graph)
+        self.kills = [0] * len(self.graph)
+
+    # 工作表算法，工作表按逆后序(后向分析为后序)排优先级，集合变化时把受影响的基本块放回工作表
+    # 循环中的基本块在离开循环之前就迭代到不动点，不会把变化一遍遍地传到整个函数
+    def _solve(self):
+        graph = self.graph
+        count = len(graph)
+        forward = self.DIRECTION == 'forward'
+        union = self.MEET == 'union'
+        # 前向分析从前驱汇合到入口，后向分析从后继汇合到出口
+        sources = graph.predecessors if forward else graph.successors
+        targets = graph.successors if forward else graph.predecessors
+        initial = 0 if union else self.universe
+        # 没有前驱(后向分析为后继)的基本块汇合的结果为空集
+        merged = [initial] * count
+        results = [initial] * count
+        order = graph.order if forward else graph.order[::-1]
+        # 不可到达的基本块也计算一次，放在最后
+        order = order + [block for block in xrange(count) if not graph.reachable(block)]
+        positions = array('i', [0]) * count
+        for position, block in enumerate(order):
+            positions[block] = position
+        # 工作表中是基本块在order中的位置，一开始所有基本块都在工作表中
+        worklist = range(count)
+        queued = bytearray([1]) * count
+        gens = self.gens
+        kills = self.kills
+        while worklist:
+            block = order[heapq.heappop(worklist)]
+            queued[block] = 0
+            blocks = sources[block]
+            if blocks:
+                value = results[blocks[0]]
+                for source in blocks[1:]:
+                    if union:
+                        value |= results[source]
+                    else:
+                        value &= results[source]
+                merged[block] = value
+            else:
+                merged[block] = 0
+            result = gens[block] | (merged[block] & ~kills[block])
+            if result != results[block]:
+                results[block] = result
+                for target in targets[block]:
+                    if not queued[target]:
+                        queued[target] = 1
+                        heapq.heappush(worklist, positions[target])
+        if forward:
+            self.ins, self.outs = merged, results
+        else:
+            self.ins, self.outs = results, merged
+
+    # 位向量中各个位的下标
+    @staticmethod
+    def members(bits):
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    # 位向量中各元素的写法，子类覆盖，默认为位的下标
+    def names(self, bits):
+        return [str(i) for i in self.members(bits)]
+
+
+class Liveness(DataflowAnalysis):
+    '''活跃变量分析，基本块入口处活跃的变量和虚拟寄存器'''
+
+    DIRECTION = 'backward'
+    MEET = 'union'
+
+    # gen为基本块中先读后写的变量，kill为基本块中写的变量
+    def _local(self):
+        graph = self.graph
+        program = self.program
+        for block in xrange(len(graph)):
+            gen = kill = 0
+            for index in reversed(graph.instructions(block)):
+                dest = self._definition(index)
+                if dest >= 0:
+                    bit = self._bit(dest)
+                    gen &= ~bit
+                    kill |= bit
+                gen |= self._uses(index)
+            self.gens.append(gen)
+            self.kills.append(kill)
+
+    # 由第index条指令之后活跃的集合得到之前活跃的集合
+    def transfer(self, index, live):
+        dest = self._definition(index)
+        if dest >= 0:
+            live &= ~self._bit(dest)
+        return live | self._uses(index)
+
+    # 第index条指令是否只写了之后不再活跃的变量、虚拟寄存器或者数组，live为指令之后活跃的集合
+    def dead(self, index, live):
+        program = self.program
+        opcode = program.opcodes[index]
+        if opcode not in self.definition_ids and opcode != IRProgram.OPCODE_ID['store']:
+            return False
+        return not live & self._bit(program.dests[index])
+
+    # 基本块中每条指令之后活跃的集合，从后向前依次产生(指令下标, 集合)
+    def live_after(self, block):
+        live = self.outs[block]
+        for index in reversed(self.graph.instructions(block)):
+            yield index, live
+            live = self.transfer(index, live)
+
+    # 位的下标对应的变量名或者虚拟寄存器
+    def names(self, bits):
+        declarations = self.program.declarations
+        return [declarations[i] if i < self.variable_count else 't' + str(i - self.variable_count)
+                for i in self.members(bits)]
+
+
+class ReachingDefinitions(DataflowAnalysis):
+    '''到达定值分析，定值为写变量或者虚拟寄存器的指令，scanf的取地址参数和数组元素的写入不会覆盖之前的定值'''
+
+    DIRECTION = 'forward'
+    MEET = 'union'
+
+    # 给所有定值编号，同一个变量的所有定值组成它的kill集合
+    def _local(self):
+        graph = self.graph
+        program = self.program
+        # 每个定值所在的指令，以及每个变量的所有定值
+        self.definitions = []
+        variable_definitions = {}
+        # 每条指令的(定值的位, 写的变量的位, 是否覆盖)
+        effects = {}
+        store_id = IRProgram.OPCODE_ID['store']
+        param_id = IRProgram.OPCODE_ID['param']
+        for index in xrange(graph.start, graph.end):
+            opcode = program.opcodes[index]
+            dest = self._definition(index)
+            strong = True
+            if dest < 0 and opcode == store_id:
+                dest, strong = program.dests[index], False
+            elif dest < 0 and opcode == param_id and program.kind(program.operands_a[index]) == 'ADDRESS':
+                dest, strong = program.operands_a[index], False
+            if dest < 0:
+                continue
+            bit = 1 << len(self.definitions)
+            variable = self._bit(dest)
+            self.definitions.append(index)
+            variable_definitions[variable] = variable_definitions.get(variable, 0) | bit
+            effects[index] = (bit, variable, strong)
+        for block in xrange(len(graph)):
+            gen = kill = 0
+            for index in graph.instructions(block):
+                if index not in effects:
+                    continue
+                bit, variable, strong = effects[index]
+                if strong:
+                    gen &= ~variable_definitions[variable]
+                    kill |= variable_definitions[variable]
+                gen |= bit
+            self.gens.append(gen)
+            self.kills.append(kill & ~gen)
+
+    # 定值的写法
+    def names(self, bits):
+        return ['%d: %s' % (self.definitions[i], self.program.instruction_text(self.definitions[i]))
+                for i in self.members(bits)]
+
+
+class AvailableExpressions(DataflowAnalysis):
+    '''可用表达式分析，表达式为运算、类型转换和数组元素的读取，在基本块入口处已经算过且操作数之后没有被改写'''
+
+    DIRECTION = 'forward'
+    MEET = 'intersection'
+    # 作为表达式的操作码
+    EXPRESSION_OPCODES = frozenset(['add', 'sub', 'mul', 'div', 'itof', 'ftoi', 'load'])
+
+    # 给所有表达式编号，读同一个变量的所有表达式组成改写该变量时的kill集合
+    def _local(self):
+        graph = self.graph
+        program = self.program
+        expression_ids = set(IRProgram.OPCODE_ID[name] for name in self.EXPRESSION_OPCODES)
+        store_id = IRProgram.OPCODE_ID['store']
+        param_id = IRProgram.OPCODE_ID['param']
+        # (操作码, 操作数a, 操作数b)到表达式编号
+        self.expressions = []
+        expression_numbers = {}
+        # 每个变量被改写时失效的表达式
+        operand_expressions = {}
+        for index in xrange(graph.start, graph.end):
+            opcode = program.opcodes[index]
+            if opcode not in expression_ids:
+                continue
+            key = (opcode, program.operands_a[index], program.operands_b[index])
+            if key in expression_numbers:
+                continue
+            bit = 1 << len(self.expressions)
+            expression_numbers[key] = len(self.expressions)
+            self.expressions.append(key)
+            for value in key[1:]:
+                if value >= 0:
+                    variable = self._bit(value)
+                    operand_expressions[variable] = operand_expressions.get(variable, 0) | bit
+        self.universe = (1 << len(self.expressions)) - 1
+        for block in xrange(len(graph)):
+            gen = kill = 0
+            for index in graph.instructions(block):
+                opcode = program.opcodes[index]
+                if opcode in expression_ids:
+                    gen |= 1 << expression_numbers[(opcode, program.operands_a[index], program.operands_b[index])]
+                # 改写的变量，数组元素的写入改写整个数组
+                dest = self._definition(index)
+                if opcode == store_id:
+                    dest = program.dests[index]
+                elif opcode == param_id and program.kind(program.operands_a[index]) == 'ADDRESS':
+                    dest = program.operands_a[index]
+                if dest >= 0:
+                    killed = operand_expressions.get(self._bit(dest), 0)
+                    gen &= ~killed
+                    kill |= killed
+            self.gens.append(gen)
+            self.kills.append(kill & ~gen)
+
+    # 表达式的写法
+    def names(self, bits):
+        names = []
+        for i in self.members(bits):
+            opcode, value_a, value_b = self.expressions[i]
+            name, text = IRProgram.OPCODES[opcode]
+            names.append(text.format(d='', a=self.program.text(value_a), b=self.program.text(value_b)).lstrip(' ='))
+        return names
+
+
+class DeadCodeEliminator(object):
+    '''三地址码上的死代码删除，删掉不可到达的基本块、结果不再被读的赋值和数组元素的写入，以及没有引用的变量、数组和字符串常量'''
+
+    def __init__(self, program):
+        self.program = program
+        # 删掉的不可到达的指令、死赋值、声明和字符串常量的个数
+        self.unreachable = 0
+        self.dead = 0
+        self.declarations = 0
+        self.strings = 0
+
+    # 删掉一条死赋值之后，它读的变量的定值可能也变成死的，反复删除直到没有可以删的指令
+    def main(self):
+        while self._instructions():
+            pass
+        self._declarations()
+        return self
+
+    # 按活跃变量分析删除一遍指令，返回删掉的条数
+    def _instructions(self):
+        program = self.program
+        keep = bytearray([1]) * len(program)
+        removed = 0
+        for name, start, end in list(program.functions()):
+            graph = ControlFlowGraph(program, start, end)
+            liveness = Liveness(graph)
+            for block in xrange(len(graph)):
+                instructions = graph.instructions(block)
+                if not graph.reachable(block):
+                    for index in instructions:
+                        keep[index] = 0
+                    self.unreachable += len(instructions)
+                    removed += len(instructions)
+                    continue
+                # 从后向前，删掉的指令读的变量不算活跃
+                live = liveness.outs[block]
+                for index in reversed(instructions):
+                    if liveness.dead(index, live):
+                        keep[index] = 0
+                        self.dead += 1
+                        removed += 1
+                    else:
+                        live = liveness.transfer(index, live)
+        if removed:
+            program.compact(keep)
+        return removed
+
+    # 删掉指令中没有引用的变量、数组和字符串常量，变量的id重新按声明的顺序编号
+    def _declarations(self):
+        program = self.program
+        referenced = set()
+        for operands in (program.dests, program.operands_a, program.operands_b):
+            for value in set(operands):
+                if value >= 0 and program.kind(value) in ['VARIABLE', 'ADDRESS', 'STRING']:
+                    referenced.add(program.values[value][1])
+        declarations = [name for name in program.declarations if name in referenced]
+        self.declarations += len(program.declarations) - len(declarations)
+        for name in program.declarations:
+            if name not in referenced:
+                del program.symbols[name]
+        for variable_id, name in enumerate(declarations):
+            program.symbols[name]['id'] = variable_id
+        program.declarations = declarations
+        strings = [(label, text) for label, text in program.strings if label in referenced]
+        self.strings += len(program.strings) - len(strings)
+        program.strings = strings
+
+
+class AssemblerFileHandler(object):
+    '''维护生成的汇编文件'''
+
+    # 汇编文件中的段，按输出的顺序排列，(insert时的类型, 段的声明, 是否总是输出)
+    SECTIONS = [
+        ('DATA', '.data', True),
+        ('RODATA', '.section .rodata', False),
+        ('BSS', '.bss', True),
+        ('TEXT', '.text', True),
+    ]
+    # 数据段和bss段中一项定义的开头，.lcomm的名字或者行首的标号，之后不以标号开头的行(如.zero)属于同一项
+    DEFINITION_PATTERN = re.compile(r'\.lcomm\s+([\w.]+)|([\w.]+):')
+    # 代码段中引用的符号，立即数前的$不属于符号
+    SYMBOL_PATTERN = re.compile(r'[A-Za-z_.][\w.]*')
+
+    def __init__(self, stream=None, optimizer=None, sweep=False):
+        # 每个段的内容，只在末尾添加
+        self.sections = dict((_type, []) for _type, name, always in self.SECTIONS)
+        self.sections['BSS'].append('.lcomm bss_tmp, 4')
+        # 如果给出了文件对象，代码段直接写入该文件，不保存在内存中
+        self.stream = stream
+        if stream:
+            stream.write('.text\n')
+        # 代码段的窥孔优化，PeepholeOptimizer
+        self.optimizer = optimizer
+        # 代码段是否已经优化过
+        self.optimized = False
+        # 是否删掉数据段和bss段中代码段没有引用的定义，以及代码段中引用到的符号
+        self.sweep = sweep
+        self.references = set()
+
+    # 把一行代码写入流，记下它引用的符号
+    def _write_text(self, line):
+        if self.sweep:
+            self.references.update(self.SYMBOL_PATTERN.findall(line))
+        self.stream.write(line + '\n')
+
+    def insert(self, value, _type):
+        # 代码段直接写入文件，有窥孔优化时只写入之后不会再被修改的指令
+        if _type == 'TEXT' and self.stream:
+            if self.optimizer:
+                for line in self.optimizer.feed(value):
+                    self._write_text(line)
+            else:
+                self._write_text(value)
+        # 插入到对应的段
+        elif _type in self.sections:
+            self.sections[_type].append(value)
+        else:
+            print 'error!'
+            exit()
+
+    # 段中代码段引用到的定义
+    def _swept(self, lines):
+        keep = True
+        for line in lines:
+            match = self.DEFINITION_PATTERN.match(line)
+            if match:
+                keep = (match.group(1) or match.group(2)) in self.references
+            if keep:
+                yield line
+
+    # 汇编文件中还没有写入文件的所有行
+    def lines(self):
+        # 生成汇编文件之前对代码段做窥孔优化
+        if self.optimizer and not self.stream and not self.optimized:
+            self.optimizer.optimize(self.sections['TEXT'])
+            self.optimized = True
+        if self.sweep and not self.stream:
+            for line in self.sections['TEXT']:
+                self.references.update(self.SYMBOL_PATTERN.findall(line))
+        for _type, name, always in self.SECTIONS:
+            if _type == 'TEXT' and self.stream:
+                continue
+            lines = self.sections[_type]
+            if self.sweep and _type != 'TEXT':
+                lines = list(self._swept(lines))
+            if always or lines:
+                yield name
+                for line in lines:
+                    yield line
+
+    # 将还没有写入的段写入文件对象
+    def write(self, output):
+        # 流式写入时代码段中还留在窥孔优化窗口里的指令
+        if self.optimizer and self.stream:
+            for line in self.optimizer.finish():
+                self._write_text(line)
+        for line in self.lines():
+            output.write(line + '\n')
+
+    # 将结果保存到文件中
+    def generate_ass_file(self, file_name):
+        self.file = open(file_name + '.S', 'w+')
+        self.write(self.file)
+        self.file.close()
+
+
+class PeepholeOptimizer(object):
+    '''窥孔优化，在代码段的指令上滑动窗口，按规则表替换指令，直到没有规则可以再用'''
+
+    # 规则表，(名字, 窗口大小, 处理方法)，处理方法检查从第i行开始的窗口，返回(匹配的行数, 替换成的行)或者None
+    RULES = [
+        ('move', 3, '_move'),
+        ('jump-next', 4, '_jump_next'),
+        ('stack-adjust', 16, '_stack_adjust'),
+    ]
+    # 判断寄存器的值是否还会用到时最多向后看的行数
+    LIVENESS_WINDOW = 16
+    # 临时结果只在一条语句中存在，标号、跳转和函数调用处这些寄存器的值都不会再用到
+    SCRATCH_REGISTERS = ['%eax', '%ecx', '%edx']
+    # 隐式读写寄存器的指令
+    IMPLICIT_READS = {'mull': ['%eax'], 'idivl': ['%eax', '%edx'], 'cltd': ['%eax']}
+    IMPLICIT_WRITES = {'mull': ['%eax', '%edx'], 'idivl': ['%eax', '%edx'], 'cltd': ['%edx']}
+    # 可以合并的双目运算指令
+    MERGE_INSTRUCTIONS = ['addl', 'subl']
+    STACK_ADJUST_PATTERN = re.compile(r'add \$(\d+), %esp$')
+
+    # 解析规则的配置，all为所有规则，none为不优化，或者用逗号隔开的规则名
+    @classmethod
+    def parse(cls, spec):
+        names = [name for name, window, method in cls.RULES]
+        if spec == 'all':
+            return names
+        elif spec == 'none' or not spec:
+            return []
+        rules = spec.split(',')
+        for rule in rules:
+            if rule not in names:
+                print 'peephole rule %s not found!' % rule
+                exit()
+        return rules
+
+    def __init__(self, rules=None):
+        self.rules = [(name, getattr(self, method)) for name, window, method in self.RULES
+                      if rules is None or name in rules]
+        # 替换之后最多要退回多少行重新检查，以及检查一行时最多要看到之后的多少行
+        self.reach = max(window for name, window, method in self.RULES) + self.LIVENESS_WINDOW
+        # 每条规则删掉的指令条数
+        self.counts = dict((name, 0) for name, method in self.rules)
+        # 流式输出时还可能被修改的指令，以及下一个要检查的位置
+        self.pending = []
+        self.position = 0
+
+    # 把一条指令拆成(助记符, 操作数列表)，括号中的逗号不拆开
+    def _split(self, line):
+        parts = line.split(' ', 1)
+        operands = []
+        if len(parts) > 1:
+            depth = 0
+            start = 0
+            text = parts[1]
+            for i, char in enumerate(text):
+                if char == '(':
+                    depth += 1
+                elif char == ')':
+                    depth -= 1
+                elif char == ',' and depth == 0:
+                    operands.append(text[start:i].strip())
+                    start = i + 1
+            operands.append(text[start:].strip())
+        return parts[0], operands
+
+    # 是否是标号或者跳转
+    def _is_boundary(self, line):
+        return line.endswith(':') or line.startswith('j')
+
+    # 从lines[start]开始寄存器的值是否不会再用到，在窗口中确定不了时当作还要用到
+    def _dead(self, register, lines, start):
+        for line in lines[start:start + self.LIVENESS_WINDOW]:
+            if self._is_boundary(line):
+                return register in self.SCRATCH_REGISTERS
+            mnemonic, operands = self._split(line)
+            if mnemonic == 'call':
+                return register in self.SCRATCH_REGISTERS
+            if register in self.IMPLICIT_READS.get(mnemonic, ()):
+                return False
+            if any(register in operand for operand in operands[:-1]):
+                return False
+            if operands and register in operands[-1]:
+                # 只有movl直接改写目的寄存器，其余指令都要读出原来的值
+                return mnemonic == 'movl' and operands[-1] == register
+            if register in self.IMPLICIT_WRITES.get(mnemonic, ()):
+                return True
+        return False
+
+    # 经过临时寄存器的传送
+    def _move(self, lines, i):
+        mnemonic, operands = self._split(lines[i])
+        if mnemonic != 'movl' or len(operands) != 2 or i + 1 >= len(lines):
+            return None
+        source, register = operands
+        next_mnemonic, next_operands = self._split(lines[i + 1])
+        # movl A, B; movl B, A，第二条是多余的
+        if next_mnemonic == 'movl' and next_operands == [register, source]:
+            return 2, [lines[i]]
+        if register not in RegisterAllocator.REGISTERS:
+            return None
+        # movl X, %R; movl %R, Y，%R之后不再用到时直接传送，两个操作数不能都在内存中
+        if next_mnemonic == 'movl' and len(next_operands) == 2 and next_operands[0] == register and \
+                register not in next_operands[1] and \
+                (source[0] in '%$' or next_operands[1] in RegisterAllocator.REGISTERS) and self._dead(register, lines, i + 2):
+            if source == next_operands[1]:
+                return 2, []
+            return 2, ['movl ' + source + ', ' + next_operands[1]]
+        # movl %S, %R; addl Z, %R; movl %R, %S，直接在%S上运算
+        if source in RegisterAllocator.REGISTERS and next_mnemonic in self.MERGE_INSTRUCTIONS and \
+                len(next_operands) == 2 and next_operands[1] == register and register not in next_operands[0] and \
+                i + 2 < len(lines) and lines[i + 2] == 'movl ' + register + ', ' + source and \
+                self._dead(register, lines, i + 3):
+            return 3, [next_mnemonic + ' ' + next_operands[0] + ', ' + source]
+
+    # 跳转到紧接着的标号
+    def _jump_next(self, lines, i):
+        if not lines[i].startswith('jmp '):
+            return None
+        label = lines[i][4:] + ':'
+        for line in lines[i + 1:i + 4]:
+            if not line.endswith(':'):
+                return None
+            if line == label:
+                return 1, []
+
+    # 连续的函数调用之后各自恢复栈顶，合并到最后一次调用之后
+    def _stack_adjust(self, lines, i):
+        match = self.STACK_ADJUST_PATTERN.match(lines[i])
+        if not match:
+            return None
+        for j in range(i + 1, min(len(lines), i + 16)):
+            next_match = self.STACK_ADJUST_PATTERN.match(lines[j])
+            if next_match:
+                size = int(match.group(1)) + int(next_match.group(1))
+                return j - i + 1, lines[i + 1:j] + ['add $' + str(size) + ', %esp']
+            # 不同路径到达时栈顶不同，不能跨过标号和跳转
+            if self._is_boundary(lines[j]):
+                return None
+
+    # 从position开始检查，直到剩下lookahead行，返回下一个要检查的位置
+    def _run(self, lines, position, lookahead):
+        while position < len(lines) - lookahead:
+            for name, rule in self.rules:
+                result = rule(lines, position)
+                if result is not None:
+                    count, new_lines = result
+                    lines[position:position + count] = new_lines
+                    self.counts[name] += count - len(new_lines)
+                    # 替换之后前面的指令可能组成新的模式
+                    position = max(position - self.reach, 0)
+                    break
+            else:
+                position += 1
+        return position
+
+    # 优化全部指令，直接修改lines
+    def optimize(self, lines):
+        self._run(lines, 0, 0)
+        return lines
+
+    # 流式输出时加入一条指令，返回之后不会再被修改、可以写入文件的指令
+    def feed(self, line):
+        self.pending.append(line)
+        self.position = self._run(self.pending, self.position, self.reach)
+        done = self.position - self.reach
+        if done <= 0:
+            return []
+        lines = self.pending[:done]
+        del self.pending[:done]
+        self.position -= done
+        return lines
+
+    # 流式输出结束，返回剩下的指令
+    def finish(self):
+        self._run(self.pending, self.position, 0)
+        lines = self.pending
+        self.pending = []
+        self.position = 0
+        return lines
+
+    # 每条规则删掉的指令条数
+    def report_lines(self):
+        for name, rule in self.rules:
+            yield 'peephole %-14s removed %d' % (name, self.counts[name])
+        yield 'peephole %-14s removed %d' % ('total', sum(self.counts.values()))
+
+
+class RegisterAllocator(object):
+    '''给表达式的临时结果和循环中的整型变量分配寄存器，寄存器不够时溢出到内存'''
+
+    # 通用寄存器，按分配的先后排列
+    REGISTERS = ['%eax', '%ecx', '%edx', '%ebx', '%esi', '%edi']
+    # 被调用者保存的寄存器，调用printf、scanf前后值不变，用来存放循环变量
+    CALLEE_SAVED = ['%ebx', '%esi', '%edi']
+
+    def __init__(self, ass_file_handler, symbol_table):
+        self.ass_file_handler = ass_file_handler
+        self.symbol_table = symbol_table
+        # 空闲的寄存器
+        self.free = set(self.REGISTERS)
+        # 保存在寄存器中的临时结果，按分配的先后排列，溢出时先溢出最早的
+        self.temps = []
+        # 放在寄存器中的变量，变量名到寄存器的映射
+        self.variables = {}
+        # x87栈中的临时结果，最后一个在栈顶
+        self.fpu_stack = []
+        # 已经声明了多少个溢出用的内存单元
+        self.spill_cnt = 0
+
+    # 声明一个溢出用的内存单元
+    def _slot(self, field_type):
+        slot = 'bss_spill_' + str(self.spill_cnt)
+        self.spill_cnt += 1
+        self.ass_file_handler.insert('.lcomm ' + slot + ', 4', 'BSS')
+        self.symbol_table[slot] = {'type': 'IDENTIFIER', 'field_type': field_type}
+        return slot
+
+    # 寄存器中的临时结果
+    def _temp(self, register):
+        for operand in self.temps:
+            if operand['operand'] == register:
+                return operand
+
+    # 把临时结果存到内存中，操作数原地改成该内存单元
+    def _spill(self, operand):
+        slot = self._slot('int')
+        self.ass_file_handler.insert('movl ' + operand['operand'] + ', ' + slot, 'TEXT')
+        self.temps.remove(operand)
+        self.free.add(operand['operand'])
+        operand['type'] = 'VARIABLE'
+        operand['operand'] = slot
+
+    # 分配一个空闲的寄存器，没有空闲的时把最早的临时结果溢出
+    def take(self, avoid=()):
+        for register in self.REGISTERS:
+            if register in self.free and register not in avoid:
+                self.free.remove(register)
+                return register
+        for operand in self.temps:
+            if operand['operand'] not in avoid:
+                register = operand['operand']
+                self._spill(operand)
+                self.free.remove(register)
+                return register
+        print 'register allocation error!'
+        exit()
+
+    # 占用一个指定的空闲寄存器
+    def claim(self, register):
+        self.free.remove(register)
+
+    # 让指令要改写的寄存器空出来，其中的临时结果移到别的寄存器或者溢出
+    def evict(self, register):
+        if register in self.free:
+            return
+        operand = self._temp(register)
+        if operand is None:
+            print 'register %s is not available!' % register
+            exit()
+        for new in self.REGISTERS:
+            if new in self.free:
+                self.free.remove(new)
+                self.free.add(register)
+                self.ass_file_handler.insert('movl ' + register + ', ' + new, 'TEXT')
+                operand['operand'] = new
+                return
+        self._spill(operand)
+
+    # 用寄存器保存一个临时结果，返回该操作数
+    def hold(self, register):
+        operand = {'type': 'REGISTER', 'operand': register}
+        self.temps.append(operand)
+        return operand
+
+    # 释放寄存器，变量所在的寄存器不释放
+    def release(self, register):
+        if register is None or register in self.variables.values():
+            return
+        operand = self._temp(register)
+        if operand is not None:
+            self.temps.remove(operand)
+        self.free.add(register)
+
+    # 把变量放到寄存器中
+    def promote(self, name, register):
+        self.free.remove(register)
+        self.variables[name] = register
+
+    # 变量回到内存中
+    def demote(self, name):
+        self.free.add(self.variables.pop(name))
+
+    # 还能存放循环变量的寄存器
+    def loop_registers(self):
+        return [register for register in self.CALLEE_SAVED if register in self.free]
+
+    # 变量在指令中的写法，在寄存器中时为寄存器
+    def location(self, name):
+        return self.variables.get(name, name)
+
+    # 栈顶新的浮点临时结果
+    def push_float(self):
+        operand = {'type': 'FPU', 'operand': '%st(0)'}
+        self.fpu_stack.append(operand)
+        return operand
+
+    # 弹出栈顶的浮点临时结果
+    def pop_float(self):
+        return self.fpu_stack.pop()
+
+    # x87栈中的临时结果都存到内存中，之后的指令只需要处理栈顶
+    def spill_floats(self):
+        while self.fpu_stack:
+            operand = self.fpu_stack.pop()
+            slot = self._slot('float')
+            self.ass_file_handler.insert('fstps ' + slot, 'TEXT')
+            operand['type'] = 'VARIABLE'
+            operand['operand'] = slot
+
+    # 一条语句结束，丢弃没有用到的临时结果
+    def discard(self):
+        for operand in self.fpu_stack:
+            self.ass_file_handler.insert('fstp %st(0)', 'TEXT')
+        self.fpu_stack = []
+        for operand in self.temps:
+            self.free.add(operand['operand'])
+        self.temps = []
+
+
+class Assembler(object):
+    '''编译成汇编语言'''
+
+    # 节点的value到处理方法的映射，新的句型只需要在这里加一项
+    NODE_HANDLERS = {
+        'Sentence': '_sentence',
+        'Include': '_include',
+        'FunctionStatement': '_function_statement',
+        'Statement': '_statement',
+        'FunctionCall': '_function_call',
+        'Assignment': '_assignment',
+        'Control': '_control',
+        'Expression': '_expression_sentence',
+        'Return': '_return',
+    }
+    # 控制语句的type到处理方法的映射
+    CONTROL_HANDLERS = {
+        'IfElseControl': '_control_if',
+        'ForControl': '_control_for',
+        'WhileControl': '_control_while',
+    }
+    # 双目运算符到生成代码的方法的映射
+    BINARY_EMITTERS = {
+        '+': '_emit_add',
+        '-': '_emit_sub',
+        '*': '_emit_mul',
+        '/': '_emit_div',
+        '>=': '_emit_ge',
+        '<': '_emit_lt',
+        '>': '_emit_unsupported',
+        '<=': '_emit_unsupported',
+    }
+    # 单目运算符到生成代码的方法的映射
+    UNARY_EMITTERS = {
+        '++': '_emit_increment',
+        '--': '_emit_decrement',
+    }
+    # 比较运算符不成立时的跳转指令，浮点数比较之后按无符号数的标志位跳转，整数比较按有符号数跳转
+    OPERATOR_JUMPS = {'>': 'jbe', '<': 'jae', '>=': 'jb', '<=': 'ja'}
+    INT_OPERATOR_JUMPS = {'>': 'jle', '<': 'jge', '>=': 'jl', '<=': 'jg'}
+    # 交换两个操作数之后的比较运算符
+    REVERSED_OPERATORS = {'>': '<', '<': '>', '>=': '<=', '<=': '>='}
+    # 浮点数双目运算的指令，(操作数为浮点数, 操作数为整数, 交换操作数后为浮点数, 交换操作数后为整数)
+    FLOAT_INSTRUCTIONS = {
+        '+': ('fadds', 'fiaddl', 'fadds', 'fiaddl'),
+        '-': ('fsubs', 'fisubl', 'fsubrs', 'fisubrl'),
+        '*': ('fmuls', 'fimull', 'fmuls', 'fimull'),
+        '/': ('fdivs', 'fidivl', 'fdivrs', 'fidivrl'),
+    }
+    # 栈顶的浮点数和C一样向0取整后存入{0}，控制字保存在栈上，复制一份把舍入方式改成向0取整，之后再恢复，不占用寄存器
+    TRUNCATE_LINES = ['subl $4, %esp', 'fnstcw (%esp)', 'fnstcw 2(%esp)', 'orw $0x0c00, 2(%esp)', 'fldcw 2(%esp)',
+                      'fistpl {0}', 'fldcw (%esp)', 'addl $4, %esp']
+
+    # 把类中名为name的映射表解析成{键: 函数}，每个类只解析一次，子类可以覆盖映射表或者其中的方法
+    @classmethod
+    def _dispatch_table(cls, name):
+        attribute = '_resolved' + name
+        if attribute not in cls.__dict__:
+            setattr(cls, attribute, dict(
+                (key, getattr(cls, method).__func__) for key, method in getattr(cls, name).iteritems()))
+        return cls.__dict__[attribute]
+
+    def __init__(self, tree, stream=None, peephole=None, dce=True):
+        # 要编译的语法树
+        self.tree = tree
+        # 要生成的汇编文件管理器，给出stream时代码段直接写入stream，peephole为窥孔优化要用的规则，
+        # dce为True时删掉代码段没有引用的变量、数组和字符串常量
+        self.ass_file_handler = AssemblerFileHandler(
+            stream, PeepholeOptimizer(peephole) if peephole else None, sweep=dce)
+        # 符号表
+        self.symbol_table = {}
+        # 寄存器分配器，临时结果和循环变量尽量放在寄存器中
+        self.allocator = RegisterAllocator(self.ass_file_handler, self.symbol_table)
+        # 各种节点和运算符的分派表
+        self._node_handlers = self._dispatch_table('NODE_HANDLERS')
+        self._control_handlers = self._dispatch_table('CONTROL_HANDLERS')
+        self._binary_emitters = self._dispatch_table('BINARY_EMITTERS')
+        self._unary_emitters = self._dispatch_table('UNARY_EMITTERS')
+        # 表达式中的操作数栈
+        self.operand_stack = []
+        # 已经声明了多少个label
+        self.label_cnt = 0
+        # ifelse中的标签
+        self.labels_ifelse = {}
+
+    # include句型
+    def _include(self, node=None):
+        pass
+
+    # 函数定义句型，产生函数体中要遍历的第一个节点
+    def _function_statement(self, node=None):
+        # 第一个儿子
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'FunctionName':
+                if current_node.first_son.value != 'main':
+                    print 'other function statement except for main is not supported!'
+                    exit()
+                else:
+                    self.ass_file_handler.insert('.globl main', 'TEXT')
+                    self.ass_file_handler.insert('main:', 'TEXT')
+                    self.ass_file_handler.insert('finit', 'TEXT')
+            elif current_node.value == 'Sentence':
+                yield current_node.first_son
+            current_node = current_node.right
+
+    # 简单的sizeof
+    def _sizeof(self, _type):
+        size = -1
+        if _type == 'int' or _type == 'float' or _type == 'long':
+            size = 4
+        elif _type == 'char':
+            size = 1
+        elif _type == 'double':
+            size = 8
+        return str(size)
+
+    # 声明语句
+    def _statement(self, node=None):
+        # 对应的汇编代码中的声明语句
+        line = None
+        # 1:初始化的，0:没有初始化
+        flag = 0
+        # 变量数据类型
+        variable_field_type = None
+        # 变量类型，是数组还是单个变量
+        variable_type = None
+        # 变量名
+        variable_name = None
+        current_node = node.first_son
+        while current_node:
+            # 类型
+            if current_node.value == 'Type':
+                variable_field_type = current_node.first_son.value
+            # 变量名
             elif current_node.type == 'IDENTIFIER':
                 variable_name = current_node.value
                 variable_type = current_node.extra_info['type']
@@ -1059,7 +3652,7 @@ class Assembler(object):
                 elif self.symbol_table[parameter]['type'] == 'VARIABLE':
                     field_type = self.symbol_table[parameter]['field_type']
                     if field_type == 'int':
-                        line = 'pushl ' + parameter
+                        line = 'pushl ' + self.allocator.location(parameter)
                         self.ass_file_handler.insert(line, 'TEXT')
                         num += 1
                     elif field_type == 'float':
@@ -1101,19 +3694,37 @@ class Assembler(object):
         current_node = node.first_son
         if current_node.type == 'IDENTIFIER' and current_node.right.value == 'Expression':
             expres = self._expression(current_node.right)
+            operand = {'type': expres['type'], 'operand': expres['value']}
             # 该变量的类型
             field_type = self.symbol_table[current_node.value]['field_type']
+            # 该变量在指令中的写法
+            target = self.allocator.location(current_node.value)
             if field_type == 'int':
                 # 常数
                 if expres['type'] == 'CONSTANT':
                     line = 'movl $' + \
-                        expres['value'] + ', ' + current_node.value
+                        expres['value'] + ', ' + target
                     self.ass_file_handler.insert(line, 'TEXT')
-                elif expres['type'] == 'VARIABLE':
-                    line = 'movl ' + expres['value'] + ', ' + '%edi'
-                    self.ass_file_handler.insert(line, 'TEXT')
-                    line = 'movl %edi, ' + current_node.value
+                # 浮点数的结果转换成整数
+                elif expres['type'] == 'FPU':
+                    self.allocator.pop_float()
+                    destination = target if target == current_node.value else 'bss_tmp'
+                    for line in self.TRUNCATE_LINES:
+                        self.ass_file_handler.insert(line.format(destination), 'TEXT')
+                    if destination != target:
+                        self.ass_file_handler.insert('movl bss_tmp, ' + target, 'TEXT')
+                elif expres['type'] in ['VARIABLE', 'REGISTER', 'ARRAY_ITEM']:
+                    source, scratch = self._int_source(operand)
+                    # 内存之间不能直接传送，经过一个寄存器
+                    if source[0] != '%' and target[0] != '%':
+                        register = scratch or self.allocator.take()
+                        if source != register:
+                            line = 'movl ' + source + ', ' + register
+                            self.ass_file_handler.insert(line, 'TEXT')
+                        source = scratch = register
+                    line = 'movl ' + source + ', ' + target
                     self.ass_file_handler.insert(line, 'TEXT')
+                    self.allocator.release(scratch)
                 else:
                     pass
             elif field_type == 'float':
@@ -1121,22 +3732,57 @@ class Assembler(object):
                     line = 'movl $' + \
                         expres['value'] + ', ' + current_node.value
                     self.ass_file_handler.insert(line, 'TEXT')
-                    line = 'filds ' + current_node.value
+                    line = 'fildl ' + current_node.value
                     self.ass_file_handler.insert(line, 'TEXT')
                     line = 'fstps ' + current_node.value
                     self.ass_file_handler.insert(line, 'TEXT')
-                else:
+                elif expres['type'] == 'FPU':
+                    self.allocator.pop_float()
+                    line = 'fstps ' + current_node.value
+                    self.ass_file_handler.insert(line, 'TEXT')
+                elif expres['type']:
+                    self._load_float(operand)
                     line = 'fstps ' + current_node.value
                     self.ass_file_handler.insert(line, 'TEXT')
             else:
                 print 'field type except int and float not supported!'
                 exit()
+            self.allocator.discard()
         else:
             print 'assignment wrong.'
             exit()
 
-    # for语句
+    # 循环中用到的整型变量，按使用次数从多到少排列，取了地址的变量不能放到寄存器中
+    def _loop_variables(self, node=None):
+        counts = {}
+        addressed = set()
+        for current_node in SyntaxTree.preorder(node):
+            if current_node.type not in ['IDENTIFIER', '_Variable', '_ArrayIndex']:
+                continue
+            name = current_node.value
+            item = self.symbol_table.get(name)
+            if not item or item['type'] != 'VARIABLE' or item['field_type'] != 'int':
+                continue
+            if current_node.left and current_node.left.type == 'ADDRESS':
+                addressed.add(name)
+            counts[name] = counts.get(name, 0) + 1
+        names = [name for name in counts if name not in addressed and name not in self.allocator.variables]
+        names.sort(key=lambda name: (-counts[name], name))
+        return names
+
+    # for语句，产生循环体中要遍历的第一个节点
     def _control_for(self, node=None):
+        # 使用最多的循环变量放到寄存器中，寄存器不够时其余的留在内存中
+        promoted = zip(self._loop_variables(node), self.allocator.loop_registers())
+        # 第一部分赋值的变量不需要先从内存读入
+        init = node.first_son if node.first_son.value == 'Assignment' else None
+        for name, register in promoted:
+            self.allocator.promote(name, register)
+            if init and init.first_son.value == name and \
+                    not any(item.value == name for item in SyntaxTree.preorder(init.first_son.right)):
+                continue
+            line = 'movl ' + name + ', ' + register
+            self.ass_file_handler.insert(line, 'TEXT')
         current_node = node.first_son
         # 遍历的是for循环中的那个部分
         cnt = 2
@@ -1154,17 +3800,23 @@ class Assembler(object):
                     self._expression(current_node)
                 else:
                     self._expression(current_node)
+                self.allocator.discard()
             # for语句部分
             elif current_node.value == 'Sentence':
-                self.traverse(current_node.first_son)
+                yield current_node.first_son
             current_node = current_node.right
         line = 'jmp label_' + str(self.label_cnt - 1)
         self.ass_file_handler.insert(line, 'TEXT')
         line = 'label_' + str(self.label_cnt) + ':'
         self.ass_file_handler.insert(line, 'TEXT')
         self.label_cnt += 1
+        # 循环结束后把寄存器中的变量写回内存
+        for name, register in promoted:
+            line = 'movl ' + register + ', ' + name
+            self.ass_file_handler.insert(line, 'TEXT')
+            self.allocator.demote(name)
 
-    # if else语句
+    # if else语句，依次产生if和else语句块中要遍历的第一个节点
     def _control_if(self, node=None):
         current_node = node.first_son
         self.labels_ifelse['label_else'] = 'label_' + str(self.label_cnt)
@@ -1177,20 +3829,37 @@ class Assembler(object):
                     print 'control_if error!'
                     exit()
                 self._expression(current_node.first_son)
-                self.traverse(current_node.first_son.right.first_son)
+                self.allocator.discard()
+                yield current_node.first_son.right.first_son
                 line = 'jmp ' + self.labels_ifelse['label_end']
                 self.ass_file_handler.insert(line, 'TEXT')
                 line = self.labels_ifelse['label_else'] + ':'
                 self.ass_file_handler.insert(line, 'TEXT')
             elif current_node.value == 'ElseControl':
-                self.traverse(current_node.first_son)
+                yield current_node.first_son
                 line = self.labels_ifelse['label_end'] + ':'
                 self.ass_file_handler.insert(line, 'TEXT')
             current_node = current_node.right
 
-    # while语句
+    # while语句，产生循环体中要遍历的第一个节点
     def _control_while(self, node=None):
-        print 'while not supported yet!'
+        # 循环开始的标号，条件不成立时跳到紧接着的下一个标号
+        begin = 'label_' + str(self.label_cnt)
+        end = 'label_' + str(self.label_cnt + 1)
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'Expression':
+                self.ass_file_handler.insert(begin + ':', 'TEXT')
+                self.label_cnt += 1
+                self._expression(current_node)
+                self.allocator.discard()
+                # 循环体中的标号排在结束的标号之后
+                self.label_cnt += 1
+            elif current_node.value == 'Sentence':
+                yield current_node.first_son
+            current_node = current_node.right
+        self.ass_file_handler.insert('jmp ' + begin, 'TEXT')
+        self.ass_file_handler.insert(end + ':', 'TEXT')
 
     # return语句
     def _return(self, node=None):
@@ -1210,384 +3879,1237 @@ class Assembler(object):
                 print 'return type not supported!'
                 exit()
 
-    # 遍历表达式
+    # 后序遍历表达式，操作数入栈，运算在它的操作数都算完之后生成代码，结果入栈
     def _traverse_expression(self, node=None):
-        if not node:
-            return
-        if node.type == '_Variable':
-            self.operand_stack.append(
-                {'type': 'VARIABLE', 'operand': node.value})
-        elif node.type == '_Constant':
-            self.operand_stack.append(
-                {'type': 'CONSTANT', 'operand': node.value})
-        elif node.type == '_Operator':
-            self.operator_stack.append(node.value)
-        elif node.type == '_ArrayName':
-            self.operand_stack.append(
-                {'type': 'ARRAY_ITEM', 'operand': [node.value, node.right.value]})
-            return
-        current_node = node.first_son
-        while current_node:
-            self._traverse_expression(current_node)
-            current_node = current_node.right
+        binary_emitters = self._binary_emitters
+        unary_emitters = self._unary_emitters
+        for node in SyntaxTree.postorder(node):
+            if node.type == '_Variable':
+                self.operand_stack.append(
+                    {'type': 'VARIABLE', 'operand': node.value})
+            elif node.type == '_Constant':
+                self.operand_stack.append(
+                    {'type': 'CONSTANT', 'operand': node.value})
+            elif node.type == '_ArrayName':
+                # 数组名没有儿子，下标是它的右兄弟
+                self.operand_stack.append(
+                    {'type': 'ARRAY_ITEM', 'operand': [node.value, node.right.value]})
+            elif node.value != 'Expression':
+                continue
+            # 双目运算符，儿子为(操作数, 运算符, 操作数)
+            elif node.type == 'DoubleOperand':
+                emitter = binary_emitters.get(node.first_son.right.first_son.value)
+                if emitter is None:
+                    print 'operator not supported!'
+                    exit()
+                operand_b = self.operand_stack.pop()
+                operand_a = self.operand_stack.pop()
+                emitter(self, operand_a, operand_b)
+            # 单目运算符，儿子为(运算符, 操作数)
+            elif node.type == 'SingleOperand':
+                emitter = unary_emitters.get(node.first_son.first_son.value)
+                if emitter is None:
+                    print 'operator not supported!'
+                    exit()
+                emitter(self, self.operand_stack.pop())
 
-    # 判断一个变量是不是float类型
+    # 判断一个操作数是不是float类型
     def _is_float(self, operand):
+        if operand['type'] == 'FPU':
+            return True
         return operand['type'] == 'VARIABLE' and self.symbol_table[operand['operand']]['field_type'] == 'float'
     # 判断两个操作数中是否含有float类型的数
 
     def _contain_float(self, operand_a, operand_b):
         return self._is_float(operand_a) or self._is_float(operand_b)
 
+    # 整型操作数在指令中的写法，返回(写法, 用完之后要释放的寄存器)
+    def _int_source(self, operand):
+        if operand['type'] == 'CONSTANT':
+            return '$' + operand['operand'], None
+        elif operand['type'] == 'REGISTER':
+            return operand['operand'], operand['operand']
+        elif operand['type'] == 'ARRAY_ITEM':
+            # 下标不在寄存器中时先读到一个寄存器中
+            name, index = operand['operand']
+            register = self.allocator.variables.get(index)
+            scratch = None
+            if register is None:
+                register = scratch = self.allocator.take()
+                line = 'movl ' + index + ', ' + register
+                self.ass_file_handler.insert(line, 'TEXT')
+            return name + '(, ' + register + ', 4)', scratch
+        return self.allocator.location(operand['operand']), None
+
+    # 浮点运算中操作数在内存中的写法，不在内存中的整数经过bss_tmp，返回(写法, 是否为整数)
+    def _float_source(self, operand):
+        if operand['type'] == 'VARIABLE' and operand['operand'] not in self.allocator.variables:
+            return operand['operand'], not self._is_float(operand)
+        elif operand['type'] == 'ARRAY_ITEM':
+            source, scratch = self._int_source(operand)
+            self.allocator.release(scratch)
+            return source, self.symbol_table[operand['operand'][0]]['field_type'] != 'float'
+        source, scratch = self._int_source(operand)
+        line = 'movl ' + source + ', bss_tmp'
+        self.ass_file_handler.insert(line, 'TEXT')
+        self.allocator.release(scratch)
+        return 'bss_tmp', True
+
+    # 把操作数读到x87栈顶，栈中原有的临时结果先存到内存中
+    def _load_float(self, operand):
+        self.allocator.spill_floats()
+        source, is_int = self._float_source(operand)
+        line = ('fildl ' if is_int else 'flds ') + source
+        self.ass_file_handler.insert(line, 'TEXT')
+
     # 表达式
     def _expression(self, node=None):
         if node.type == 'Constant':
             return {'type': 'CONSTANT', 'value': node.first_son.value}
         # 先清空
-        self.operator_priority = []
         self.operand_stack = []
-        # 遍历该表达式
+        # 遍历该表达式并生成代码
         self._traverse_expression(node)
+        result = {'type': self.operand_stack[0]['type'], 'value': self.operand_stack[
+            0]['operand']} if self.operand_stack else {'type': '', 'value': ''}
+        return result
 
-        # 双目运算符
-        double_operators = ['+', '-', '*', '/', '>', '<', '>=', '<=']
-        # 单目运算符
-        single_operators = ['++', '--']
-        # 运算符对汇编指令的映射
-        operator_map = {'>': 'jbe', '<': 'jae', '>=': 'jb', '<=': 'ja'}
-        while self.operator_stack:
-            operator = self.operator_stack.pop()
-            if operator in double_operators:
-                operand_b = self.operand_stack.pop()
-                operand_a = self.operand_stack.pop()
-                contain_float = self._contain_float(operand_a, operand_b)
-                if operator == '+':
-                    if contain_float:
-                        line = 'flds ' if self._is_float(
-                            operand_a) else 'filds '
-                        line += operand_a['operand']
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'fadd ' if self._is_float(
-                            operand_b) else 'fiadd '
-                        line += operand_b['operand']
-                        self.ass_file_handler.insert(line, 'TEXT')
+    # 浮点数的双目运算，结果留在x87栈顶
+    def _emit_float(self, operator, operand_a, operand_b):
+        instructions = self.FLOAT_INSTRUCTIONS[operator]
+        if operand_a['type'] == 'FPU' and operand_b['type'] == 'FPU':
+            # 栈顶的b先存到内存中，a就到了栈顶
+            self.allocator.spill_floats()
+        if operand_a['type'] == 'FPU':
+            self.allocator.pop_float()
+            operand, reverse = operand_b, 0
+        elif operand_b['type'] == 'FPU':
+            # 栈顶是b，用交换操作数的指令
+            self.allocator.pop_float()
+            operand, reverse = operand_a, 2
+        else:
+            self._load_float(operand_a)
+            operand, reverse = operand_b, 0
+        source, is_int = self._float_source(operand)
+        line = instructions[reverse + is_int] + ' ' + source
+        self.ass_file_handler.insert(line, 'TEXT')
+        # 计算结果留在栈顶
+        self.operand_stack.append(self.allocator.push_float())
 
-                        # 计算结果保存到bss_tmp中
-                        line = 'fstps bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'flds bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        # 计算结果压栈
-                        self.operand_stack.append(
-                            {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                        # 记录到符号表中
-                        self.symbol_table['bss_tmp'] = {
-                            'type': 'IDENTIFIER', 'field_type': 'float'}
-                    else:
-                        # 第一个操作数
-                        if operand_a['type'] == 'ARRAY_ITEM':
-                            line = 'movl ' + \
-                                operand_a['operand'][1] + r', %edi'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                            line = 'movl ' + \
-                                operand_a['operand'][0] + r'(, %edi, 4), %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        elif operand_a['type'] == 'VARIABLE':
-                            line = 'movl ' + operand_a['operand'] + r', %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        elif operand_a['type'] == 'CONSTANT':
-                            line = 'movl $' + operand_a['operand'] + r', %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        # 加上第二个操作数
-                        if operand_b['type'] == 'ARRAY_ITEM':
-                            line = 'movl ' + \
-                                operand_b['operand'][1] + r', %edi'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                            line = 'addl ' + \
-                                operand_b['operand'][0] + r'(, %edi, 4), %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        elif operand_b['type'] == 'VARIABLE':
-                            line = 'addl ' + operand_b['operand'] + r', %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        elif operand_b['type'] == 'CONSTANT':
-                            line = 'addl $' + operand_b['operand'] + r', %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        # 赋值给临时操作数
-                        line = 'movl %eax, bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        # 计算结果压栈
-                        self.operand_stack.append(
-                            {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                        # 记录到符号表中
-                        self.symbol_table['bss_tmp'] = {
-                            'type': 'IDENTIFIER', 'field_type': 'int'}
-
-                elif operator == '-':
-                    if contain_float:
-                        # 操作数a
-                        if self._is_float(operand_a):
-                            if operand_a['type'] == 'VARIABLE':
-                                line = 'flds ' if self._is_float(
-                                    operand_a) else 'filds '
-                                line += operand_a['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                        else:
-                            if operand_a['type'] == 'CONSTANT':
-                                line = 'movl $' + \
-                                    operand_a['operand'] + ', bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                        # 操作数b
-                        if self._is_float(operand_b):
-                            if operand_b['type'] == 'VARIABLE':
-                                line = 'flds ' if self._is_float(
-                                    operand_b) else 'filds '
-                                line += operand_b['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                                line = 'fsub ' + operand_b['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                        else:
-                            if operand_b['type'] == 'CONSTANT':
-                                line = 'movl $' + \
-                                    operand_b['operand'] + ', bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                                line = 'fisub bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                        # 计算结果保存到bss_tmp中
-                        line = 'fstps bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'flds bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        # 计算结果压栈
-                        self.operand_stack.append(
-                            {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                        # 记录到符号表中
-                        self.symbol_table['bss_tmp'] = {
-                            'type': 'IDENTIFIER', 'field_type': 'float'}
-                    else:
-                        print 'not supported yet!'
-                        exit()
-                # 尚未考虑浮点数，只考虑整数乘法
-                elif operator == '*':
-                    if operand_a['type'] == 'ARRAY_ITEM':
-                        line = 'movl ' + operand_a['operand'][1] + r', %edi'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'movl ' + \
-                            operand_a['operand'][0] + r'(, %edi, 4), %eax'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                    else:
-                        print 'other MUL not supported yet!'
-                        exit()
+    # 整数的双目运算，结果保存在寄存器中
+    def _emit_int(self, instruction, operand_a, operand_b):
+        if operand_a['type'] == 'REGISTER':
+            # 结果留在a的寄存器中，沿用a在temps中的记录，寄存器被挪走时结果跟着走
+            register = operand_a['operand']
+            result = operand_a
+        else:
+            source, register = self._int_source(operand_a)
+            register = register or self.allocator.take()
+            line = 'movl ' + source + ', ' + register
+            self.ass_file_handler.insert(line, 'TEXT')
+            result = None
+        source, scratch = self._int_source(operand_b)
+        line = instruction + ' ' + source + ', ' + register
+        self.ass_file_handler.insert(line, 'TEXT')
+        self.allocator.release(scratch)
+        # 计算结果压栈
+        self.operand_stack.append(result or self.allocator.hold(register))
 
-                    if operand_b['type'] == 'ARRAY_ITEM':
-                        line = 'movl ' + operand_b['operand'][1] + r', %edi'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        # 相乘
-                        line = 'mull ' + \
-                            operand_b['operand'][0] + '(, %edi, 4)'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                    else:
-                        print 'other MUL not supported yet!'
-                        exit()
-                    # 将所得结果压入栈
-                    line = r'movl %eax, bss_tmp'
-                    self.ass_file_handler.insert(line, 'TEXT')
-                    self.operand_stack.append(
-                        {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                    self.symbol_table['bss_tmp'] = {
-                        'type': 'IDENTIFIER', 'field_type': 'int'}
-                elif operator == '/':
-                    if contain_float:
-                        line = 'flds ' if self._is_float(
-                            operand_a) else 'filds '
-                        line += operand_a['operand']
-                        self.ass_file_handler.insert(line, 'TEXT')
+    # 结果在%eax中的整数运算，%edx会被改写，prefix为运算之前要执行的指令
+    def _emit_eax(self, instruction, operand_a, operand_b, prefix=()):
+        allocator = self.allocator
+        # a已经在%eax中时结果沿用a在temps中的记录
+        result = operand_a if operand_a['type'] == 'REGISTER' and operand_a['operand'] == '%eax' else None
+        if result is None:
+            allocator.evict('%eax')
+            source, scratch = self._int_source(operand_a)
+            if source != '%eax':
+                line = 'movl ' + source + ', %eax'
+                self.ass_file_handler.insert(line, 'TEXT')
+            allocator.release(scratch)
+            allocator.claim('%eax')
+        allocator.evict('%edx')
+        allocator.claim('%edx')
+        source, scratch = self._int_source(operand_b)
+        # 操作数不能是立即数
+        if operand_b['type'] == 'CONSTANT':
+            scratch = allocator.take()
+            line = 'movl ' + source + ', ' + scratch
+            self.ass_file_handler.insert(line, 'TEXT')
+            source = scratch
+        for line in prefix:
+            self.ass_file_handler.insert(line, 'TEXT')
+        line = instruction + ' ' + source
+        self.ass_file_handler.insert(line, 'TEXT')
+        allocator.release(scratch)
+        allocator.release('%edx')
+        # 计算结果压栈
+        self.operand_stack.append(result or allocator.hold('%eax'))
 
-                        line = 'fdiv ' if self._is_float(
-                            operand_b) else 'fidiv '
-                        line += operand_b['operand']
-                        self.ass_file_handler.insert(line, 'TEXT')
+    # 加法
+    def _emit_add(self, operand_a, operand_b):
+        if self._contain_float(operand_a, operand_b):
+            self._emit_float('+', operand_a, operand_b)
+        # 加法可交换，已经在寄存器中的结果作为目的操作数
+        elif operand_b['type'] == 'REGISTER' and operand_a['type'] != 'REGISTER':
+            self._emit_int('addl', operand_b, operand_a)
+        else:
+            self._emit_int('addl', operand_a, operand_b)
 
-                        # 计算结果保存到bss_tmp中
-                        line = 'fstps bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'flds bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        # 计算结果压栈
-                        self.operand_stack.append(
-                            {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                        # 记录到符号表中
-                        self.symbol_table['bss_tmp'] = {
-                            'type': 'IDENTIFIER', 'field_type': 'float'}
-                    else:
-                        pass
-                elif operator == '>=':
-                    if contain_float:
-                        if self._is_float(operand_a):
-                            if operand_a['type'] == 'VARIABLE':
-                                line = 'flds ' if self._is_float(
-                                    operand_a) else 'filds '
-                                line += operand_a['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                print 'array item not supported when >='
-                                exit()
-                        else:
-                            pass
-
-                        if self._is_float(operand_b):
-                            if operand_b['type'] == 'VARIABLE':
-                                line = 'fcom ' + operand_b['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                print 'array item not supported when >='
-                                exit()
-                        else:
-                            if operand_b['type'] == 'CONSTANT':
-                                line = 'movl $' + \
-                                    operand_b['operand'] + ', bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                                line = 'fcom bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                                line = operator_map[
-                                    '>='] + ' ' + self.labels_ifelse['label_else']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                    else:
-                        pass
-                elif operator == '<':
-                    if contain_float:
-                        pass
-                    else:
-                        line = 'movl $' if operand_a[
-                            'type'] == 'CONSTANT' else 'movl '
-                        line += operand_a['operand'] + ', %edi'
-                        self.ass_file_handler.insert(line, 'TEXT')
+    # 减法
+    def _emit_sub(self, operand_a, operand_b):
+        if self._contain_float(operand_a, operand_b):
+            self._emit_float('-', operand_a, operand_b)
+        else:
+            self._emit_int('subl', operand_a, operand_b)
 
-                        line = 'movl $' if operand_b[
-                            'type'] == 'CONSTANT' else 'movl '
-                        line += operand_b['operand'] + ', %esi'
-                        self.ass_file_handler.insert(line, 'TEXT')
+    # 乘法
+    def _emit_mul(self, operand_a, operand_b):
+        if self._contain_float(operand_a, operand_b):
+            self._emit_float('*', operand_a, operand_b)
+        else:
+            self._emit_eax('mull', operand_a, operand_b)
 
-                        line = r'cmpl %esi, %edi'
-                        self.ass_file_handler.insert(line, 'TEXT')
+    # 除法
+    def _emit_div(self, operand_a, operand_b):
+        if self._contain_float(operand_a, operand_b):
+            self._emit_float('/', operand_a, operand_b)
+        else:
+            self._emit_eax('idivl', operand_a, operand_b, ['cltd'])
 
-                        line = operator_map[
-                            '<'] + ' ' + 'label_' + str(self.label_cnt)
-                        self.ass_file_handler.insert(line, 'TEXT')
+    # 大于等于，不成立时跳转到else
+    def _emit_ge(self, operand_a, operand_b):
+        self._emit_compare('>=', operand_a, operand_b, self.labels_ifelse['label_else'])
 
-            elif operator in single_operators:
-                operand = self.operand_stack.pop()
-                if operator == '++':
-                    line = 'incl ' + operand['operand']
-                    self.ass_file_handler.insert(line, 'TEXT')
-                elif operator == '--':
-                    pass
-            else:
-                print 'operator not supported!'
-                exit()
-        result = {'type': self.operand_stack[0]['type'], 'value': self.operand_stack[
-            0]['operand']} if self.operand_stack else {'type': '', 'value': ''}
-        return result
+    # 小于，不成立时跳出循环
+    def _emit_lt(self, operand_a, operand_b):
+        self._emit_compare('<', operand_a, operand_b, 'label_' + str(self.label_cnt))
+
+    # 比较两个操作数，operator不成立时跳转到label
+    def _emit_compare(self, operator, operand_a, operand_b, label):
+        if self._contain_float(operand_a, operand_b):
+            if self._compare_float(operand_a, operand_b):
+                operator = self.REVERSED_OPERATORS[operator]
+            line = self.OPERATOR_JUMPS[operator] + ' ' + label
+        else:
+            # 第一个操作数放在寄存器中
+            source, register = self._int_source(operand_a)
+            if source[0] != '%':
+                register = register or self.allocator.take()
+                line = 'movl ' + source + ', ' + register
+                self.ass_file_handler.insert(line, 'TEXT')
+                source = register
+            source_b, scratch = self._int_source(operand_b)
+            line = 'cmpl ' + source_b + ', ' + source
+            self.ass_file_handler.insert(line, 'TEXT')
+            self.allocator.release(scratch)
+            self.allocator.release(register)
+            line = self.INT_OPERATOR_JUMPS[operator] + ' ' + label
+        self.ass_file_handler.insert(line, 'TEXT')
+
+    # 栈顶和另一个操作数比较后弹出，x87的状态字经过%ax存入标志位，返回比较时是否交换了操作数
+    def _compare_float(self, operand_a, operand_b):
+        if operand_a['type'] == 'FPU' and operand_b['type'] == 'FPU':
+            # 栈顶的b先存到内存中，a就到了栈顶
+            self.allocator.spill_floats()
+        reverse = False
+        if operand_a['type'] == 'FPU':
+            self.allocator.pop_float()
+            operand = operand_b
+        elif operand_b['type'] == 'FPU':
+            self.allocator.pop_float()
+            operand, reverse = operand_a, True
+        else:
+            self._load_float(operand_a)
+            operand = operand_b
+        source, is_int = self._float_source(operand)
+        line = ('ficompl ' if is_int else 'fcomps ') + source
+        self.ass_file_handler.insert(line, 'TEXT')
+        # fnstsw改写%ax，其中的临时结果先挪走
+        self.allocator.evict('%eax')
+        self.ass_file_handler.insert('fnstsw %ax', 'TEXT')
+        self.ass_file_handler.insert('sahf', 'TEXT')
+        return reverse
+
+    # 尚未实现的双目运算符，和原来一样只弹出操作数
+    def _emit_unsupported(self, operand_a, operand_b):
+        pass
+
+    # 自增，操作数加1之后作为结果
+    def _emit_increment(self, operand):
+        source, scratch = self._int_source(operand)
+        line = 'incl ' + source
+        self.ass_file_handler.insert(line, 'TEXT')
+        self.allocator.release(scratch)
+        self.operand_stack.append(operand)
+
+    # 自减，操作数减1之后作为结果
+    def _emit_decrement(self, operand):
+        source, scratch = self._int_source(operand)
+        line = 'decl ' + source
+        self.ass_file_handler.insert(line, 'TEXT')
+        self.allocator.release(scratch)
+        self.operand_stack.append(operand)
+
+    # 语句块，产生其中要遍历的第一个节点
+    def _sentence(self, node=None):
+        yield node.first_son
 
-    # 处理某一种句型
+    # 处理某一种句型，含有语句块的句型返回一个生成器，依次产生各语句块中要遍历的第一个节点
     def _handler_block(self, node=None):
         if not node:
             return
-        # 下一个将要遍历的节点
-        if node.value in self.sentence_type:
-            # 如果是根节点
-            if node.value == 'Sentence':
-                self.traverse(node.first_son)
-            # include语句
-            elif node.value == 'Include':
-                self._include(node)
-            # 函数声明
-            elif node.value == 'FunctionStatement':
-                self._function_statement(node)
-            # 声明语句
-            elif node.value == 'Statement':
-                self._statement(node)
-            # 函数调用
-            elif node.value == 'FunctionCall':
-                self._function_call(node)
-            # 赋值语句
-            elif node.value == 'Assignment':
-                self._assignment(node)
-            # 控制语句
-            elif node.value == 'Control':
-                if node.type == 'IfElseControl':
-                    self._control_if(node)
-                elif node.type == 'ForControl':
-                    self._control_for(node)
-                elif node.type == 'WhileControl':
-                    self._control_while()
-                else:
-                    print 'control type not supported!'
-                    exit()
-            # 表达式语句
-            elif node.value == 'Expression':
-                self._expression(node)
-            # return语句
-            elif node.value == 'Return':
-                self._return(node)
+        handler = self._node_handlers.get(node.value)
+        if handler is not None:
+            return handler(self, node)
+
+    # 控制语句，按type分派
+    def _control(self, node=None):
+        handler = self._control_handlers.get(node.type)
+        if handler is None:
+            print 'control type not supported!'
+            exit()
+        return handler(self, node)
+
+    # 表达式语句，结果不需要保存
+    def _expression_sentence(self, node=None):
+        self._expression(node)
+        self.allocator.discard()
+
+    # 依次处理node及其之后的兄弟节点，产生其中各语句块要遍历的第一个节点
+    def _sentences(self, node=None):
+        while node:
+            blocks = self._handler_block(node)
+            if blocks is not None:
+                for first in blocks:
+                    yield first
+            node = node.right
+
+    # 遍历节点，语句块的嵌套用显式的栈代替递归
+    def traverse(self, node=None):
+        stack = [self._sentences(node)]
+        while stack:
+            try:
+                first = next(stack[-1])
+            except StopIteration:
+                stack.pop()
             else:
-                print 'sentenct type not supported yet！'
-                exit()
+                # 先遍历完这个语句块，再继续处理外层的语句
+                stack.append(self._sentences(first))
+
+
+class IRAssembler(object):
+    '''由三地址码生成汇编，虚拟寄存器放在%ebx、%esi、%edi或者内存中，%eax、%ecx、%edx只在一条指令内部使用'''
+
+    # 操作码到生成代码的方法的映射
+    EMITTERS = {
+        'function': '_emit_function',
+        'label': '_emit_label',
+        'jump': '_emit_jump',
+        'mov': '_emit_mov',
+        'add': '_emit_arithmetic',
+        'sub': '_emit_arithmetic',
+        'mul': '_emit_arithmetic',
+        'div': '_emit_div',
+        'itof': '_emit_itof',
+        'ftoi': '_emit_ftoi',
+        'load': '_emit_load',
+        'store': '_emit_store',
+        'jl': '_emit_branch',
+        'jge': '_emit_branch',
+        'jg': '_emit_branch',
+        'jle': '_emit_branch',
+        'je': '_emit_branch',
+        'jne': '_emit_branch',
+        'param': '_emit_param',
+        'call': '_emit_call',
+        'exit': '_emit_exit',
+    }
+    # 整数和浮点数运算的指令
+    INT_INSTRUCTIONS = {'add': 'addl', 'sub': 'subl', 'mul': 'imull'}
+    FLOAT_INSTRUCTIONS = {'add': 'fadds', 'sub': 'fsubs', 'mul': 'fmuls', 'div': 'fdivs'}
+    # 条件跳转的指令，浮点数比较之后按无符号数的标志位跳转
+    INT_JUMPS = {'jl': 'jl', 'jge': 'jge', 'jg': 'jg', 'jle': 'jle', 'je': 'je', 'jne': 'jne'}
+    FLOAT_JUMPS = {'jl': 'jb', 'jge': 'jae', 'jg': 'ja', 'jle': 'jbe', 'je': 'je', 'jne': 'jne'}
+    # 保存虚拟寄存器的寄存器，函数调用不会改写
+    REGISTERS = ['%ebx', '%esi', '%edi']
+    # 各数据类型的字节数
+    SIZES = {'int': 4, 'float': 4, 'long': 4, 'char': 1, 'double': 8}
 
-    # 遍历节点
+    def __init__(self, tree, stream=None, peephole=None, dce=True):
+        self.tree = tree
+        # 要生成的汇编文件管理器，和Assembler相同
+        self.ass_file_handler = AssemblerFileHandler(
+            stream, PeepholeOptimizer(peephole) if peephole else None, sweep=dce)
+        # 生成汇编之前是否在三地址码上删除死代码
+        self.dce = dce
+        # 翻译出来的三地址码
+        self.program = None
+        # 虚拟寄存器所在的寄存器或者内存
+        self.homes = {}
+        self.free_registers = list(self.REGISTERS)
+        self.free_slots = []
+        self.slot_cnt = 0
+        # 浮点数常量的标号
+        self.float_labels = {}
+        # 等待call的参数
+        self.parameters = []
+        self._emitters = [getattr(self, self.EMITTERS[name]) for name, text in IRProgram.OPCODES]
+
+    # 翻译语法树并生成汇编
     def traverse(self, node=None):
-        self._handler_block(node)
-        next_node = node.right
-        while next_node:
-            self._handler_block(next_node)
-            next_node = next_node.right
+        self.program = IRBuilder(self.tree).traverse(node)
+        if self.dce:
+            DeadCodeEliminator(self.program).main()
+        self.assemble(self.program)
+
+    # 由三地址码生成汇编
+    def assemble(self, program):
+        self.program = program
+        self._declare()
+        # 每个虚拟寄存器最后一次出现的位置，之后它的寄存器或者内存就可以给别的虚拟寄存器用
+        last = {}
+        values = program.values
+        for array_name in ['dests', 'operands_a', 'operands_b']:
+            for index, value in enumerate(getattr(program, array_name)):
+                if value >= 0 and values[value][0] == 'VREG' and last.get(value, -1) < index:
+                    last[value] = index
+        ends = {}
+        for value, index in last.iteritems():
+            ends.setdefault(index, []).append(value)
+        opcodes = program.opcodes
+        dests = program.dests
+        operands_a = program.operands_a
+        operands_b = program.operands_b
+        names = [name for name, text in IRProgram.OPCODES]
+        for index in xrange(len(opcodes)):
+            dest = dests[index]
+            # 目的操作数先分配，不会和还在用的源操作数在同一个地方
+            if dest >= 0 and values[dest][0] == 'VREG' and dest not in self.homes:
+                self._allocate(dest)
+            self._emitters[opcodes[index]](names[opcodes[index]], dest, operands_a[index], operands_b[index])
+            for value in ends.get(index, ()):
+                self._free(value)
+
+    # 数据段和bss段中的变量、数组和字符串常量
+    def _declare(self):
+        program = self.program
+        for name in program.declarations:
+            item = program.symbols[name]
+            size = self.SIZES.get(item['field_type'], 4)
+            if item['type'] == 'VARIABLE':
+                self.ass_file_handler.insert('.lcomm %s, %d' % (name, size), 'BSS')
+            elif item['values'] is None:
+                self.ass_file_handler.insert('.lcomm %s, %d' % (name, size * int(item['size'])), 'BSS')
+            else:
+                line = name + ': .' + item['field_type'] + ' ' + ', '.join(item['values'])
+                self.ass_file_handler.insert(line, 'DATA')
+                # 初始化列表比数组短时其余元素为0
+                rest = int(item['size']) - len(item['values'])
+                if rest > 0:
+                    self.ass_file_handler.insert('.zero %d' % (size * rest), 'DATA')
+        for label, text in program.strings:
+            self.ass_file_handler.insert(label + ': .asciz "' + text + '"', 'DATA')
+
+    # 给虚拟寄存器分配寄存器，浮点数和寄存器不够时分配内存
+    def _allocate(self, value):
+        if self.program.field_type(value) == 'int' and self.free_registers:
+            self.homes[value] = self.free_registers.pop(0)
+        elif self.free_slots:
+            self.homes[value] = self.free_slots.pop()
+        else:
+            slot = 'bss_spill_' + str(self.slot_cnt)
+            self.slot_cnt += 1
+            self.ass_file_handler.insert('.lcomm ' + slot + ', 4', 'BSS')
+            self.homes[value] = slot
+
+    # 虚拟寄存器不再用到，释放它的寄存器或者内存
+    def _free(self, value):
+        home = self.homes.pop(value, None)
+        if home is None:
+            return
+        if home in self.REGISTERS:
+            self.free_registers.append(home)
+            self.free_registers.sort(key=self.REGISTERS.index)
+        else:
+            self.free_slots.append(home)
+
+    # 操作数在指令中的写法，浮点数常数放在数据段中
+    def _text(self, value):
+        kind, text = self.program.values[value]
+        if kind == 'VREG':
+            return self.homes[value]
+        elif kind == 'CONSTANT':
+            if '.' not in text:
+                return '$' + text
+            label = self.float_labels.get(text)
+            if label is None:
+                label = self.float_labels[text] = 'float_' + str(len(self.float_labels))
+                self.ass_file_handler.insert(label + ': .float ' + text, 'DATA')
+            return label
+        elif kind in ['ADDRESS', 'STRING']:
+            return '$' + text
+        return text
+
+    # 写法是否是内存操作数
+    def _is_memory(self, text):
+        return text[0] not in '%$'
+
+    # 添加到代码段
+    def _insert(self, line):
+        self.ass_file_handler.insert(line, 'TEXT')
+
+    # 整数读到寄存器中，返回该寄存器
+    def _load_int(self, value, register='%eax'):
+        source = self._text(value)
+        if source[0] == '%':
+            return source
+        self._insert('movl ' + source + ', ' + register)
+        return register
+
+    # 整数读到x87栈顶
+    def _load_float(self, value):
+        source = self._text(value)
+        if self.program.field_type(value) == 'float':
+            self._insert('flds ' + source)
+        elif self._is_memory(source):
+            self._insert('fildl ' + source)
+        else:
+            self._insert('movl ' + source + ', bss_tmp')
+            self._insert('fildl bss_tmp')
+
+    # 寄存器中的结果写入目的操作数
+    def _store_int(self, register, dest):
+        target = self._text(dest)
+        if target != register:
+            self._insert('movl ' + register + ', ' + target)
+
+    # 函数开头
+    def _emit_function(self, opcode, dest, operand_a, operand_b):
+        name = self._text(operand_a)
+        self._insert('.globl ' + name)
+        self._insert(name + ':')
+        self._insert('finit')
+
+    # 标号
+    def _emit_label(self, opcode, dest, operand_a, operand_b):
+        self._insert(self._text(operand_a) + ':')
+
+    # 无条件跳转
+    def _emit_jump(self, opcode, dest, operand_a, operand_b):
+        self._insert('jmp ' + self._text(operand_a))
+
+    # 传送，float和int一样按32位传送
+    def _emit_mov(self, opcode, dest, operand_a, operand_b):
+        source = self._text(operand_a)
+        target = self._text(dest)
+        if source == target:
+            return
+        if self._is_memory(source) and self._is_memory(target):
+            source = self._load_int(operand_a)
+        self._insert('movl ' + source + ', ' + target)
+
+    # 加减乘，整数在目的寄存器或者%eax中运算，浮点数在x87栈顶运算
+    def _emit_arithmetic(self, opcode, dest, operand_a, operand_b):
+        if self.program.field_type(dest) == 'float':
+            self._emit_float(opcode, dest, operand_a, operand_b)
+            return
+        target = self._text(dest)
+        register = target if target[0] == '%' else '%eax'
+        source = self._text(operand_a)
+        if source != register:
+            self._insert('movl ' + source + ', ' + register)
+        self._insert(self.INT_INSTRUCTIONS[opcode] + ' ' + self._text(operand_b) + ', ' + register)
+        self._store_int(register, dest)
+
+    # 浮点数的双目运算
+    def _emit_float(self, opcode, dest, operand_a, operand_b):
+        self._load_float(operand_a)
+        self._insert(self.FLOAT_INSTRUCTIONS[opcode] + ' ' + self._text(operand_b))
+        self._insert('fstps ' + self._text(dest))
+
+    # 除法，整数的被除数在%edx:%eax中，除数不能是立即数
+    def _emit_div(self, opcode, dest, operand_a, operand_b):
+        if self.program.field_type(dest) == 'float':
+            self._emit_float(opcode, dest, operand_a, operand_b)
+            return
+        source = self._text(operand_a)
+        if source != '%eax':
+            self._insert('movl ' + source + ', %eax')
+        divisor = self._text(operand_b)
+        if divisor[0] == '$':
+            divisor = self._load_int(operand_b, '%ecx')
+        self._insert('cltd')
+        self._insert('idivl ' + divisor)
+        self._store_int('%eax', dest)
+
+    # 整数转换成浮点数
+    def _emit_itof(self, opcode, dest, operand_a, operand_b):
+        self._load_float(operand_a)
+        self._insert('fstps ' + self._text(dest))
+
+    # 浮点数转换成整数，和C一样向0取整，写法和Assembler相同
+    def _emit_ftoi(self, opcode, dest, operand_a, operand_b):
+        self._load_float(operand_a)
+        target = self._text(dest)
+        destination = target if self._is_memory(target) else 'bss_tmp'
+        for line in Assembler.TRUNCATE_LINES:
+            self._insert(line.format(destination))
+        if destination != target:
+            self._insert('movl bss_tmp, ' + target)
+
+    # 数组元素的写法，下标为常数时直接算出地址
+    def _element(self, array_name, index):
+        name = self._text(array_name)
+        size = self.SIZES[self.program.field_type(array_name)]
+        position = self._text(index)
+        if position[0] == '$':
+            return '%s+%d' % (name, int(position[1:]) * size)
+        return '%s(, %s, %d)' % (name, self._load_int(index, '%ecx'), size)
+
+    # 读数组元素
+    def _emit_load(self, opcode, dest, operand_a, operand_b):
+        source = self._element(operand_a, operand_b)
+        target = self._text(dest)
+        register = target if target[0] == '%' else '%eax'
+        self._insert('movl ' + source + ', ' + register)
+        self._store_int(register, dest)
+
+    # 写数组元素
+    def _emit_store(self, opcode, dest, operand_a, operand_b):
+        source = self._text(operand_b)
+        if self._is_memory(source):
+            source = self._load_int(operand_b)
+        self._insert('movl ' + source + ', ' + self._element(dest, operand_a))
+
+    # 条件跳转，浮点数比较的结果经过%ax读到标志位中
+    def _emit_branch(self, opcode, dest, operand_a, operand_b):
+        label = self._text(dest)
+        if self.program.field_type(operand_a) == 'float':
+            self._load_float(operand_a)
+            self._insert('fcomps ' + self._text(operand_b))
+            self._insert('fnstsw %ax')
+            self._insert('sahf')
+            self._insert(self.FLOAT_JUMPS[opcode] + ' ' + label)
+            return
+        source = self._text(operand_a)
+        source_b = self._text(operand_b)
+        if source[0] == '$' or self._is_memory(source) and self._is_memory(source_b):
+            source = self._load_int(operand_a)
+        self._insert('cmpl ' + source_b + ', ' + source)
+        self._insert(self.INT_JUMPS[opcode] + ' ' + label)
+
+    # 参数在call时倒序压栈
+    def _emit_param(self, opcode, dest, operand_a, operand_b):
+        self.parameters.append(operand_a)
+
+    # 函数调用，float参数和C一样转换成double
+    def _emit_call(self, opcode, dest, operand_a, operand_b):
+        words = 0
+        for parameter in reversed(self.parameters):
+            source = self._text(parameter)
+            if self.program.kind(parameter) != 'ADDRESS' and self.program.field_type(parameter) == 'float':
+                self._insert('flds ' + source)
+                self._insert(r'subl $8, %esp')
+                self._insert(r'fstpl (%esp)')
+                words += 2
+            else:
+                self._insert('pushl ' + source)
+                words += 1
+        self.parameters = []
+        self._insert('call ' + self._text(operand_a))
+        if words:
+            self._insert('add $' + str(words * 4) + ', %esp')
+
+    # main函数返回，退出程序
+    def _emit_exit(self, opcode, dest, operand_a, operand_b):
+        self._insert('pushl ' + self._text(operand_a))
+        self._insert('call exit')
+
+
+class CompilationCache(object):
+    '''保存在磁盘上的编译结果缓存，以源文件内容、编译器版本和选项的hash为键'''
 
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        # 缓存目录
+        self.directory = directory
+        # 缓存的总大小上限，超过时淘汰最久没有用过的结果
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # 其他进程同时创建了该目录
+                if not os.path.isdir(directory):
+                    raise
 
-def lexer():
-    lexer = Lexer()
-    lexer.main()
-    for token in lexer.tokens:
-        print '(%s, %s)' % (token.type, token.value)
+    # 源文件和选项对应的键
+    def key(self, source, options):
+        sha1 = hashlib.sha1(VERSION + '\0' + repr(sorted(options.items())) + '\0')
+        sha1.update(source)
+        return sha1.hexdigest()
 
+    # 缓存文件的路径，kind为缓存的内容，比如S、tokens、tree
+    def _path(self, key, kind):
+        return os.path.join(self.directory, key + '.' + kind)
 
-def parser():
-    parser = Parser()
-    parser.main()
-    parser.display(parser.tree.root)
+    # 取出缓存的内容，没有时返回None
+    def get(self, key, kind):
+        path = self._path(key, kind)
+        try:
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+        except IOError:
+            return None
+        # 更新修改时间，淘汰时按修改时间判断最近是否用过
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
 
+    # 写入缓存，先写临时文件再重命名，多个进程同时写入时读到的总是完整的文件
+    def put(self, key, kind, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        self._commit(tmp_path, key, kind)
+
+    # 将文件复制到缓存中，不读入内存
+    def put_file(self, key, kind, path):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            with open(path, 'rb') as source_file:
+                shutil.copyfileobj(source_file, tmp_file)
+        self._commit(tmp_path, key, kind)
+
+    def _commit(self, tmp_path, key, kind):
+        os.rename(tmp_path, self._path(key, kind))
+        self._evict()
+
+    # 超过大小上限时，按最近使用的时间从旧到新删除缓存文件
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                # 已经被其他进程删除
+                pass
+            total -= size
+
+
+class CompilationSession(object):
+    '''一次编译的源文件和各个阶段的结果，每个阶段在第一次用到时计算，之后直接复用'''
+
+    # 生成汇编的方式，ast直接由语法树生成，ir先翻译成三地址码再生成
+    CODE_GENERATORS = {'ast': Assembler, 'ir': IRAssembler}
+
+    def __init__(self, source, file_name=None, engine='regex', backend='node', cache=None, peephole='all',
+                 fold=True, codegen='ast', dce=True):
+        # 源文件内容，字符串或者mmap
+        self.source = source
+        # 不带后缀的文件名，生成的汇编文件为file_name.S
+        self.file_name = file_name
+        # 词法分析引擎
+        self.engine = engine
+        # 语法树的存储方式
+        self.backend = backend
+        # 编译结果的缓存，CompilationCache
+        self.cache = cache
+        # 窥孔优化的规则，见PeepholeOptimizer.parse
+        self.peephole = peephole
+        # 生成汇编之前是否做常量折叠和常量传播
+        self.fold = fold
+        # 是否删除死代码和没有引用的数据
+        self.dce = dce
+        # 生成汇编的方式，见CODE_GENERATORS
+        if codegen not in self.CODE_GENERATORS:
+            print 'code generator %s not found!' % codegen
+            exit()
+        self.codegen = codegen
+        self._key = None
+        self._tokens = None
+        self._parser = None
+        self._tree = None
+        # 语法树中每个大括号语句块在tokens中的范围
+        self._blocks = None
+        self._assembler = None
+        # 三地址码，IRProgram
+        self._ir = None
+        # 每个函数的(函数名, ControlFlowGraph)
+        self._cfgs = None
+        # 缓存中的汇编代码
+        self._assembly = None
+        # 生成汇编时用到的窥孔优化器，命中缓存时为None
+        self.optimizer = None
+
+    # 影响编译结果的选项
+    def options(self):
+        return {'engine': self.engine, 'peephole': self.peephole, 'fold': self.fold, 'codegen': self.codegen,
+                'dce': self.dce}
+
+    # 在缓存中的键
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = self.cache.key(self.source, self.options())
+        return self._key
+
+    # 词法分析的结果
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            data = self.cache.get(self.key, 'tokens') if self.cache else None
+            if data is not None:
+                self._tokens = CompactTokens.load(self.source, data)
+            else:
+                self._tokens = Lexer(self.source, self.engine).compact_tokens()
+                if self.cache:
+                    self.cache.put(self.key, 'tokens', self._tokens.dump())
+        return self._tokens
+
+    # 完成了语法分析的语法分析器
+    @property
+    def parser(self):
+        if self._parser is None:
+            self._parser = Parser(tokens=self.tokens, backend=self.backend)
+            self._parser.main()
+        return self._parser
+
+    # 语法树
+    @property
+    def tree(self):
+        if self._tree is None:
+            data = self.cache.get(self.key, 'tree') if self.cache else None
+            if data is not None:
+                new_node = ArenaTree().new_node if self.backend == 'arena' else SyntaxTreeNode
+                self._tree = SyntaxTree.load(pickle.loads(data), new_node)
+            else:
+                self._tree = self.parser.tree
+                if self.cache:
+                    self.cache.put(self.key, 'tree', pickle.dumps(self._tree.dump(), 2))
+        return self._tree
+
+    # 修改源文件：在offset处删除deleted个字符并插入inserted，返回修改后的会话
+    # 只重新词法分析受影响的token，只重新语法分析包含修改处的最内层语句块
+    # 新会话接管了这个会话的语法树，这个会话之后用到语法树时会重新分析
+    def edit(self, offset, deleted, inserted):
+        source = self.source[:offset] + inserted + self.source[offset + deleted:]
+        session = CompilationSession(
+            source, self.file_name, self.engine, self.backend, self.cache, self.peephole, self.fold, self.codegen,
+            self.dce)
+        tokens, first, old_end, new_end = Lexer(source, self.engine).relex(self.tokens, offset, deleted, inserted)
+        session._tokens = tokens
+        if self._blocks is None:
+            # 语法树来自缓存时没有语句块的范围，需要完整地分析一次
+            self._tree = self.parser.tree
+            self._blocks = self.parser.blocks
+        # 包含所有被替换的token的最内层语句块
+        block = None
+        for node, (left, right) in self._blocks.iteritems():
+            if left < first and old_end <= right and (block is None or left > self._blocks[block][0]):
+                block = node
+        # 修改处不在任何语句块中，新会话完整地重新分析
+        if block is None:
+            return session
+        left, right = self._blocks[block]
+        shift = new_end - old_end
+        parser = Parser(tokens=tokens, backend=self.backend, arena=getattr(block, 'arena', None))
+        parser.index = left
+        holder = SyntaxTree()
+        holder.root = parser.new_node('Sentence')
+        parser._block(holder)
+        # 大括号的配对发生了变化
+        if parser.index != right + shift + 1:
+            return session
+        tree = self._tree
+        tree.replace(block, holder.root.first_son)
+        # 修改处之后的语句块平移，被替换的语句块及其中的语句块换成新分析出来的
+        blocks = parser.blocks
+        for node, (start, end) in self._blocks.iteritems():
+            if node == block or left < start and end < right:
+                continue
+            if start >= old_end:
+                blocks[node] = (start + shift, end + shift)
+            elif end >= old_end:
+                blocks[node] = (start, end + shift)
+            else:
+                blocks[node] = (start, end)
+        session._tree = tree
+        session._blocks = blocks
+        self._parser = self._tree = self._blocks = None
+        return session
+
+    # 完成了汇编代码生成的汇编器
+    @property
+    def assembler(self):
+        if self._assembler is None:
+            self._assembler = self._new_assembler()
+            self._generate(self._assembler)
+            self.optimizer = self._assembler.ass_file_handler.optimizer
+        return self._assembler
+
+    # 新的汇编器，给出stream时代码段直接写入stream
+    def _new_assembler(self, stream=None):
+        return self.CODE_GENERATORS[self.codegen](
+            self.tree, stream=stream, peephole=PeepholeOptimizer.parse(self.peephole), dce=self.dce)
+
+    # 由语法树翻译出来的三地址码
+    @property
+    def ir(self):
+        if self._ir is None:
+            if self.codegen == 'ir':
+                self._ir = self.assembler.program
+            else:
+                builder = IRBuilder(self.tree)
+                self._generate(builder)
+                self._ir = builder.program
+                if self.dce:
+                    DeadCodeEliminator(self._ir).main()
+        return self._ir
+
+    # 遍历语法树生成汇编或者三地址码，常量折叠对语法树的改写在生成完之后撤销，语法树仍然是分析出来的样子
+    def _generate(self, assembler):
+        folder = ConstantFolder(self.tree).main() if self.fold else None
+        try:
+            assembler.traverse(self.tree.root)
+        finally:
+            if folder:
+                folder.undo()
+
+    # 缓存中的汇编代码，没有时返回None
+    def _cached_assembly(self):
+        if self._assembly is None and self._assembler is None and self.cache:
+            self._assembly = self.cache.get(self.key, 'S')
+        return self._assembly
+
+    # 词法分析结果的每一行
+    def token_lines(self):
+        for token in self.tokens:
+            yield '(%s, %s)' % (token.type, token.value)
+
+    # 语法树的每一行
+    def tree_lines(self):
+        return Parser.display_lines(self.tree.root)
+
+    # 三地址码的每一行
+    def ir_lines(self):
+        return self.ir.lines()
+
+    # 三地址码中每个函数的控制流图
+    @property
+    def cfgs(self):
+        if self._cfgs is None:
+            self._cfgs = [(name, ControlFlowGraph(self.ir, start, end)) for name, start, end in self.ir.functions()]
+        return self._cfgs
+
+    # DOT格式的控制流图的每一行，虚线为支配树
+    def cfg_lines(self):
+        for name, graph in self.cfgs:
+            for line in graph.dot_lines(name, dominators=True):
+                yield line
+
+    # 每个基本块入口和出口处活跃的变量、到达的定值和可用的表达式
+    def dataflow_lines(self):
+        for name, graph in self.cfgs:
+            liveness = Liveness(graph)
+            reaching = ReachingDefinitions(graph)
+            available = AvailableExpressions(graph)
+            yield '%s:' % name
+            for block in xrange(len(graph)):
+                yield 'B%d%s' % (block, '' if graph.reachable(block) else ' (unreachable)')
+                yield '    live in: %s' % ', '.join(liveness.names(liveness.ins[block]))
+                yield '    live out: %s' % ', '.join(liveness.names(liveness.outs[block]))
+                yield '    reaching in: %s' % ', '.join(reaching.names(reaching.ins[block]))
+                yield '    available in: %s' % ', '.join(available.names(available.ins[block]))
+
+    # 汇编代码的每一行
+    def assembly_lines(self):
+        if self._cached_assembly() is not None:
+            return iter(self._assembly.splitlines())
+        lines = self.assembler.ass_file_handler.lines()
+        if self.cache:
+            lines = list(lines)
+            self.cache.put(self.key, 'S', '\n'.join(lines) + '\n')
+        return lines
+
+    # 生成汇编文件，stream为True时代码段边生成边写入文件，数据段和bss段写在代码段之后
+    def write_assembly(self, file_name=None, stream=False):
+        file_name = file_name or self.file_name
+        # 命中缓存时不需要执行任何阶段
+        if self._cached_assembly() is not None:
+            with open(file_name + '.S', 'w+') as ass_file:
+                ass_file.write(self._assembly)
+            return
+        if stream and self._assembler is None:
+            ass_file = open(file_name + '.S', 'w+')
+            assem = self._new_assembler(ass_file)
+            self._generate(assem)
+            assem.ass_file_handler.write(ass_file)
+            self.optimizer = assem.ass_file_handler.optimizer
+            ass_file.close()
+        else:
+            self.assembler.ass_file_handler.generate_ass_file(file_name)
+        if self.cache:
+            self.cache.put_file(self.key, 'S', file_name + '.S')
+
+
+# 读取源文件，尽量映射到内存中而不是复制一份
+def read_source(path):
+    source_file = open(path, 'rb')
+    try:
+        return mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+        # 空文件等不能映射的情况
+        return source_file.read()
+    finally:
+        source_file.close()
+
+
+# 执行func，返回(结果, 错误信息)，出错时的提示信息都打印在标准输出上，收集起来作为错误信息
+def run_captured(func, *args):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    result = error = None
+    try:
+        result = func(*args)
+    except SystemExit:
+        error = sys.stdout.getvalue().strip() or 'compile error!'
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    finally:
+        sys.stdout = stdout
+    return result, error
+
+
+# 编译一个源文件生成汇编文件，返回(路径, 错误信息)，没有错误时错误信息为None
+def compile_file(task):
+    path, engine, stream, cache_dir, peephole, fold, codegen, dce = task
+
+    def run():
+        cache = CompilationCache(cache_dir) if cache_dir else None
+        session = CompilationSession(
+            read_source(path), os.path.splitext(path)[0], engine, cache=cache, peephole=peephole, fold=fold,
+            codegen=codegen, dce=dce)
+        session.write_assembly(stream=stream)
+    return path, run_captured(run)[1]
+
+
+# 读取清单文件中的源文件路径，每行一个，相对路径相对于清单文件所在的目录
+def read_manifest(path):
+    directory = os.path.dirname(path)
+    paths = []
+    for line in open(path, 'r'):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            paths.append(os.path.join(directory, line))
+    return paths
+
+
+# 用多个进程批量编译，每个文件单独编译，出错的文件不影响其他文件
+def batch_compile(paths, jobs=None, engine='regex', stream=False, cache_dir=None, peephole='all', fold=True,
+                  codegen='ast', dce=True):
+    tasks = [(path, engine, stream, cache_dir, peephole, fold, codegen, dce) for path in paths]
+    jobs = jobs or multiprocessing.cpu_count()
+    start = time.time()
+    if jobs == 1:
+        results = map(compile_file, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            # 每次分给一个进程多个文件，减少进程间通信
+            chunk_size = max(1, len(tasks) / (jobs * 4))
+            results = list(pool.imap_unordered(compile_file, tasks, chunk_size))
+        finally:
+            pool.close()
+            pool.join()
+    cost = time.time() - start
+    failures = [(path, error) for path, error in results if error]
+    for path, error in sorted(failures):
+        print '%s: %s' % (path, error.replace('\n', ' '))
+    print 'compiled %d files, %d failed, %.3f s, %.1f files/s' % (
+        len(results), len(failures), cost, len(results) / cost if cost else 0.0)
+    return results
+
+
+class CompileRequestHandler(SocketServer.StreamRequestHandler):
+    '''处理编译服务器的一个连接，每行一个json请求，对每个请求回复一行json'''
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'error': 'bad request!'}
+            else:
+                response = self.server.compile(request)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class CompileServer(SocketServer.UnixStreamServer):
+    '''常驻的编译服务器，监听unix socket，编译请求中的源文件，省去每次启动python的时间'''
+
+    def __init__(self, path, cache=None):
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, CompileRequestHandler)
+        # 所有请求共用的缓存
+        self.cache = cache
+
+    # 编译一个请求，请求中source为源文件内容，actions为-l、-p、-i、-g、-d、-a中的若干个，peephole为窥孔优化的规则，
+    # fold为是否做常量折叠，codegen为生成汇编的方式，dce为是否删除死代码
+    def compile(self, request):
+        def run():
+            session = CompilationSession(
+                request['source'].encode('latin-1'), engine=request.get('engine', 'regex'),
+                cache=self.cache, peephole=request.get('peephole', 'all'), fold=request.get('fold', True),
+                codegen=request.get('codegen', 'ast'), dce=request.get('dce', True))
+            response = {}
+            for action in request.get('actions', ['-a']):
+                if action == '-l':
+                    response['tokens'] = [line.decode('latin-1') for line in session.token_lines()]
+                elif action == '-p':
+                    response['tree'] = [line.decode('latin-1') for line in session.tree_lines()]
+                elif action == '-i':
+                    response['ir'] = [line.decode('latin-1') for line in session.ir_lines()]
+                elif action == '-g':
+                    response['cfg'] = [line.decode('latin-1') for line in session.cfg_lines()]
+                elif action == '-d':
+                    response['dataflow'] = [line.decode('latin-1') for line in session.dataflow_lines()]
+                elif action == '-a':
+                    response['assembly'] = '\n'.join(session.assembly_lines()).decode('latin-1') + '\n'
+            return response
+        response, error = run_captured(run)
+        return {'error': error} if error else response
 
-def assembler():
-    assem = Assembler()
-    assem.traverse(assem.tree.root)
-    assem.ass_file_handler.generate_ass_file()
 
 if __name__ == '__main__':
     try:
-        opts, argvs = getopt.getopt(sys.argv[1:], 's:lpah', ['help'])
+        opts, argvs = getopt.getopt(sys.argv[1:], 's:m:j:e:lpigdah', [
+            'help', 'stream', 'cache=', 'serve=', 'grammar', 'peephole=', 'peephole-report', 'no-fold', 'codegen=', 'no-dce'])
     except:
         print __doc__
         exit()
 
+    # 源文件路径，多于一个时批量编译
+    source_paths = []
+    # 批量编译的进程数，默认为cpu个数
+    jobs = None
+    # 词法分析引擎
+    engine = 'regex'
+    # 代码段是否直接写入文件
+    stream = False
+    # 缓存目录
+    cache_dir = None
+    # 编译服务器监听的socket
+    serve_path = None
+    # 窥孔优化的规则，以及是否报告每条规则删掉的指令条数
+    peephole = 'all'
+    peephole_report = False
+    # 是否做常量折叠和常量传播
+    fold = True
+    dce = True
+    # 生成汇编的方式
+    codegen = 'ast'
+    # 要执行的-l、-p、-i、-g、-a，按给出的顺序执行
+    actions = []
+
     for opt, argv in opts:
         if opt in ['-h', '--h', '--help']:
             print __doc__
             exit()
         elif opt == '-s':
-            file_name = argv.split('.')[0]
-            source_file = open(argv, 'r')
-            content = source_file.read()
-        elif opt == '-l':
-            lexer()
-        elif opt == '-p':
-            parser()
-        elif opt == '-a':
-            assembler()
+            source_paths.append(argv)
+        elif opt == '-m':
+            source_paths.extend(read_manifest(argv))
+        elif opt == '-j':
+            jobs = int(argv)
+        elif opt == '-e':
+            engine = argv
+        elif opt == '--stream':
+            stream = True
+        elif opt == '--cache':
+            cache_dir = argv
+        elif opt == '--serve':
+            serve_path = argv
+        elif opt == '--grammar':
+            PredictTable.generate(report=True)
+            exit()
+        elif opt == '--peephole':
+            peephole = argv
+        elif opt == '--peephole-report':
+            peephole_report = True
+        elif opt == '--no-fold':
+            fold = False
+        elif opt == '--no-dce':
+            dce = False
+        elif opt == '--codegen':
+            codegen = argv
+        elif opt in ['-l', '-p', '-i', '-g', '-d', '-a']:
+            actions.append(opt)
+
+    # 启动编译服务器
+    if serve_path:
+        server = CompileServer(serve_path, CompilationCache(cache_dir) if cache_dir else None)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(serve_path)
+        exit()
+
+    if actions and not source_paths:
+        print __doc__
+        exit()
+
+    # 批量编译，每个文件生成汇编文件
+    if len(source_paths) > 1:
+        if actions != ['-a']:
+            print 'only -a is supported when compiling more than one file!'
+            exit()
+        batch_compile(source_paths, jobs, engine, stream, cache_dir, peephole, fold, codegen, dce)
+        actions = []
+    # 所有选项共用一次词法分析和语法分析的结果
+    elif source_paths:
+        session = CompilationSession(
+            read_source(source_paths[0]), os.path.splitext(source_paths[0])[0], engine,
+            cache=CompilationCache(cache_dir) if cache_dir else None, peephole=peephole, fold=fold,
+            codegen=codegen, dce=dce)
+    for action in actions:
+        if action == '-l':
+            for line in session.token_lines():
+                print line
+        elif action == '-p':
+            for line in session.tree_lines():
+                print line
+        elif action == '-i':
+            for line in session.ir_lines():
+                print line
+        elif action == '-g':
+            for line in session.cfg_lines():
+                print line
+        elif action == '-d':
+            for line in session.dataflow_lines():
+                print line
+        elif action == '-a':
+            session.write_assembly(stream=stream)
+            if peephole_report and session.optimizer:
+                for line in session.optimizer.report_lines():
+                    print line
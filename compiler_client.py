@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Client of the compile server started by `python compiler.py --serve=socket`
+
+Usage: python compiler_client.py -s [file] [options]
+
+Options:
+    -h, --h         show help
+    -s file         import the source file, required!
+    -e engine       lexer engine, regex(default) or char
+    -l              lexer
+    -p              parser
+    -i              intermediate representation, three-address code lowered from the syntax tree
+    -g              control flow graph and dominator tree of the three-address code, in DOT
+    -d              dataflow of each basic block: live variables, reaching definitions and available expressions
+    -a              assembler, the assembler file is in the same path with the source file
+    --socket=path   unix socket of the compile server, default /tmp/compiler.sock
+    --peephole=rules    peephole rules applied to the text section, comma separated, all(default) or none
+    --no-fold       do not fold constant expressions or propagate constants
+    --no-dce        keep unreachable code, dead assignments and unreferenced variables, arrays and strings
+    --codegen=name  generate the assembly from the syntax tree, ast(default), or from the three-address code, ir
+
+Examples:
+    python compiler.py --serve=/tmp/compiler.sock &
+    python compiler_client.py -s source.c -a
+'''
+
+import os
+import sys
+import json
+import socket
+import getopt
+
+
+# 把编译交给编译服务器，输出和直接用compiler.py编译相同
+def client_compile(socket_path, source_path, actions, engine='regex', peephole='all', fold=True, codegen='ast',
+                   dce=True):
+    source = open(source_path, 'rb').read()
+    request = {'source': source.decode('latin-1'), 'actions': actions, 'engine': engine,
+               'peephole': peephole, 'fold': fold, 'codegen': codegen, 'dce': dce}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        client.sendall(json.dumps(request) + '\n')
+        response = json.loads(client.makefile('rb').readline())
+    finally:
+        client.close()
+    if response.get('error'):
+        print response['error'].encode('latin-1')
+        exit()
+    for action in actions:
+        if action == '-l':
+            for line in response['tokens']:
+                print line.encode('latin-1')
+        elif action == '-p':
+            for line in response['tree']:
+                print line.encode('latin-1')
+        elif action == '-i':
+            for line in response['ir']:
+                print line.encode('latin-1')
+        elif action == '-g':
+            for line in response['cfg']:
+                print line.encode('latin-1')
+        elif action == '-d':
+            for line in response['dataflow']:
+                print line.encode('latin-1')
+        elif action == '-a':
+            with open(os.path.splitext(source_path)[0] + '.S', 'w+') as ass_file:
+                ass_file.write(response['assembly'].encode('latin-1'))
+
+if __name__ == '__main__':
+    try:
+        opts, argvs = getopt.getopt(sys.argv[1:], 's:e:lpigdah', ['help', 'socket=', 'peephole=', 'no-fold', 'codegen=', 'no-dce'])
+    except:
+        print __doc__
+        exit()
+
+    source_path = None
+    engine = 'regex'
+    socket_path = '/tmp/compiler.sock'
+    peephole = 'all'
+    fold = True
+    codegen = 'ast'
+    dce = True
+    actions = []
+
+    for opt, argv in opts:
+        if opt in ['-h', '--h', '--help']:
+            print __doc__
+            exit()
+        elif opt == '-s':
+            source_path = argv
+        elif opt == '-e':
+            engine = argv
+        elif opt == '--socket':
+            socket_path = argv
+        elif opt == '--peephole':
+            peephole = argv
+        elif opt == '--no-fold':
+            fold = False
+        elif opt == '--codegen':
+            codegen = argv
+        elif opt == '--no-dce':
+            dce = False
+        elif opt in ['-l', '-p', '-i', '-g', '-d', '-a']:
+            actions.append(opt)
+
+    if not source_path:
+        print __doc__
+        exit()
+    client_compile(socket_path, source_path, actions, engine, peephole, fold, codegen, dce)
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Tests for compiler.py: compile sample programs with different options, run them and check the output
+
+Usage: python test_compiler.py
+
+The assembler files are built with `$CC -m32` (gcc by default). The tests are skipped when it can not build
+a 32-bit program.
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+
+import compiler
+
+# 样例程序，每个程序在所有编译选项下的输出都要和OUTPUTS中的相同
+PROGRAMS = {
+    # 运算结果留在第一个操作数的寄存器中，之后该寄存器被挪走时结果要跟着走
+    'register_reuse': '''#include <stdio.h>
+
+int main() {
+    int b, d, e, i, j;
+    int arr[4] = {1, 2, 3, 4};
+    b = 0;
+    d = 0;
+    for (i = 0; i < 3; i++) {
+        b = b + 0;
+    }
+    e = 7;
+    e = e * (b + (d - (d)));
+    printf("%d\\n", e);
+    j = 2;
+    d = arr[j] * (4 + (7 + (8)));
+    printf("%d\\n", d);
+    return 0;
+}
+''',
+    # 运算符的两个子树都要先于它求值，左右倾斜的表达式树都一样
+    'evaluation_order': '''#include <stdio.h>
+
+int main() {
+    int a, b, c, x, d;
+    a = 42;
+    b = 2;
+    c = 3;
+    x = a * b + c;
+    printf("%d\\n", x);
+    c = a * b + 4 / 2;
+    printf("%d\\n", c);
+    d = 2 * 3 + a;
+    printf("%d\\n", d);
+    return 0;
+}
+''',
+    # 常量在语句之间传播，循环中被赋值的变量不再是常量
+    'constant_folding': '''#include <stdio.h>
+
+int main() {
+    int a, b, c, d, i;
+    a = 3 * 4 + 2;
+    b = a * 2 - 7 / 2;
+    c = (a + b) * (a - b);
+    d = c / 5 + 100 / (2 + 3);
+    printf("%d %d %d %d\\n", a, b, c, d);
+    for (i = 0; i < 3; i++) {
+        a = a + b;
+        b = 2 * 3;
+    }
+    c = a - b * 2;
+    printf("%d %d %d\\n", a, b, c);
+    return 0;
+}
+''',
+    # 循环中的临时结果和循环变量放在寄存器中，整数和浮点数混合运算
+    'loop': '''#include <stdio.h>
+
+int main() {
+    int score[8] = {76, 82, 90, 86, 79, 62, 95, 70};
+    int credit[8] = {2, 2, 1, 2, 2, 3, 1, 4};
+    int n, i, total, weight;
+    float mean, sum;
+    scanf("%d", &n);
+    sum = 0;
+    total = 0;
+    weight = 0;
+    for (i = 0; i < n; i++) {
+        sum = sum + score[i] * credit[i];
+        total = total + score[i];
+        weight = weight + credit[i];
+    }
+    mean = sum / weight;
+    if (mean >= 60) {
+        mean = mean - 60;
+        printf("%d %d %f higher\\n", total, weight, mean);
+    } else {
+        mean = 60 - mean;
+        printf("%d %d %f lower\\n", total, weight, mean);
+    }
+    return 0;
+}
+''',
+    # float变量中的值要舍入到单精度，转换成整数时向0取整
+    'float_arithmetic': '''#include <stdio.h>
+
+int main() {
+    int i, n;
+    float f, g, h;
+    i = 16777217;
+    f = i;
+    g = f + 1;
+    g = g - 16777216;
+    printf("%f\\n", g);
+    n = 7;
+    h = (f / 4) + ((g * 5) / 2);
+    h = h - n;
+    n = h / 1024;
+    printf("%f %d\\n", h, n);
+    return 0;
+}
+''',
+    # 没有用到的变量、数组，死赋值和return之后的语句
+    'dead_code': '''#include <stdio.h>
+
+int main() {
+    int a, b, spare, i;
+    int unused[6];
+    float ratio;
+    a = 5;
+    spare = a * 2;
+    b = a + 1;
+    spare = b * 3;
+    for (i = 0; i < 4; i++) {
+        spare = a + i;
+        b = b + i;
+    }
+    ratio = b;
+    printf("%d %d\\n", a, b);
+    return 0;
+    a = 9;
+    printf("%d\\n", a);
+}
+''',
+    # float和int的比较，条件成立和不成立的分支都要走到
+    'compare': '''#include <stdio.h>
+
+int main() {
+    int a, b, i, n;
+    float f, g, s;
+    f = 5;
+    if (f >= 60) {
+        printf("high\\n");
+    } else {
+        printf("low\\n");
+    }
+    g = 60;
+    if (f >= g) {
+        printf("high\\n");
+    } else {
+        printf("low\\n");
+    }
+    if (g >= f * 2) {
+        printf("high\\n");
+    } else {
+        printf("low\\n");
+    }
+    if ((f * 20) >= (g + 40)) {
+        printf("high\\n");
+    } else {
+        printf("low\\n");
+    }
+    a = 0 - 5;
+    b = 3;
+    if (a >= b) {
+        printf("high\\n");
+    } else {
+        printf("low\\n");
+    }
+    if (b >= a) {
+        printf("high\\n");
+    } else {
+        printf("low\\n");
+    }
+    n = 0;
+    for (i = 0; i < f; i++) {
+        n = n + 1;
+    }
+    for (i = a; i < b; i++) {
+        n = n + 1;
+    }
+    printf("%d\\n", n);
+    return 0;
+}
+''',
+    # while循环，条件中的变量在循环中被修改，循环体中的字符串常量不能占用循环的标号
+    'while': '''#include <stdio.h>
+
+int main() {
+    int n, i, total;
+    float f;
+    scanf("%d", &n);
+    i = 0;
+    total = 0;
+    while (i < n) {
+        total = total + i * i;
+        i = i + 1;
+    }
+    f = 1;
+    while (f < total) {
+        f = f * 2;
+        printf("%f\\n", f);
+    }
+    printf("%d %d %f\\n", i, total, f);
+    return 0;
+}
+''',
+}
+
+# 样例程序的标准输出，和gcc编译出的程序的输出相同，程序都返回0
+OUTPUTS = {
+    'register_reuse': '0\n57\n',
+    'evaluation_order': '87\n86\n48\n',
+    'constant_folding': '14 25 -429 -65\n51 6 39\n',
+    'loop': '570 13 18.230766 higher\n',
+    'float_arithmetic': '0.000000\n4194297.000000 4095\n',
+    'dead_code': '5 12\n',
+    'compare': 'low\nlow\nhigh\nhigh\nlow\nhigh\n13\n',
+    'while': '2.000000\n4.000000\n8.000000\n16.000000\n32.000000\n64.000000\n128.000000\n7 91 128.000000\n',
+}
+
+# 关闭每一种优化的选项
+UNOPTIMIZED = {'fold': False, 'peephole': 'none', 'dce': False}
+
+# 编译选项，两种生成汇编的方式下各有关闭所有优化、只打开一种优化和打开所有优化的选项
+CONFIGURATIONS = []
+for codegen in ['ir', 'ast']:
+    CONFIGURATIONS.append(dict(UNOPTIMIZED, codegen=codegen))
+    for flag in sorted(UNOPTIMIZED):
+        options = dict(UNOPTIMIZED, codegen=codegen)
+        del options[flag]
+        CONFIGURATIONS.append(options)
+    CONFIGURATIONS.append({'codegen': codegen})
+
+# scanf读入的数
+STDIN = '7\n8\n9\n10\n'
+# 程序运行的最长秒数，生成错的循环可能不会结束
+TIMEOUT = 10
+
+
+class OutputTest(unittest.TestCase):
+    '''每个样例程序在各种编译选项下运行的输出都和预期的相同，返回值都为0'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cc = os.environ.get('CC', 'gcc').split()
+        # 先试着编译一个空程序，没有32位的工具链时跳过
+        source = 'int main() {\n    return 0;\n}\n'
+        if self._build(source, {}, 'probe') is None:
+            self.skipTest('%s -m32 can not build the assembler files' % ' '.join(self.cc))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # 按选项编译成可执行文件，返回它的路径，失败时返回None
+    def _build(self, source, options, name):
+        path = os.path.join(self.directory, name)
+        compiler.CompilationSession(source, path, **options).write_assembly()
+        with open(os.devnull, 'w') as devnull:
+            code = subprocess.call(self.cc + ['-m32', '-o', path, path + '.S'], stdout=devnull, stderr=devnull)
+        return path if code == 0 else None
+
+    # 运行可执行文件，返回(输出, 返回值)，超时的程序被杀掉
+    def _run(self, path):
+        process = subprocess.Popen([path], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        timer = threading.Timer(TIMEOUT, process.kill)
+        timer.start()
+        try:
+            output = process.communicate(STDIN)[0]
+        finally:
+            timer.cancel()
+        return output, process.returncode
+
+    # 样例程序在每种选项下的结果和预期的相同
+    def _check(self, name):
+        for i, options in enumerate(CONFIGURATIONS):
+            path = self._build(PROGRAMS[name], options, '%s_%d' % (name, i))
+            self.assertTrue(path, 'can not build %s with %r' % (name, options))
+            self.assertEqual((OUTPUTS[name], 0), self._run(path), '%s with %r' % (name, options))
+
+    def test_register_reuse(self):
+        self._check('register_reuse')
+
+    def test_evaluation_order(self):
+        self._check('evaluation_order')
+
+    def test_constant_folding(self):
+        self._check('constant_folding')
+
+    def test_loop(self):
+        self._check('loop')
+
+    def test_float_arithmetic(self):
+        self._check('float_arithmetic')
+
+    def test_dead_code(self):
+        self._check('dead_code')
+
+    def test_compare(self):
+        self._check('compare')
+
+    def test_while(self):
+        self._check('while')
+
+
+
+class DirectiveTest(unittest.TestCase):
+    '''语法分析只支持include，其余的预处理指令在词法分析时报错'''
+
+    def test_define(self):
+        source = '#define N 5\n#include <stdio.h>\nint main() {\n    return 0;\n}\n'
+        for engine in ['regex', 'char']:
+            result, error = compiler.run_captured(compiler.Lexer(source, engine).main)
+            self.assertEqual('include error!', error)
+
+    def test_include(self):
+        for header in ['<stdio.h>', '"stdio.h"']:
+            source = '#include %s\nint main() {\n    return 0;\n}\n' % header
+            for engine in ['regex', 'char']:
+                lexer = compiler.Lexer(source, engine)
+                result, error = compiler.run_captured(lexer.main)
+                self.assertIsNone(error)
+                self.assertEqual(['#', 'include', header[0], 'stdio.h', header[-1]],
+                                 [token.value for token in lexer.tokens[:5]])
+
+
+if __name__ == '__main__':
+    unittest.main()